@@ -0,0 +1,284 @@
+import asyncio
+import re
+from collections import Counter, defaultdict
+from typing import Union
+
+from .base import BaseGraphStorage, BaseKVStorage, BaseVectorStorage
+from .metrics import NOOP_COLLECTOR, MetricsCollector, increment
+from .utils import logger
+
+_WORD = re.compile(r"\w+")
+_NUMBER = re.compile(r"\d+")
+# legal forms dropped from the end of organization names
+_LEGAL_FORMS = {
+    "AG",
+    "CO",
+    "COMPANY",
+    "CORP",
+    "CORPORATION",
+    "GMBH",
+    "INC",
+    "INCORPORATED",
+    "LLC",
+    "LTD",
+    "LIMITED",
+    "PLC",
+}
+
+
+def normalize_entity_name(name: str) -> str:
+    """Blocking key of an entity name: its words run together, without
+    quotes, punctuation, case, a leading "the" and trailing legal forms, so
+    "OPENAI", "OPENAI INC." and "OPEN AI" share it"""
+    words = _WORD.findall(name.upper())
+    while len(words) > 1 and words[-1] in _LEGAL_FORMS:
+        words.pop()
+    if len(words) > 1 and words[0] == "THE":
+        words.pop(0)
+    return "".join(words)
+
+
+def _known_type(entity_type: Union[str, None]) -> bool:
+    return bool(entity_type) and entity_type.strip('"') != "UNKNOWN"
+
+
+class EntityAliasIndex:
+    """Persistent alias table mapping extracted entity names to the name of
+    their canonical node.
+
+    A new name is an alias of a canonical name with the same blocking key
+    (``normalize_entity_name``). Otherwise it may be a fuzzy alias of a
+    canonical name of the same entity type and with the same numbers in its
+    key, whose character n-grams reach a Jaccard ``similarity``: n-grams
+    alone can't tell "ARTICLE 1234" from "ARTICLE 1235" or "JOHN SMITHSON"
+    from "JOHN SMITHSONS", so such a match is only taken when the canonical
+    entity is among the nearest neighbours of the new one in the entities
+    vector db at an ``embedding_similarity`` (> 0), or, without that check,
+    with ``fuzzy_without_embedding``. Names without a match, or already nodes
+    of the graph, become canonical themselves.
+
+    Every name maps to its canonical name in ``storage``, which is read on
+    first use and flushed with the other storages. The nodes of the graph
+    are canonical names too, so new spellings of entities inserted before
+    the table existed are folded into them.
+    """
+
+    def __init__(
+        self,
+        storage: BaseKVStorage,
+        similarity: float = 0.8,
+        embedding_similarity: float = 0.0,
+        fuzzy_without_embedding: bool = False,
+        ngram_size: int = 3,
+    ):
+        self.storage = storage
+        self.similarity = similarity
+        self.embedding_similarity = embedding_similarity
+        self.fuzzy_without_embedding = fuzzy_without_embedding
+        self.ngram_size = ngram_size
+
+        self._canonical: dict[str, str] = {}
+        self._types: dict[str, str] = {}
+        self._by_key: dict[str, str] = {}
+        self._ngram_counts: dict[str, int] = {}
+        self._ngram_index: dict[str, set[str]] = defaultdict(set)
+        self._loaded = False
+        self._lock = asyncio.Lock()
+
+    def _ngrams(self, key: str) -> set[str]:
+        if len(key) <= self.ngram_size:
+            return {key}
+        return {
+            key[i : i + self.ngram_size] for i in range(len(key) - self.ngram_size + 1)
+        }
+
+    async def _load(self, knowledge_graph_inst: BaseGraphStorage):
+        names = await self.storage.all_keys()
+        for name, entry in zip(names, await self.storage.get_by_ids(names)):
+            if entry is not None:
+                self._apply(name, entry["canonical"], entry.get("entity_type"))
+        try:
+            nodes = await knowledge_graph_inst.all_nodes()
+        except NotImplementedError:
+            logger.warning(
+                f"{type(knowledge_graph_inst).__name__} can't list its nodes, "
+                "entities inserted before the alias table existed get no aliases"
+            )
+            nodes = []
+        for node_id, node_data in nodes:
+            if node_id not in self._canonical:
+                self._apply(node_id, node_id, node_data.get("entity_type"))
+        logger.info(
+            f"Load entity alias table with {len(self._types)} canonical names "
+            f"and {len(self._canonical) - len(self._types)} aliases"
+        )
+
+    def _apply(self, name: str, canonical: str, entity_type: Union[str, None]):
+        self._canonical[name] = canonical
+        if name != canonical:
+            return
+        self._types[name] = entity_type
+        key = normalize_entity_name(name)
+        if not key:
+            return
+        self._by_key.setdefault(key, name)
+        ngrams = self._ngrams(key)
+        self._ngram_counts[name] = len(ngrams)
+        for ngram in ngrams:
+            self._ngram_index[ngram].add(name)
+
+    @property
+    def fuzzy(self) -> bool:
+        return self.embedding_similarity > 0 or self.fuzzy_without_embedding
+
+    def _match(
+        self,
+        name: str,
+        entity_type: Union[str, None],
+        neighbours: dict[str, float],
+    ) -> tuple[Union[str, None], float]:
+        """The canonical name ``name`` is an alias of, with the n-gram
+        similarity of a fuzzy match (1 for the same blocking key)"""
+        key = normalize_entity_name(name)
+        if not key:
+            return None, 0.0
+        if key in self._by_key:
+            return self._by_key[key], 1.0
+        if not self.fuzzy:
+            return None, 0.0
+        ngrams = self._ngrams(key)
+        numbers = _NUMBER.findall(key)
+        shared = Counter(
+            candidate
+            for ngram in ngrams
+            for candidate in self._ngram_index.get(ngram, ())
+        )
+        best, best_similarity = None, 0.0
+        for candidate, count in shared.items():
+            similarity = count / (len(ngrams) + self._ngram_counts[candidate] - count)
+            if similarity < self.similarity or similarity <= best_similarity:
+                continue
+            candidate_type = self._types.get(candidate)
+            if (
+                _known_type(entity_type)
+                and _known_type(candidate_type)
+                and entity_type != candidate_type
+            ):
+                continue
+            # a different number is a different article, version, year...
+            if _NUMBER.findall(normalize_entity_name(candidate)) != numbers:
+                continue
+            if (
+                self.embedding_similarity > 0
+                and neighbours.get(candidate, 0.0) < self.embedding_similarity
+            ):
+                continue
+            best, best_similarity = candidate, similarity
+        return best, best_similarity
+
+    async def resolve(
+        self,
+        entities: dict[str, Union[dict, None]],
+        knowledge_graph_inst: BaseGraphStorage,
+        entity_vdb: BaseVectorStorage = None,
+        collector: MetricsCollector = NOOP_COLLECTOR,
+    ) -> dict[str, str]:
+        """The canonical name of every name in ``entities``, which maps names
+        to one of their extracted records (None for names only seen as the
+        endpoint of a relationship); new names are added to the table"""
+        async with self._lock:
+            if not self._loaded:
+                await self._load(knowledge_graph_inst)
+                self._loaded = True
+            unknown = [name for name in entities if name not in self._canonical]
+            if not unknown:
+                return {name: self._canonical[name] for name in entities}
+            # nodes written before the table existed stay what they are
+            in_graph = await knowledge_graph_inst.get_nodes_batch(unknown)
+            neighbours = {}
+            if entity_vdb is not None and self.embedding_similarity > 0:
+                # queried like the vector db's content, name and description
+                results = await asyncio.gather(
+                    *[
+                        entity_vdb.query(
+                            name + (entities[name] or {}).get("description", ""),
+                            top_k=5,
+                        )
+                        for name in unknown
+                    ]
+                )
+                neighbours = {
+                    name: {
+                        dp["entity_name"]: dp["distance"]
+                        for dp in result
+                        if "entity_name" in dp
+                    }
+                    for name, result in zip(unknown, results)
+                }
+
+            staged = {}
+            for name, node in zip(unknown, in_graph):
+                entity_type = (entities[name] or {}).get("entity_type")
+                canonical, similarity = None, 0.0
+                if node is None:
+                    canonical, similarity = self._match(
+                        name, entity_type, neighbours.get(name, {})
+                    )
+                if canonical is None:
+                    canonical = name
+                elif similarity < 1:
+                    logger.info(
+                        f"Entity {name} is a fuzzy alias of {canonical} "
+                        f"(n-gram similarity {similarity:.2f})"
+                    )
+                else:
+                    logger.debug(f"Entity {name} is an alias of {canonical}")
+                self._apply(name, canonical, entity_type)
+                staged[name] = {"canonical": canonical, "entity_type": entity_type}
+            increment(
+                collector,
+                "merge.entity_aliases",
+                sum(name != entry["canonical"] for name, entry in staged.items()),
+            )
+            await self.storage.upsert(staged)
+            return {name: self._canonical[name] for name in entities}
+
+
+async def canonicalize_extractions(
+    results: list[tuple[dict, dict]],
+    index: EntityAliasIndex,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage = None,
+    collector: MetricsCollector = NOOP_COLLECTOR,
+) -> list[tuple[dict, dict]]:
+    """Per-chunk extraction results with every entity renamed to its
+    canonical name, the records of its aliases merged into it. Relationships
+    between two aliases of one entity are dropped."""
+    entities = {}
+    for maybe_nodes, maybe_edges in results:
+        for name, nodes_data in maybe_nodes.items():
+            entities.setdefault(name, nodes_data[0])
+        for src_id, tgt_id in maybe_edges:
+            entities.setdefault(src_id, None)
+            entities.setdefault(tgt_id, None)
+    canonical = await index.resolve(
+        entities, knowledge_graph_inst, entity_vdb, collector
+    )
+
+    renamed = []
+    for maybe_nodes, maybe_edges in results:
+        nodes = defaultdict(list)
+        for name, nodes_data in maybe_nodes.items():
+            nodes[canonical[name]].extend(
+                {**dp, "entity_name": canonical[name]} for dp in nodes_data
+            )
+        edges = defaultdict(list)
+        for (src_id, tgt_id), edges_data in maybe_edges.items():
+            src_id, tgt_id = canonical[src_id], canonical[tgt_id]
+            if src_id == tgt_id:
+                continue
+            edges[(src_id, tgt_id)].extend(
+                {**dp, "src_id": src_id, "tgt_id": tgt_id} for dp in edges_data
+            )
+        renamed.append((dict(nodes), dict(edges)))
+    return renamed
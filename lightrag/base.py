@@ -1,3 +1,4 @@
+import asyncio
 from dataclasses import dataclass, field
 from typing import TypedDict, Union, Literal, Generic, TypeVar
 
@@ -7,7 +8,20 @@ from .utils import EmbeddingFunc
 
 TextChunkSchema = TypedDict(
     "TextChunkSchema",
-    {"tokens": int, "content": str, "full_doc_id": str, "chunk_order_index": int},
+    {
+        "tokens": int,
+        "content": str,
+        "full_doc_id": str,
+        "chunk_order_index": int,
+        # where the content is in the document, if the chunker knows it
+        "char_start": int,
+        "char_end": int,
+        # new entities and relationships found by the extraction and each
+        # gleaning round, and the LLM tokens they took
+        "extraction_rounds": list[int],
+        "extraction_tokens": int,
+    },
+    total=False,
 )
 
 T = TypeVar("T")
@@ -50,12 +64,19 @@ class BaseVectorStorage(StorageNameSpace):
     async def query(self, query: str, top_k: int) -> list[dict]:
         raise NotImplementedError
 
+    async def query_by_embedding(self, embedding: np.ndarray, top_k: int) -> list[dict]:
+        """Same as query, for an already embedded query"""
+        raise NotImplementedError
+
     async def upsert(self, data: dict[str, dict]):
         """Use 'content' field from value for embedding, use key as id.
         If embedding_func is None, use 'embedding' field from value
         """
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
 
 @dataclass
 class BaseKVStorage(Generic[T], StorageNameSpace):
@@ -79,6 +100,9 @@ class BaseKVStorage(Generic[T], StorageNameSpace):
     async def upsert(self, data: dict[str, T]):
         raise NotImplementedError
 
+    async def delete(self, ids: list[str]):
+        raise NotImplementedError
+
     async def drop(self):
         raise NotImplementedError
 
@@ -112,6 +136,30 @@ class BaseGraphStorage(StorageNameSpace):
     ) -> Union[list[tuple[str, str]], None]:
         raise NotImplementedError
 
+    async def all_nodes(self) -> list[tuple[str, dict]]:
+        """Id and data of every node"""
+        raise NotImplementedError
+
+    # Batched reads, one result per input in input order. These defaults run
+    # the single lookups concurrently; storages where every lookup is a round
+    # trip should override them.
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        return await asyncio.gather(*[self.get_node(n) for n in node_ids])
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return await asyncio.gather(*[self.node_degree(n) for n in node_ids])
+
+    async def get_edges_batch(
+        self, pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        return await asyncio.gather(*[self.get_edge(s, t) for s, t in pairs])
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        return await asyncio.gather(*[self.get_node_edges(n) for n in node_ids])
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         raise NotImplementedError
 
@@ -120,8 +168,22 @@ class BaseGraphStorage(StorageNameSpace):
     ):
         raise NotImplementedError
 
+    # Batched writes, applied in order. These defaults write one at a time;
+    # storages that can write them in a single round trip should override them.
+
+    async def upsert_nodes_batch(self, nodes: dict[str, dict[str, str]]):
+        for node_id, node_data in nodes.items():
+            await self.upsert_node(node_id, node_data)
+
+    async def upsert_edges_batch(self, edges: dict[tuple[str, str], dict[str, str]]):
+        for (source_node_id, target_node_id), edge_data in edges.items():
+            await self.upsert_edge(source_node_id, target_node_id, edge_data)
+
     async def delete_node(self, node_id: str):
         raise NotImplementedError
 
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        raise NotImplementedError
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         raise NotImplementedError("Node embedding is not used in lightrag.")
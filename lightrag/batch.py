@@ -0,0 +1,285 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Iterable, Literal, Union
+
+from .base import (
+    BaseGraphStorage,
+    BaseKVStorage,
+    BaseVectorStorage,
+    TextChunkSchema,
+)
+from .aliases import EntityAliasIndex, canonicalize_extractions
+from .dedup import (
+    NearDuplicateIndex,
+    link_near_duplicates,
+    staged_near_duplicates,
+)
+from .journal import IngestionJournal
+from .metrics import get_collector, increment, metric_tags
+from .operate import (
+    achunk_documents,
+    combine_extracted_results,
+    extract_packed_entities,
+    merge_extracted_entities,
+    pack_chunks,
+    record_chunk_extractions,
+)
+from .pipeline import _iterate_documents
+from .utils import compute_mdhash_id, logger
+
+
+@dataclass
+class DocumentInsertResult:
+    # position of the document in the input
+    index: int
+    doc_id: str
+    status: Literal["inserted", "skipped", "failed"]
+    chunks: int = 0
+    error: Union[str, None] = None
+
+
+@dataclass
+class BatchIngestor:
+    """Insert a (possibly unbounded) stream of documents with bounded
+    concurrency.
+
+    A fixed pool of document workers pulls from the input, so neither tasks
+    nor documents pile up in memory. Chunks of all in-flight documents share
+    one extraction limit, which keeps the LLM busy even when documents are
+    small. Each document succeeds or fails on its own.
+    """
+
+    full_docs: BaseKVStorage
+    text_chunks: BaseKVStorage[TextChunkSchema]
+    chunks_vdb: BaseVectorStorage
+    entities_vdb: BaseVectorStorage
+    relationships_vdb: BaseVectorStorage
+    knowledge_graph_inst: BaseGraphStorage
+    global_config: dict
+    # coroutine function persisting all storages, e.g. LightRAG.aflush
+    checkpoint_func: callable
+    journal: IngestionJournal = None
+    chunk_extractions: BaseKVStorage = None
+    near_duplicates: NearDuplicateIndex = None
+    summary_queue: BaseKVStorage = None
+    alias_index: EntityAliasIndex = None
+
+    max_docs_in_flight: int = 8
+    max_chunks_in_flight: int = 32
+    # flush after this many documents were inserted
+    checkpoint_interval: int = 100
+
+    results: list[DocumentInsertResult] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._chunks_in_flight = 0
+        self._chunk_slots_changed = asyncio.Condition()
+        self._input_lock = asyncio.Lock()
+        self._checkpoint_lock = asyncio.Lock()
+        self._in_flight_docs: set[str] = set()
+        # chunks being inserted, to the event set once their document is done
+        self._in_flight_chunks: dict[str, asyncio.Event] = {}
+        self._since_checkpoint = 0
+        self._dirty = False
+
+    async def run(
+        self, documents: Union[str, Iterable[str], AsyncIterable[str]]
+    ) -> list[DocumentInsertResult]:
+        doc_iter = _enumerate_documents(documents)
+        try:
+            await asyncio.gather(
+                *[self._doc_worker(doc_iter) for _ in range(self.max_docs_in_flight)]
+            )
+        finally:
+            if self._dirty:
+                await self._checkpoint()
+        self.results.sort(key=lambda r: r.index)
+        failed = sum(r.status == "failed" for r in self.results)
+        logger.info(
+            f"[Batch Insert] {len(self.results)} docs processed, {failed} failed"
+        )
+        return self.results
+
+    async def _doc_worker(self, doc_iter):
+        while True:
+            async with self._input_lock:
+                try:
+                    index, doc = await doc_iter.__anext__()
+                except StopAsyncIteration:
+                    return
+            content = doc.strip()
+            doc_key = compute_mdhash_id(content, prefix="doc-")
+            try:
+                result = await self._insert_document(index, doc_key, content)
+            except Exception as e:
+                logger.exception(f"[Batch Insert] failed to insert {doc_key}")
+                result = DocumentInsertResult(
+                    index, doc_key, "failed", error=f"{type(e).__name__}: {e}"
+                )
+            self.results.append(result)
+            if result.status == "inserted":
+                self._since_checkpoint += 1
+                if self._since_checkpoint >= self.checkpoint_interval:
+                    await self._checkpoint()
+
+    async def _insert_document(
+        self, index: int, doc_key: str, content: str
+    ) -> DocumentInsertResult:
+        if doc_key in self._in_flight_docs or not len(
+            await self.full_docs.filter_keys([doc_key])
+        ):
+            return DocumentInsertResult(index, doc_key, "skipped")
+        self._in_flight_docs.add(doc_key)
+        try:
+            pending = await achunk_documents({doc_key: content}, self.global_config)
+            chunk_ids, extracted = [], 0
+            while pending:
+                _add_chunk_keys = await self.text_chunks.filter_keys(list(pending))
+                pending = {k: v for k, v in pending.items() if k in _add_chunk_keys}
+                # a chunk shared with another in-flight document is inserted
+                # by it; if that document fails, it is inserted here after all
+                owners = {
+                    self._in_flight_chunks[k]
+                    for k in pending
+                    if k in self._in_flight_chunks
+                }
+                chunks = {
+                    k: v for k, v in pending.items() if k not in self._in_flight_chunks
+                }
+                self._dirty = True
+                if len(chunks):
+                    chunk_ids.extend(chunks.keys())
+                    extracted += await self._insert_chunks(chunks)
+                if not owners:
+                    break
+                await asyncio.gather(*[owner.wait() for owner in owners])
+                pending = {k: v for k, v in pending.items() if k not in chunks}
+            await self.full_docs.upsert(
+                {doc_key: {"content": content, "chunk_ids": chunk_ids}}
+            )
+            increment(get_collector(self.global_config), "insert.docs")
+            increment(get_collector(self.global_config), "insert.chunks", extracted)
+            return DocumentInsertResult(index, doc_key, "inserted", chunks=extracted)
+        finally:
+            self._in_flight_docs.discard(doc_key)
+
+    async def _insert_chunks(self, chunks: dict[str, TextChunkSchema]) -> int:
+        """Insert chunks no other document is inserting, which wait on it
+        meanwhile; returns the number extracted"""
+        done = asyncio.Event()
+        for k in chunks:
+            self._in_flight_chunks[k] = done
+        try:
+            # the near-duplicates among them are linked, never staged
+            async with staged_near_duplicates(
+                list(chunks.keys()), self.near_duplicates, self.text_chunks
+            ):
+                if self.near_duplicates is not None:
+                    unique_chunks = await link_near_duplicates(
+                        chunks,
+                        self.near_duplicates,
+                        self.text_chunks,
+                        get_collector(self.global_config),
+                    )
+                    # linked near-duplicates are stored already
+                    for k in chunks.keys() - unique_chunks.keys():
+                        del self._in_flight_chunks[k]
+                    chunks = unique_chunks
+                if len(chunks):
+                    await self._process_chunks(chunks)
+                return len(chunks)
+        finally:
+            for k in chunks:
+                del self._in_flight_chunks[k]
+            done.set()
+
+    @asynccontextmanager
+    async def _chunk_slots(self, count: int):
+        """Hold ``count`` of the ``max_chunks_in_flight`` slots, one per chunk
+        of a packed request; a request larger than the limit takes them all"""
+        count = min(count, self.max_chunks_in_flight)
+        async with self._chunk_slots_changed:
+            await self._chunk_slots_changed.wait_for(
+                lambda: self._chunks_in_flight + count <= self.max_chunks_in_flight
+            )
+            self._chunks_in_flight += count
+        try:
+            yield
+        finally:
+            async with self._chunk_slots_changed:
+                self._chunks_in_flight -= count
+                self._chunk_slots_changed.notify_all()
+
+    async def _process_chunks(self, chunks: dict[str, TextChunkSchema]):
+        if self.journal is not None:
+            self.journal.record_chunked(chunks)
+            to_embed = {
+                k: v for k, v in chunks.items() if not self.journal.is_embedded(k)
+            }
+        else:
+            to_embed = chunks
+        if len(to_embed):
+            with metric_tags(stage="embed"):
+                await self.chunks_vdb.upsert(to_embed)
+            if self.journal is not None:
+                self.journal.mark(list(to_embed.keys()), "embedded")
+
+        async def _extract(group: list[tuple[str, TextChunkSchema]]):
+            async with self._chunk_slots(len(group)):
+                return await extract_packed_entities(
+                    group, self.global_config, journal=self.journal
+                )
+
+        results = [
+            result
+            for group_results in await asyncio.gather(
+                *[
+                    _extract(group)
+                    for group in pack_chunks(list(chunks.items()), self.global_config)
+                ]
+            )
+            for result in group_results
+        ]
+        if self.alias_index is not None:
+            results = await canonicalize_extractions(
+                results,
+                self.alias_index,
+                self.knowledge_graph_inst,
+                self.entities_vdb,
+                get_collector(self.global_config),
+            )
+        await record_chunk_extractions(
+            self.chunk_extractions, list(chunks.keys()), results
+        )
+        maybe_nodes, maybe_edges = combine_extracted_results(results)
+        # merges of documents sharing entities take turns on their merge locks
+        await merge_extracted_entities(
+            maybe_nodes,
+            maybe_edges,
+            self.knowledge_graph_inst,
+            self.entities_vdb,
+            self.relationships_vdb,
+            self.global_config,
+            summary_queue=self.summary_queue,
+        )
+        await self.text_chunks.upsert(chunks)
+        if self.journal is not None:
+            self.journal.mark(list(chunks.keys()), "merged")
+        if self.near_duplicates is not None:
+            self.near_duplicates.confirm(list(chunks.keys()))
+
+    async def _checkpoint(self):
+        async with self._checkpoint_lock:
+            self._since_checkpoint = 0
+            self._dirty = False
+            await self.checkpoint_func()
+
+
+async def _enumerate_documents(
+    documents: Union[str, Iterable[str], AsyncIterable[str]],
+):
+    index = 0
+    async for doc in _iterate_documents(documents):
+        yield index, doc
+        index += 1
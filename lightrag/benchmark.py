@@ -0,0 +1,414 @@
+"""End-to-end ingestion and query benchmark with a deterministic local LLM and
+embedder, to measure LightRAG's own overhead without network access.
+
+    python -m lightrag.benchmark --chunks 1000 --llm-latency 0.02 --llm-jitter 0.01
+
+Model calls are answered by ``MockLLM`` and ``MockEmbedding``; their latency
+is simulated with ``asyncio.sleep`` so concurrency limits behave as they
+would against a real endpoint. The tokenizer is still tiktoken, so its
+encoding files must be cached locally.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+from dataclasses import asdict, dataclass, field
+from hashlib import md5
+
+import numpy as np
+
+from .base import QueryParam
+from .lightrag import LightRAG
+from .metrics import InMemoryMetricsCollector
+from .prompt import PROMPTS
+from .utils import EmbeddingFunc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _template_head(name: str) -> str:
+    """Fixed text a prompt built from the template starts with"""
+    return PROMPTS[name].split("{", 1)[0]
+
+
+class MockLLM:
+    """Answers LightRAG prompts deterministically: extraction prompts get valid
+    entity/relationship records for the capitalized names in the chunk, every
+    other prompt a fixed short answer.
+    """
+
+    _NAME = re.compile(r"\b[A-Z][a-z]+[0-9]*\b")
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        seed: int = 0,
+        max_entities_per_chunk: int = 8,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.max_entities_per_chunk = max_entities_per_chunk
+        self.calls = Counter()
+        self.busy_time = defaultdict(float)
+
+    def _classify(self, prompt: str, system_prompt: str) -> str:
+        if system_prompt is not None:
+            return "answer"
+        if prompt.startswith(_template_head("entity_extraction")):
+            return "extract"
+        if prompt == PROMPTS["entiti_continue_extraction"]:
+            return "glean"
+        if prompt == PROMPTS["entiti_if_loop_extraction"]:
+            return "glean_check"
+        if prompt.startswith(_template_head("summarize_entity_descriptions")):
+            return "summarize"
+        if prompt.startswith(_template_head("keywords_extraction")):
+            return "keywords"
+        return "answer"
+
+    async def _sleep(self, prompt: str):
+        if not self.latency and not self.jitter:
+            return
+        # seeded by the prompt, so a run is reproducible whatever the ordering
+        rng = random.Random(md5(f"{self.seed}:{prompt}".encode()).digest())
+        await asyncio.sleep(max(self.latency + rng.uniform(-1, 1) * self.jitter, 0))
+
+    def _extraction(self, text: str) -> str:
+        tuple_delimiter = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        names = sorted(set(self._NAME.findall(text)))[: self.max_entities_per_chunk]
+        records = [
+            f'("entity"{tuple_delimiter}"{name}"{tuple_delimiter}"person"'
+            f'{tuple_delimiter}"{name} is mentioned in the text.")'
+            for name in names
+        ]
+        records += [
+            f'("relationship"{tuple_delimiter}"{a}"{tuple_delimiter}"{b}"'
+            f'{tuple_delimiter}"{a} appears together with {b}."'
+            f'{tuple_delimiter}"co-occurrence"{tuple_delimiter}5)'
+            for a, b in zip(names, names[1:])
+        ]
+        return (
+            PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+            + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+        )
+
+    async def __call__(
+        self, prompt, system_prompt=None, history_messages=[], **kwargs
+    ) -> str:
+        kind = self._classify(prompt, system_prompt)
+        self.calls[kind] += 1
+        start = time.perf_counter()
+        await self._sleep(prompt)
+        self.busy_time[kind] += time.perf_counter() - start
+        if kind == "extract":
+            return self._extraction(prompt.rsplit("Text:", 1)[-1])
+        if kind == "glean":
+            return PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+        if kind == "glean_check":
+            return "no"
+        if kind == "summarize":
+            entity = prompt.split("Entities:", 1)[1].split("\n", 1)[0].strip()
+            return f"{entity} is mentioned in several places of the corpus."
+        if kind == "keywords":
+            names = self._NAME.findall(prompt.rsplit("Query:", 1)[-1])
+            return json.dumps(
+                {"high_level_keywords": ["relations"], "low_level_keywords": names}
+            )
+        return "This is a mock answer."
+
+
+class MockEmbedding:
+    """Unit vectors derived from the md5 of each text"""
+
+    def __init__(self, dim: int = 64, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+        self.busy_time = 0.0
+
+    async def __call__(self, texts: list[str]) -> np.ndarray:
+        self.calls += 1
+        self.texts += len(texts)
+        start = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        vectors = np.stack(
+            [
+                np.random.default_rng(
+                    int.from_bytes(md5(t.encode()).digest()[:8], "little")
+                ).standard_normal(self.dim)
+                for t in texts
+            ]
+        ).astype(np.float32)
+        self.busy_time += time.perf_counter() - start
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_corpus(
+    num_chunks: int, chunks_per_doc: int, chunk_token_size: int, seed: int = 0
+) -> list[str]:
+    """Documents of short sentences about a zipf-like population of named
+    entities, sized to produce about ``num_chunks`` chunks in total.
+    """
+    rng = random.Random(seed)
+    population = [f"Person{i}" for i in range(max(num_chunks, 100))]
+    places = [f"Place{i}" for i in range(max(num_chunks // 10, 10))]
+    # cumulative once, rather than by every choices() call
+    cum_weights = list(accumulate(1 / (i + 1) for i in range(len(population))))
+    verbs = ["met", "called", "visited", "argued with", "worked for", "helped"]
+    # a sentence is about a dozen tokens
+    sentences_per_doc = max(chunks_per_doc * chunk_token_size // 12, 1)
+    docs = []
+    for doc_index in range(max(num_chunks // chunks_per_doc, 1)):
+        sentences = []
+        for _ in range(sentences_per_doc):
+            a, b = rng.choices(population, cum_weights=cum_weights, k=2)
+            sentences.append(
+                f"{a} {rng.choice(verbs)} {b} near {rng.choice(places)} "
+                f"in year {rng.randint(1900, 2024)}."
+            )
+        docs.append(f"Document {doc_index}. " + " ".join(sentences))
+    return docs
+
+
+def _peak_rss_mb() -> float:
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 / (1024 if os.uname().sysname == "Darwin" else 1)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    return float(np.percentile(values, q))
+
+
+@dataclass
+class BenchmarkConfig:
+    chunks: int = 1000
+    chunks_per_doc: int = 10
+    chunk_token_size: int = 1200
+    insert_mode: str = "insert"  # insert | batch | stream
+    insert_batch_docs: int = 10
+    queries: int = 20
+    query_modes: tuple = ("local", "global", "hybrid", "naive")
+    llm_latency: float = 0.0
+    llm_jitter: float = 0.0
+    llm_max_async: int = 16
+    embedding_latency: float = 0.0
+    embedding_dim: int = 64
+    seed: int = 0
+    working_dir: str = None
+    # extra LightRAG fields, e.g. {"storage_num_shards": 4}
+    rag_kwargs: dict = field(default_factory=dict)
+
+
+async def run_benchmark(config: BenchmarkConfig) -> dict:
+    working_dir = config.working_dir or tempfile.mkdtemp(prefix="lightrag-bench-")
+    os.makedirs(working_dir, exist_ok=True)
+    llm = MockLLM(
+        latency=config.llm_latency, jitter=config.llm_jitter, seed=config.seed
+    )
+    embedder = MockEmbedding(dim=config.embedding_dim, latency=config.embedding_latency)
+    # times chunking inside the insert
+    metrics = InMemoryMetricsCollector()
+    try:
+        rag = LightRAG(
+            working_dir=working_dir,
+            llm_model_func=llm,
+            llm_model_max_async=config.llm_max_async,
+            embedding_func=EmbeddingFunc(
+                embedding_dim=config.embedding_dim, max_token_size=8192, func=embedder
+            ),
+            chunk_token_size=config.chunk_token_size,
+            enable_llm_cache=False,
+            log_level=logging.WARNING,
+            metrics_collector=metrics,
+            **config.rag_kwargs,
+        )
+        docs = make_corpus(
+            config.chunks, config.chunks_per_doc, config.chunk_token_size, config.seed
+        )
+        stage_time = defaultdict(float)
+
+        insert_done = rag._insert_done
+
+        async def _timed_insert_done(*args, **kwargs):
+            flush_start = time.perf_counter()
+            await insert_done(*args, **kwargs)
+            stage_time["flush"] += time.perf_counter() - flush_start
+
+        rag._insert_done = _timed_insert_done
+
+        start = time.perf_counter()
+        if config.insert_mode == "batch":
+            await rag.ainsert_batch(docs)
+        elif config.insert_mode == "stream":
+            await rag.ainsert_stream(docs)
+        else:
+            for i in range(0, len(docs), config.insert_batch_docs):
+                await rag.ainsert(docs[i : i + config.insert_batch_docs])
+        insert_time = time.perf_counter() - start
+        num_chunks = int(metrics.counter("insert.chunks"))
+        stage_time["chunking"] = sum(
+            h["sum"]
+            for h in metrics.snapshot()["histograms"]
+            if h["name"] == "insert.chunking_latency"
+        )
+
+        rng = random.Random(config.seed)
+        names = [f"Person{rng.randint(0, 99)}" for _ in range(config.queries)]
+        latencies = defaultdict(list)
+        start = time.perf_counter()
+        for name in names:
+            for mode in config.query_modes:
+                query_start = time.perf_counter()
+                await rag.aquery(
+                    f"What do we know about {name}?",
+                    QueryParam(mode=mode, only_need_context=True),
+                )
+                latencies[mode].append(time.perf_counter() - query_start)
+        query_time = time.perf_counter() - start
+    finally:
+        if config.working_dir is None:
+            shutil.rmtree(working_dir, ignore_errors=True)
+
+    all_latencies = [t for ts in latencies.values() for t in ts]
+    for kind, busy in llm.busy_time.items():
+        stage_time[f"llm_{kind}"] = busy
+    stage_time["embedding"] = embedder.busy_time
+    return {
+        "config": asdict(config),
+        "docs": len(docs),
+        "chunks": num_chunks,
+        "insert_seconds": insert_time,
+        "docs_per_second": len(docs) / insert_time,
+        "chunks_per_second": num_chunks / insert_time,
+        "query_seconds": query_time,
+        "query_p50_ms": _percentile(all_latencies, 50) * 1000,
+        "query_p99_ms": _percentile(all_latencies, 99) * 1000,
+        "query_p50_ms_by_mode": {
+            m: _percentile(ts, 50) * 1000 for m, ts in latencies.items()
+        },
+        "query_p99_ms_by_mode": {
+            m: _percentile(ts, 99) * 1000 for m, ts in latencies.items()
+        },
+        "peak_rss_mb": _peak_rss_mb(),
+        # summed over concurrent calls, so stages may add up to more than the
+        # wall time
+        "stage_seconds": dict(stage_time),
+        "llm_calls": dict(llm.calls),
+        "embedding_calls": embedder.calls,
+        "embedded_texts": embedder.texts,
+    }
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"docs:            {report['docs']}",
+        f"chunks:          {report['chunks']}",
+        f"insert:          {report['insert_seconds']:.2f}s "
+        f"({report['docs_per_second']:.2f} docs/s, "
+        f"{report['chunks_per_second']:.2f} chunks/s)",
+        f"query p50/p99:   {report['query_p50_ms']:.1f} / "
+        f"{report['query_p99_ms']:.1f} ms",
+    ]
+    for mode, p50 in report["query_p50_ms_by_mode"].items():
+        p99 = report["query_p99_ms_by_mode"][mode]
+        lines.append(f"  {mode:<14} {p50:.1f} / {p99:.1f} ms")
+    lines.append(f"peak RSS:        {report['peak_rss_mb']:.1f} MB")
+    lines.append("stage time (s, summed over concurrent calls):")
+    for stage, seconds in sorted(report["stage_seconds"].items()):
+        lines.append(f"  {stage:<14} {seconds:.3f}")
+    lines.append(f"llm calls:       {report['llm_calls']}")
+    lines.append(
+        f"embedding:       {report['embedding_calls']} calls, "
+        f"{report['embedded_texts']} texts"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    defaults = BenchmarkConfig()
+    parser.add_argument("--chunks", type=int, default=defaults.chunks)
+    parser.add_argument("--chunks-per-doc", type=int, default=defaults.chunks_per_doc)
+    parser.add_argument(
+        "--chunk-token-size", type=int, default=defaults.chunk_token_size
+    )
+    parser.add_argument(
+        "--insert-mode",
+        choices=["insert", "batch", "stream"],
+        default=defaults.insert_mode,
+    )
+    parser.add_argument(
+        "--insert-batch-docs",
+        type=int,
+        default=defaults.insert_batch_docs,
+        help="documents per ainsert call in --insert-mode insert",
+    )
+    parser.add_argument("--queries", type=int, default=defaults.queries)
+    parser.add_argument("--query-modes", nargs="+", default=list(defaults.query_modes))
+    parser.add_argument("--llm-latency", type=float, default=defaults.llm_latency)
+    parser.add_argument("--llm-jitter", type=float, default=defaults.llm_jitter)
+    parser.add_argument("--llm-max-async", type=int, default=defaults.llm_max_async)
+    parser.add_argument(
+        "--embedding-latency", type=float, default=defaults.embedding_latency
+    )
+    parser.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument(
+        "--working-dir", help="keep the index here instead of a temporary dir"
+    )
+    parser.add_argument(
+        "--rag-kwargs",
+        type=json.loads,
+        default={},
+        help="extra LightRAG fields as JSON, e.g. '{\"storage_num_shards\": 4}'",
+    )
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    config = BenchmarkConfig(
+        chunks=args.chunks,
+        chunks_per_doc=args.chunks_per_doc,
+        chunk_token_size=args.chunk_token_size,
+        insert_mode=args.insert_mode,
+        insert_batch_docs=args.insert_batch_docs,
+        queries=args.queries,
+        query_modes=tuple(args.query_modes),
+        llm_latency=args.llm_latency,
+        llm_jitter=args.llm_jitter,
+        llm_max_async=args.llm_max_async,
+        embedding_latency=args.embedding_latency,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+        working_dir=args.working_dir,
+        rag_kwargs=args.rag_kwargs,
+    )
+    report = asyncio.run(run_benchmark(config))
+    print(format_report(report))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import re
+from typing import Union
+
+from .utils import Tokenizer
+
+
+def token_size_windows(
+    tokens: list[int], overlap_token_size=128, max_token_size=1024
+) -> list[tuple[int, int]]:
+    return [
+        (start, min(start + max_token_size, len(tokens)))
+        for start in range(0, len(tokens), max_token_size - overlap_token_size)
+    ]
+
+
+# Content-defined chunking: a boundary falls after a token where the rolling
+# hash of the last _CDC_WINDOW tokens hits a fixed pattern.
+_CDC_WINDOW = 16
+_CDC_BASE = 1_000_003
+_CDC_MOD = (1 << 61) - 1
+
+
+def content_defined_windows(
+    tokens: list[int], overlap_token_size=128, max_token_size=1024
+) -> list[tuple[int, int]]:
+    """Chunk at boundaries that depend only on the text around them, so an
+    edit moves at most the boundaries next to it and every other chunk keeps
+    its content (and id). Boundaries are between half and all of
+    max_token_size - overlap_token_size tokens apart, about three quarters of
+    it on average, so a chunk with its overlap never exceeds max_token_size.
+    """
+    span = max(max_token_size - overlap_token_size, 1)
+    min_size = max(span // 2, 1)
+    divisor = max(span // 4, 1)
+    window_power = pow(_CDC_BASE, _CDC_WINDOW, _CDC_MOD)
+
+    boundaries = []
+    start, rolling_hash = 0, 0
+    for i, token in enumerate(tokens):
+        rolling_hash = (rolling_hash * _CDC_BASE + token) % _CDC_MOD
+        if i >= _CDC_WINDOW:
+            rolling_hash = (
+                rolling_hash - tokens[i - _CDC_WINDOW] * window_power
+            ) % _CDC_MOD
+        size = i + 1 - start
+        if size >= span or (size >= min_size and rolling_hash % divisor == 0):
+            boundaries.append(i + 1)
+            start = i + 1
+    if start < len(tokens):
+        boundaries.append(len(tokens))
+
+    # the overlap is taken from before the previous boundary, which is just
+    # as stable as the boundary itself; it is cut short when it alone is over
+    # max_token_size
+    return [
+        (max(start - overlap_token_size, end - max_token_size, 0), end)
+        for start, end in zip([0] + boundaries[:-1], boundaries)
+    ]
+
+
+def _chunk(content: str, start: int, end: int, tokens: int, index: int) -> dict:
+    """The chunk of ``content[start:end]`` without surrounding whitespace;
+    ``char_start`` and ``char_end`` locate it in the document"""
+    text = content[start:end]
+    stripped = text.strip()
+    char_start = start + len(text) - len(text.lstrip())
+    return {
+        "tokens": tokens,
+        "content": stripped,
+        "chunk_order_index": index,
+        "char_start": char_start,
+        "char_end": char_start + len(stripped),
+    }
+
+
+class Chunker:
+    """Splits documents into chunks of at most ``max_token_size`` tokens of
+    ``tokenizer``, each overlapping the previous one by up to
+    ``overlap_token_size`` tokens.
+
+    Chunks are dicts with their ``content``, ``tokens`` and
+    ``chunk_order_index``, and, where the tokenizer allows it, the
+    ``char_start`` and ``char_end`` of the content in the document. Subclass
+    it and add it with ``register_chunker`` to make it a ``chunk_strategy``.
+    """
+
+    def __init__(
+        self, tokenizer: Tokenizer, max_token_size=1024, overlap_token_size=128
+    ):
+        self.tokenizer = tokenizer
+        self.max_token_size = max_token_size
+        self.overlap_token_size = overlap_token_size
+
+    def chunk(self, content: str) -> list[dict]:
+        raise NotImplementedError
+
+    def chunk_batch(self, contents: list[str]) -> list[list[dict]]:
+        return [self.chunk(content) for content in contents]
+
+
+class TokenWindowChunker(Chunker):
+    """Cuts the token sequence of a document into windows, ignoring the
+    structure of the text"""
+
+    def windows(self, tokens: list[int]) -> list[tuple[int, int]]:
+        raise NotImplementedError
+
+    def chunk(self, content: str) -> list[dict]:
+        return self.chunk_batch([content])[0]
+
+    def chunk_batch(self, contents: list[str]) -> list[list[dict]]:
+        return [
+            self._chunks_from_windows(content, tokens, offsets)
+            for content, (tokens, offsets) in zip(
+                contents, self.tokenizer.encode_batch_with_offsets(contents)
+            )
+        ]
+
+    def _chunks_from_windows(
+        self, content: str, tokens: list[int], offsets: Union[list[int], None]
+    ) -> list[dict]:
+        windows = self.windows(tokens)
+        if offsets is not None:
+            # slice the text itself instead of decoding every window again
+            offsets = offsets + [len(content)]
+            return [
+                _chunk(content, offsets[start], offsets[end], end - start, index)
+                for index, (start, end) in enumerate(windows)
+            ]
+        chunk_contents = self.tokenizer.decode_batch(
+            [tokens[start:end] for start, end in windows]
+        )
+        return [
+            {
+                "tokens": end - start,
+                "content": chunk_content.strip(),
+                "chunk_order_index": index,
+            }
+            for index, ((start, end), chunk_content) in enumerate(
+                zip(windows, chunk_contents)
+            )
+        ]
+
+
+class TokenSizeChunker(TokenWindowChunker):
+    """Fixed windows of max_token_size tokens"""
+
+    def windows(self, tokens: list[int]) -> list[tuple[int, int]]:
+        return token_size_windows(tokens, self.overlap_token_size, self.max_token_size)
+
+
+class ContentDefinedChunker(TokenWindowChunker):
+    """Boundaries picked by a rolling hash of the text, so an edited document
+    keeps the chunks (and their extractions) of unchanged parts"""
+
+    def windows(self, tokens: list[int]) -> list[tuple[int, int]]:
+        return content_defined_windows(
+            tokens, self.overlap_token_size, self.max_token_size
+        )
+
+
+_SENTENCE_END = r"(?<=[.!?。！？])\s+"
+
+
+class RecursiveChunker(Chunker):
+    """Splits the text at the first of ``separators`` (regular expressions,
+    the text is cut at the end of each match) and every piece that is still
+    too long at the next one, down to token windows. The pieces are then
+    packed in order into chunks of up to max_token_size tokens, so chunks
+    end at the coarsest boundary that fits.
+    """
+
+    separators = [r"\n\s*\n", r"\n", _SENTENCE_END, r"\s+"]
+
+    def chunk(self, content: str) -> list[dict]:
+        pieces = self._split(content, [(0, len(content))], 0)
+        spans = self._pack(pieces)
+        spans = [(start, end) for start, end in spans if content[start:end].strip()]
+        chunk_tokens = self.tokenizer.encode_batch(
+            [content[start:end].strip() for start, end in spans]
+        )
+        return [
+            _chunk(content, start, end, len(tokens), index)
+            for index, ((start, end), tokens) in enumerate(zip(spans, chunk_tokens))
+        ]
+
+    def _split(
+        self, content: str, spans: list[tuple[int, int]], level: int
+    ) -> list[tuple[int, int, int]]:
+        """``(start, end, tokens)`` of pieces of the spans that fit into a
+        chunk"""
+        counts = self.tokenizer.encode_batch([content[a:b] for a, b in spans])
+        pieces = []
+        for (start, end), tokens in zip(spans, counts):
+            if len(tokens) <= self.max_token_size:
+                pieces.append((start, end, len(tokens)))
+            elif level < len(self.separators):
+                cuts = [start]
+                for match in re.finditer(self.separators[level], content[start:end]):
+                    if cuts[-1] < start + match.end() < end:
+                        cuts.append(start + match.end())
+                cuts.append(end)
+                pieces.extend(
+                    self._split(content, list(zip(cuts, cuts[1:])), level + 1)
+                )
+            else:
+                pieces.extend(self._token_windows(content, start, end))
+        return pieces
+
+    def _token_windows(
+        self, content: str, start: int, end: int
+    ) -> list[tuple[int, int, int]]:
+        """A span without any separator, cut into windows of max_token_size
+        tokens"""
+        [(tokens, offsets)] = self.tokenizer.encode_batch_with_offsets(
+            [content[start:end]]
+        )
+        if offsets is None:
+            # cut at the same share of characters instead
+            offsets = [
+                start + (end - start) * i // len(tokens) for i in range(len(tokens))
+            ]
+        else:
+            offsets = [start + offset for offset in offsets]
+        offsets.append(end)
+        return [
+            (offsets[a], offsets[b], b - a)
+            for a, b in token_size_windows(tokens, 0, self.max_token_size)
+        ]
+
+    def _pack(self, pieces: list[tuple[int, int, int]]) -> list[tuple[int, int]]:
+        spans = []
+        first = 0
+        while first < len(pieces):
+            last, tokens = first, pieces[first][2]
+            while (
+                last + 1 < len(pieces)
+                and tokens + pieces[last + 1][2] <= self.max_token_size
+            ):
+                last += 1
+                tokens += pieces[last][2]
+            spans.append((pieces[first][0], pieces[last][1]))
+            if last + 1 == len(pieces):
+                break
+            # the next chunk repeats the trailing pieces of this one that fit
+            # into the overlap, but always starts after this one does
+            next_first, overlap = last + 1, 0
+            while (
+                next_first - 1 > first
+                and overlap + pieces[next_first - 1][2] <= self.overlap_token_size
+            ):
+                next_first -= 1
+                overlap += pieces[next_first][2]
+            first = next_first
+        return spans
+
+
+class SentenceChunker(RecursiveChunker):
+    """Packs whole paragraphs, or whole sentences of paragraphs that are too
+    long, into chunks"""
+
+    separators = [r"\n\s*\n", _SENTENCE_END]
+
+
+class MarkdownChunker(RecursiveChunker):
+    """Packs whole markdown sections into chunks, splitting sections that are
+    too long at their subsections, then paragraphs and sentences"""
+
+    separators = [
+        r"(?m)^(?=#\s)",
+        r"(?m)^(?=##\s)",
+        r"(?m)^(?=###\s)",
+        r"(?m)^(?=#{4,6}\s)",
+    ] + RecursiveChunker.separators
+
+
+CHUNKERS: dict[str, type[Chunker]] = {
+    "token_size": TokenSizeChunker,
+    "content_defined": ContentDefinedChunker,
+    "sentence": SentenceChunker,
+    "markdown": MarkdownChunker,
+    "recursive": RecursiveChunker,
+}
+
+
+def register_chunker(name: str, chunker_class: type[Chunker]):
+    """Make ``chunker_class`` available as ``chunk_strategy=name``"""
+    CHUNKERS[name] = chunker_class
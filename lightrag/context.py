@@ -0,0 +1,108 @@
+from dataclasses import dataclass, field
+from .utils import list_of_list_to_csv
+
+
+@dataclass
+class ContextEntity:
+    entity_name: str
+    entity_type: str
+    description: str
+    rank: int
+    tokens: int
+
+    @property
+    def id(self) -> str:
+        return self.entity_name
+
+
+@dataclass
+class ContextRelation:
+    src_id: str
+    tgt_id: str
+    description: str
+    keywords: str
+    weight: float
+    rank: int
+    tokens: int
+
+    @property
+    def id(self) -> tuple[str, str]:
+        # relationships are undirected
+        return tuple(sorted((self.src_id, self.tgt_id)))
+
+
+@dataclass
+class ContextTextUnit:
+    id: str
+    content: str
+    tokens: int
+
+
+@dataclass
+class QueryContext:
+    """What a query retrieved, kept as records until it's rendered into the
+    prompt, so contexts can be merged without parsing their text back.
+    Each record carries the token count of its description or content, for
+    the tokenizer of the instance that built it."""
+
+    entities: list[ContextEntity] = field(default_factory=list)
+    relations: list[ContextRelation] = field(default_factory=list)
+    text_units: list[ContextTextUnit] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return sum(
+            item.tokens for item in self.entities + self.relations + self.text_units
+        )
+
+    def merge(self, other: "QueryContext") -> "QueryContext":
+        """Records of both contexts, this one's first, each id only once"""
+        return QueryContext(
+            entities=_dedupe(self.entities + other.entities),
+            relations=_dedupe(self.relations + other.relations),
+            text_units=_dedupe(self.text_units + other.text_units),
+        )
+
+    def render(self) -> str:
+        entities_context = list_of_list_to_csv(
+            [["id", "entity", "type", "description", "rank"]]
+            + [
+                [i, e.entity_name, e.entity_type, e.description, e.rank]
+                for i, e in enumerate(self.entities)
+            ]
+        )
+        relations_context = list_of_list_to_csv(
+            [["id", "source", "target", "description", "keywords", "weight", "rank"]]
+            + [
+                [i, r.src_id, r.tgt_id, r.description, r.keywords, r.weight, r.rank]
+                for i, r in enumerate(self.relations)
+            ]
+        )
+        text_units_context = list_of_list_to_csv(
+            [["id", "content"]]
+            + [[i, t.content] for i, t in enumerate(self.text_units)]
+        )
+        return f"""
+-----Entities-----
+```csv
+{entities_context}
+```
+-----Relationships-----
+```csv
+{relations_context}
+```
+-----Sources-----
+```csv
+{text_units_context}
+```
+"""
+
+
+def _dedupe(items: list) -> list:
+    seen = set()
+    unique = []
+    for item in items:
+        if item.id not in seen:
+            seen.add(item.id)
+            unique.append(item)
+    return unique
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import zlib
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Iterable, Union
+
+import numpy as np
+
+from .base import BaseKVStorage
+from .metrics import NOOP_COLLECTOR, MetricsCollector, increment
+from .utils import logger
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r"\w+")
+
+
+def _lsh_bands(threshold: float, num_perm: int) -> int:
+    """Number of bands whose S-curve ``(1 - (1 - s^rows)^bands)`` turns at
+    the threshold, so chunks at the threshold are found as candidates"""
+    candidates = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    return min(
+        candidates,
+        key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold),
+    )
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash/LSH index of chunk contents.
+
+    Chunks are compared by the Jaccard similarity of their word shingles,
+    estimated from ``num_perm`` MinHash values; a chunk at or above
+    ``threshold`` to an indexed chunk is its near-duplicate and is linked to
+    that twin instead of being indexed itself. The signatures of indexed
+    chunks and the links are kept in a JSON-lines file.
+
+    Chunks being inserted are only ``stage``d: they are twins for the other
+    chunks of the same insert, but enter the index with ``confirm`` once they
+    are merged, or are dropped with ``discard`` if their insert fails.
+    Confirmed changes are only written by ``commit``, after the storages
+    holding the chunks were flushed.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        threshold: float = 0.9,
+        num_perm: int = 128,
+        shingle_size: int = 5,
+        compact_ratio: int = 2,
+    ):
+        self._file_name = file_name
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._compact_ratio = compact_ratio
+        self._bands = _lsh_bands(threshold, num_perm)
+        self._rows = num_perm // self._bands
+        generator = np.random.RandomState(1)
+        self._a = generator.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+        self._signatures: dict[str, np.ndarray] = {}
+        self._buckets: dict[tuple, set[str]] = defaultdict(set)
+        self._twins: dict[str, str] = {}
+        # chunks being inserted, and near-duplicates linked to them
+        self._staged: dict[str, np.ndarray] = {}
+        self._staged_twins: dict[str, str] = {}
+        self._pending: list[dict] = []
+        self._lines = 0
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._file_name):
+            return
+        with open(self._file_name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping damaged line in {self._file_name}")
+                    continue
+                self._lines += 1
+                self._apply(entry)
+        logger.info(
+            f"Load near-duplicate index with {len(self._signatures)} chunks "
+            f"and {len(self._twins)} duplicates"
+        )
+
+    def _apply(self, entry: dict):
+        chunk_id = entry["id"]
+        if entry.get("deleted"):
+            signature = self._signatures.pop(chunk_id, None)
+            if signature is not None:
+                for band in self._band_keys(signature):
+                    self._buckets[band].discard(chunk_id)
+            self._twins.pop(chunk_id, None)
+        elif "twin" in entry:
+            self._twins[chunk_id] = entry["twin"]
+        else:
+            signature = np.array(entry["signature"], dtype=np.uint64)
+            self._signatures[chunk_id] = signature
+            for band in self._band_keys(signature):
+                self._buckets[band].add(chunk_id)
+
+    def _band_keys(self, signature: np.ndarray) -> list[tuple]:
+        return [
+            (i, signature[i * self._rows : (i + 1) * self._rows].tobytes())
+            for i in range(self._bands)
+        ]
+
+    def signature(self, content: str) -> Union[np.ndarray, None]:
+        """MinHash of the word shingles of a text, None if it has no words"""
+        words = _WORD.findall(content.lower())
+        if not words:
+            return None
+        shingles = {
+            " ".join(words[i : i + self.shingle_size])
+            for i in range(max(len(words) - self.shingle_size + 1, 1))
+        }
+        hashes = np.array(
+            [zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.uint64
+        )
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return (permuted & _MAX_HASH).min(axis=0)
+
+    def find(
+        self,
+        signature: np.ndarray,
+        chunk_id: str = None,
+        staged: set[str] = frozenset(),
+    ) -> Union[str, None]:
+        """The indexed chunk, or staged chunk in ``staged``, most similar to
+        ``signature`` if it reaches the threshold; never ``chunk_id`` itself"""
+        candidates = set()
+        for band in self._band_keys(signature):
+            candidates.update(self._buckets.get(band, ()))
+        candidates.discard(chunk_id)
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            if candidate in self._signatures:
+                candidate_signature = self._signatures[candidate]
+            elif candidate in staged:
+                candidate_signature = self._staged[candidate]
+            else:
+                # staged by another insert, which may still fail
+                continue
+            similarity = float(np.mean(candidate_signature == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def stage(self, chunk_id: str, signature: np.ndarray):
+        self._staged[chunk_id] = signature
+        for band in self._band_keys(signature):
+            self._buckets[band].add(chunk_id)
+
+    def link(self, chunk_id: str, twin_id: str):
+        if twin_id in self._staged:
+            self._staged_twins[chunk_id] = twin_id
+            return
+        entry = {"id": chunk_id, "twin": twin_id}
+        self._apply(entry)
+        self._pending.append(entry)
+
+    def confirm(self, chunk_ids: list[str]):
+        """Index staged chunks that were merged, and link their
+        near-duplicates to them"""
+        confirmed = set()
+        for chunk_id in chunk_ids:
+            signature = self._staged.pop(chunk_id, None)
+            if signature is None:
+                continue
+            confirmed.add(chunk_id)
+            entry = {"id": chunk_id, "signature": signature.tolist()}
+            self._apply(entry)
+            self._pending.append(entry)
+        for chunk_id, twin_id in list(self._staged_twins.items()):
+            if twin_id in confirmed:
+                del self._staged_twins[chunk_id]
+                entry = {"id": chunk_id, "twin": twin_id}
+                self._apply(entry)
+                self._pending.append(entry)
+
+    def discard(self, chunk_ids: list[str]) -> list[str]:
+        """Drop staged chunks whose insert failed; returns the near-duplicates
+        linked to them, which are no duplicates of anything now"""
+        discarded = set()
+        for chunk_id in chunk_ids:
+            signature = self._staged.pop(chunk_id, None)
+            if signature is None:
+                continue
+            discarded.add(chunk_id)
+            for band in self._band_keys(signature):
+                self._buckets[band].discard(chunk_id)
+        unlinked = [k for k, twin in self._staged_twins.items() if twin in discarded]
+        for chunk_id in unlinked:
+            del self._staged_twins[chunk_id]
+        return unlinked
+
+    def is_duplicate(self, chunk_id: str) -> bool:
+        return chunk_id in self._twins
+
+    def remove(self, chunk_ids: list[str]) -> list[str]:
+        """Forget deleted chunks; returns the duplicates of them that are
+        left without a twin"""
+        removed = set(chunk_ids)
+        orphans = [
+            k for k, twin in self._twins.items() if twin in removed and k not in removed
+        ]
+        for chunk_id in chunk_ids + orphans:
+            if chunk_id in self._signatures or chunk_id in self._twins:
+                entry = {"id": chunk_id, "deleted": True}
+                self._apply(entry)
+                self._pending.append(entry)
+        return orphans
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def commit(self, count: int = None):
+        """Write the first ``count`` staged changes (all of them by default)"""
+        if count is None:
+            count = len(self._pending)
+        pending, self._pending = self._pending[:count], self._pending[count:]
+        if pending:
+            with open(self._file_name, "a", encoding="utf-8") as f:
+                for entry in pending:
+                    f.write(json.dumps(entry) + "\n")
+            self._lines += len(pending)
+        live = len(self._signatures) + len(self._twins)
+        # the in-memory state includes what is still staged
+        if not self._pending and self._lines > self._compact_ratio * max(live, 1):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the file with only the chunks and links still indexed"""
+        tmp_file_name = self._file_name + ".tmp"
+        with open(tmp_file_name, "w", encoding="utf-8") as f:
+            for chunk_id, signature in self._signatures.items():
+                f.write(
+                    json.dumps({"id": chunk_id, "signature": signature.tolist()}) + "\n"
+                )
+            for chunk_id, twin_id in self._twins.items():
+                f.write(json.dumps({"id": chunk_id, "twin": twin_id}) + "\n")
+        os.replace(tmp_file_name, self._file_name)
+        self._lines = len(self._signatures) + len(self._twins)
+
+
+async def link_near_duplicates(
+    chunks: dict[str, dict],
+    index: NearDuplicateIndex,
+    text_chunks: BaseKVStorage,
+    collector: MetricsCollector = NOOP_COLLECTOR,
+) -> dict[str, dict]:
+    """Store the chunks that are near-duplicates of an indexed chunk, or of
+    another one of ``chunks``, as links to it (``duplicate_of``), stage the
+    others and return them; only those still have to be embedded and
+    extracted. ``index.confirm`` them once they are merged and
+    ``discard_near_duplicates`` the ones that were not.
+    """
+    unique, duplicates = {}, {}
+    for chunk_id, chunk in chunks.items():
+        signature = index.signature(chunk["content"])
+        twin_id = (
+            index.find(signature, chunk_id, staged=unique.keys())
+            if signature is not None
+            else None
+        )
+        if twin_id is None:
+            if signature is not None:
+                index.stage(chunk_id, signature)
+            unique[chunk_id] = chunk
+        else:
+            index.link(chunk_id, twin_id)
+            duplicates[chunk_id] = {**chunk, "duplicate_of": twin_id}
+    increment(collector, "insert.near_duplicates", len(duplicates))
+    if duplicates:
+        logger.info(f"Linked {len(duplicates)} near-duplicate chunks to their twins")
+        await text_chunks.upsert(duplicates)
+    return unique
+
+
+async def discard_near_duplicates(
+    chunk_ids: list[str], index: NearDuplicateIndex, text_chunks: BaseKVStorage
+):
+    """Forget the signatures of chunks that were not merged, so a retried
+    insert extracts them, and the links of their near-duplicates, which are
+    inserted again with them; confirmed chunks are left alone"""
+    unlinked = index.discard(chunk_ids)
+    if unlinked:
+        await text_chunks.delete(unlinked)
+
+
+@asynccontextmanager
+async def staged_near_duplicates(
+    chunk_ids: Iterable[str],
+    index: Union[NearDuplicateIndex, None],
+    text_chunks: BaseKVStorage,
+):
+    """Discard the chunks of ``chunk_ids`` still staged when the block
+    exits, however it exits; ``chunk_ids`` is read then, and may be a
+    collection the block fills. Does nothing without an ``index``."""
+    try:
+        yield
+    finally:
+        if index is not None:
+            # chunks that were not merged are extracted again on a retry
+            await discard_near_duplicates(list(chunk_ids), index, text_chunks)
@@ -0,0 +1,176 @@
+import json
+import os
+from collections import defaultdict
+from typing import Union
+
+from .utils import logger
+
+JOURNAL_STATUSES = ("chunked", "embedded", "extracted", "merged")
+
+
+def pack_extraction(maybe_nodes: dict, maybe_edges: dict) -> dict:
+    return {
+        "nodes": [dp for dps in maybe_nodes.values() for dp in dps],
+        "edges": [dp for dps in maybe_edges.values() for dp in dps],
+    }
+
+
+def unpack_extraction(payload: dict) -> tuple[dict, dict]:
+    maybe_nodes = defaultdict(list)
+    maybe_edges = defaultdict(list)
+    for dp in payload["nodes"]:
+        maybe_nodes[dp["entity_name"]].append(dp)
+    for dp in payload["edges"]:
+        maybe_edges[(dp["src_id"], dp["tgt_id"])].append(dp)
+    return dict(maybe_nodes), dict(maybe_edges)
+
+
+class IngestionJournal:
+    """Append-only, per-chunk record of ingestion progress.
+
+    ``chunked`` and ``extracted`` (which carries the parsed extraction
+    records) are written immediately, since they don't depend on any
+    storage. ``embedded`` and ``merged`` only become true once the storages
+    holding them are flushed, so they are staged with ``mark`` and written by
+    ``commit`` after a successful flush.
+    """
+
+    def __init__(self, file_name: str, compact_ratio: int = 4):
+        self._file_name = file_name
+        self._compact_ratio = compact_ratio
+        self._chunks: dict[str, dict] = {}
+        self._pending: list[dict] = []
+        self._lines = 0
+        self._load()
+        if self._lines > self._compact_ratio * max(len(self._chunks), 1):
+            self.compact()
+
+    def _load(self):
+        if not os.path.exists(self._file_name):
+            return
+        with open(self._file_name, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn write from a crash, everything before it is intact
+                    logger.warning(f"Skipping damaged line in {self._file_name}")
+                    continue
+                self._lines += 1
+                self._apply(entry)
+        logger.info(
+            f"Load ingestion journal with {len(self._chunks)} unfinished chunks"
+        )
+
+    def _apply(self, entry: dict):
+        chunk_id, status = entry["id"], entry["status"]
+        if status == "merged":
+            # merged chunks live in text_chunks now, nothing left to resume
+            self._chunks.pop(chunk_id, None)
+            return
+        state = self._chunks.setdefault(chunk_id, {"statuses": set()})
+        state["statuses"].add(status)
+        if "doc" in entry:
+            state["doc"] = entry["doc"]
+        if "extraction" in entry:
+            state["extraction"] = entry["extraction"]
+        if "stats" in entry:
+            state["stats"] = entry["stats"]
+
+    def _append(self, entries: list[dict]):
+        if not entries:
+            return
+        with open(self._file_name, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._lines += len(entries)
+
+    def status(self, chunk_id: str) -> set[str]:
+        state = self._chunks.get(chunk_id)
+        return set() if state is None else set(state["statuses"])
+
+    def is_embedded(self, chunk_id: str) -> bool:
+        return "embedded" in self.status(chunk_id)
+
+    def get_extraction(self, chunk_id: str) -> Union[tuple[dict, dict], None]:
+        state = self._chunks.get(chunk_id)
+        if state is None or "extraction" not in state:
+            return None
+        return unpack_extraction(state["extraction"])
+
+    def get_extraction_stats(self, chunk_id: str) -> dict:
+        """The per-chunk statistics recorded with the extraction"""
+        state = self._chunks.get(chunk_id)
+        return {} if state is None else dict(state.get("stats", {}))
+
+    def record_chunked(self, chunks: dict[str, dict]):
+        entries = [
+            {"id": k, "status": "chunked", "doc": v["full_doc_id"]}
+            for k, v in chunks.items()
+            if "chunked" not in self.status(k)
+        ]
+        for entry in entries:
+            self._apply(entry)
+        self._append(entries)
+
+    def record_extracted(
+        self, chunk_id: str, maybe_nodes: dict, maybe_edges: dict, stats: dict = None
+    ):
+        entry = {
+            "id": chunk_id,
+            "status": "extracted",
+            "extraction": pack_extraction(maybe_nodes, maybe_edges),
+        }
+        if stats:
+            entry["stats"] = stats
+        self._apply(entry)
+        self._append([entry])
+
+    def mark(self, chunk_ids: list[str], status: str):
+        """Stage a status that only holds after the next successful flush"""
+        self._pending.extend({"id": k, "status": status} for k in chunk_ids)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def commit(self, count: int = None):
+        """Write the first ``count`` staged statuses (all of them by default).
+
+        Callers snapshot ``pending_count`` before flushing, so statuses staged
+        by concurrent inserts while the flush ran wait for the next one.
+        """
+        if count is None:
+            count = len(self._pending)
+        pending, self._pending = self._pending[:count], self._pending[count:]
+        for entry in pending:
+            self._apply(entry)
+        self._append(pending)
+        if self._lines > self._compact_ratio * max(len(self._chunks), 1):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal keeping only the state of unfinished chunks"""
+        tmp_file_name = self._file_name + ".tmp"
+        lines = 0
+        with open(tmp_file_name, "w", encoding="utf-8") as f:
+            for chunk_id, state in self._chunks.items():
+                for status in JOURNAL_STATUSES:
+                    if status not in state["statuses"]:
+                        continue
+                    entry = {"id": chunk_id, "status": status}
+                    if status == "chunked" and "doc" in state:
+                        entry["doc"] = state["doc"]
+                    if status == "extracted" and "extraction" in state:
+                        entry["extraction"] = state["extraction"]
+                    if status == "extracted" and "stats" in state:
+                        entry["stats"] = state["stats"]
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    lines += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file_name, self._file_name)
+        logger.info(f"Compacted ingestion journal from {self._lines} to {lines} lines")
+        self._lines = lines
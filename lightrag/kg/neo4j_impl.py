@@ -21,6 +21,10 @@ from tenacity import (
 )
 
 
+def _label(node_id: str) -> str:
+    return node_id.strip('"')
+
+
 @dataclass
 class Neo4JStorage(BaseGraphStorage):
     @staticmethod
@@ -206,6 +210,101 @@ class Neo4JStorage(BaseGraphStorage):
 
             return edges
 
+    # Node ids are labels, which Cypher can't take as parameters, and
+    # UNWIND-ing them into a label predicate would scan every node. The
+    # batched reads are instead one UNION ALL statement of indexed per-label
+    # matches, tagged with the position of their input.
+
+    async def _run_union(self, parts: list[str]) -> list:
+        if not parts:
+            return []
+        query = "\nUNION ALL\n".join(parts)
+        async with self._driver.session() as session:
+            result = await session.run(query)
+            records = [record async for record in result]
+        logger.debug(
+            f"{inspect.currentframe().f_code.co_name}:{len(parts)} parts:{len(records)} records"
+        )
+        return records
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{_label(node_id)}`) RETURN {i} AS idx, n"
+                for i, node_id in enumerate(node_ids)
+            ]
+        )
+        nodes = [None] * len(node_ids)
+        for record in records:
+            if nodes[record["idx"]] is None:
+                nodes[record["idx"]] = dict(record["n"])
+        return nodes
+
+    async def all_nodes(self) -> list[tuple[str, dict]]:
+        async with self._driver.session() as session:
+            result = await session.run("MATCH (n) RETURN labels(n) AS labels, n")
+            # node ids are labels, stored without their quotes
+            return [
+                (f'"{record["labels"][0]}"', dict(record["n"]))
+                async for record in result
+                if record["labels"]
+            ]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{_label(node_id)}`) "
+                f"RETURN {i} AS idx, COUNT {{ (n)--() }} AS degree"
+                for i, node_id in enumerate(node_ids)
+            ]
+        )
+        degrees = [0] * len(node_ids)
+        for record in records:
+            degrees[record["idx"]] = record["degree"]
+        return degrees
+
+    async def get_edges_batch(
+        self, pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        records = await self._run_union(
+            [
+                f"MATCH (:`{_label(source_node_id)}`)-[r]->"
+                f"(:`{_label(target_node_id)}`) "
+                f"RETURN {i} AS idx, properties(r) AS edge_properties"
+                for i, (source_node_id, target_node_id) in enumerate(pairs)
+            ]
+        )
+        edges = [None] * len(pairs)
+        for record in records:
+            if edges[record["idx"]] is None:
+                edges[record["idx"]] = dict(record["edge_properties"])
+        return edges
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[list[tuple[str, str]]]:
+        records = await self._run_union(
+            [
+                f"MATCH (n:`{_label(node_id)}`) "
+                "OPTIONAL MATCH (n)-[r]-(connected) "
+                f"RETURN {i} AS idx, n, connected"
+                for i, node_id in enumerate(node_ids)
+            ]
+        )
+        edges = [[] for _ in node_ids]
+        for record in records:
+            source_node = record["n"]
+            connected_node = record["connected"]
+            source_label = list(source_node.labels)[0] if source_node.labels else None
+            target_label = (
+                list(connected_node.labels)[0]
+                if connected_node and connected_node.labels
+                else None
+            )
+            if source_label and target_label:
+                edges[record["idx"]].append((source_label, target_label))
+        return edges
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -292,5 +391,141 @@ class Neo4JStorage(BaseGraphStorage):
             logger.error(f"Error during edge upsert: {str(e)}")
             raise
 
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_nodes_batch(self, nodes: Dict[str, Dict[str, Any]]):
+        """Upsert several nodes in a single write transaction"""
+
+        async def _do_upsert(tx: AsyncManagedTransaction):
+            for node_id, properties in nodes.items():
+                await tx.run(
+                    f"MERGE (n:`{_label(node_id)}`) SET n += $properties",
+                    properties=properties,
+                )
+
+        if not nodes:
+            return
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_upsert)
+        except Exception as e:
+            logger.error(f"Error during batch upsert: {str(e)}")
+            raise
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def upsert_edges_batch(self, edges: Dict[tuple[str, str], Dict[str, Any]]):
+        """Upsert several edges in a single write transaction"""
+
+        async def _do_upsert_edges(tx: AsyncManagedTransaction):
+            for (source_node_id, target_node_id), properties in edges.items():
+                await tx.run(
+                    f"MATCH (source:`{_label(source_node_id)}`) "
+                    f"WITH source MATCH (target:`{_label(target_node_id)}`) "
+                    "MERGE (source)-[r:DIRECTED]->(target) SET r += $properties",
+                    properties=properties,
+                )
+
+        if not edges:
+            return
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_upsert_edges)
+        except Exception as e:
+            logger.error(f"Error during batch edge upsert: {str(e)}")
+            raise
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def delete_node(self, node_id: str):
+        """
+        Delete a node and all of its relationships.
+
+        Args:
+            node_id: The unique identifier for the node (used as label)
+        """
+        label = _label(node_id)
+
+        async def _do_delete(tx: AsyncManagedTransaction):
+            query = f"""
+            MATCH (n:`{label}`)
+            DETACH DELETE n
+            """
+            await tx.run(query)
+            logger.debug(f"Deleted node with label '{label}'")
+
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_delete)
+        except Exception as e:
+            logger.error(f"Error during node deletion: {str(e)}")
+            raise
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        retry=retry_if_exception_type(
+            (
+                neo4jExceptions.ServiceUnavailable,
+                neo4jExceptions.TransientError,
+                neo4jExceptions.WriteServiceUnavailable,
+            )
+        ),
+    )
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        """
+        Delete the edges between two nodes, in either direction.
+
+        Args:
+            source_node_id (str): Label of the source node (used as identifier)
+            target_node_id (str): Label of the target node (used as identifier)
+        """
+        source_node_label = _label(source_node_id)
+        target_node_label = _label(target_node_id)
+
+        async def _do_delete_edge(tx: AsyncManagedTransaction):
+            query = f"""
+            MATCH (source:`{source_node_label}`)-[r]-(target:`{target_node_label}`)
+            DELETE r
+            """
+            await tx.run(query)
+            logger.debug(
+                f"Deleted edges between '{source_node_label}' and '{target_node_label}'"
+            )
+
+        try:
+            async with self._driver.session() as session:
+                await session.execute_write(_do_delete_edge)
+        except Exception as e:
+            logger.error(f"Error during edge deletion: {str(e)}")
+            raise
+
     async def _node2vec_embed(self):
         print("Implemented but never called.")
@@ -1,4 +1,5 @@
 import asyncio
+import json
 
 # import html
 # import os
@@ -167,11 +168,24 @@ class OracleKVStorage(BaseKVStorage):
     def __post_init__(self):
         self._data = {}
         self._max_batch_size = self.global_config["embedding_batch_num"]
+        # 文档和分块有自己的表, 其他 namespace 以 JSON 存入 LIGHTRAG_KV_STORE
+        self._json_store = self.namespace not in ("full_docs", "text_chunks")
+
+    async def all_keys(self) -> list[str]:
+        SQL = SQL_TEMPLATES["all_keys_kv" if self._json_store else "all_keys"].format(
+            table_name=N_T[self.namespace],
+            workspace=self.db.workspace,
+            namespace=self.namespace,
+        )
+        res = await self.db.query(SQL, multirows=True) or []
+        return [row["id"] for row in res]
 
     ################ QUERY METHODS ################
 
     async def get_by_id(self, id: str) -> Union[dict, None]:
         """根据 id 获取 doc_full 数据."""
+        if self._json_store:
+            return (await self.get_by_ids([id]))[0]
         SQL = SQL_TEMPLATES["get_by_id_" + self.namespace].format(
             workspace=self.db.workspace, id=id
         )
@@ -185,26 +199,60 @@ class OracleKVStorage(BaseKVStorage):
             return None
 
     # Query by id
-    async def get_by_ids(self, ids: list[str], fields=None) -> Union[list[dict], None]:
-        """根据 id 获取 doc_chunks 数据"""
-        SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(
-            workspace=self.db.workspace, ids=",".join([f"'{id}'" for id in ids])
-        )
-        # print("get_by_ids:"+SQL)
-        res = await self.db.query(SQL, multirows=True)
-        if res:
-            data = res  # [{"data":i} for i in res]
-            # print(data)
-            return data
+    async def get_by_ids(self, ids: list[str], fields=None) -> list[Union[dict, None]]:
+        """根据 id 获取 doc_chunks 数据, 按 ids 的顺序返回, 不存在的为 None"""
+        if not ids:
+            return []
+        if self._json_store:
+            SQL = SQL_TEMPLATES["get_by_ids_kv"].format(
+                workspace=self.db.workspace,
+                namespace=self.namespace,
+                ids=_sql_in_list(ids),
+            )
+            res = await self.db.query(SQL, multirows=True) or []
+            data = {row["id"]: json.loads(row["data"]) for row in res}
+            if fields is not None:
+                data = {
+                    id: {k: v for k, v in value.items() if k in fields}
+                    for id, value in data.items()
+                }
+            return [data.get(id) for id in ids]
+        if fields is None:
+            SQL = SQL_TEMPLATES["get_by_ids_" + self.namespace].format(
+                workspace=self.db.workspace, ids=",".join([f"'{id}'" for id in ids])
+            )
         else:
-            return None
+            # 只查询需要的字段
+            SQL = SQL_TEMPLATES["get_fields_by_ids"].format(
+                table_name=N_T[self.namespace],
+                fields=",".join(
+                    "NVL(content,'') as content" if f == "content" else f.upper()
+                    for f in sorted(fields)
+                ),
+                workspace=self.db.workspace,
+                ids=",".join([f"'{id}'" for id in ids]),
+            )
+        # print("get_by_ids:"+SQL)
+        res = await self.db.query(SQL, multirows=True) or []
+        data = {row["id"]: row for row in res}
+        if fields is not None:
+            data = {
+                id: {k: v for k, v in row.items() if k in fields}
+                for id, row in data.items()
+            }
+        return [data.get(id) for id in ids]
 
     async def filter_keys(self, keys: list[str]) -> set[str]:
         """过滤掉重复内容"""
-        SQL = SQL_TEMPLATES["filter_keys"].format(
+        if not keys:
+            return set()
+        SQL = SQL_TEMPLATES[
+            "filter_keys_kv" if self._json_store else "filter_keys"
+        ].format(
             table_name=N_T[self.namespace],
             workspace=self.db.workspace,
-            ids=",".join([f"'{k}'" for k in keys]),
+            namespace=self.namespace,
+            ids=_sql_in_list(keys),
         )
         res = await self.db.query(SQL, multirows=True)
         data = None
@@ -222,6 +270,19 @@ class OracleKVStorage(BaseKVStorage):
         self._data.update(left_data)
         # print(self._data)
         # values = []
+        if self._json_store:
+            # MERGE 只插入不存在的 key, 与其他 KV 存储一致
+            for k, v in left_data.items():
+                merge_sql = SQL_TEMPLATES["merge_kv"].format(
+                    workspace=self.db.workspace,
+                    namespace=self.namespace,
+                    check_id=k.replace("'", "''"),
+                )
+                await self.db.execute(
+                    merge_sql,
+                    [k, self.db.workspace, self.namespace, json.dumps(v)],
+                )
+
         if self.namespace == "text_chunks":
             list_data = [
                 {
@@ -268,6 +329,22 @@ class OracleKVStorage(BaseKVStorage):
                 await self.db.execute(merge_sql, values)
         return left_data
 
+    async def delete(self, ids: list[str]):
+        """删除 id 对应的数据"""
+        if not ids:
+            return
+        for id in ids:
+            self._data.pop(id, None)
+        SQL = SQL_TEMPLATES[
+            "delete_by_ids_kv" if self._json_store else "delete_by_ids"
+        ].format(
+            table_name=N_T[self.namespace],
+            workspace=self.db.workspace,
+            namespace=self.namespace,
+            ids=_sql_in_list(ids),
+        )
+        await self.db.execute(SQL)
+
     async def index_done_callback(self):
         if self.namespace in ["full_docs", "text_chunks"]:
             logger.info("full doc and chunk data had been saved into oracle db!")
@@ -284,6 +361,11 @@ class OracleVectorDBStorage(BaseVectorStorage):
         """向向量数据库中插入数据"""
         pass
 
+    async def delete(self, ids: list[str]):
+        """向量存在图节点、边和分块的表中, 随 delete_node, delete_edge
+        和 text_chunks 的 delete 一起删除, 这里无需操作"""
+        pass
+
     async def index_done_callback(self):
         pass
 
@@ -291,7 +373,11 @@ class OracleVectorDBStorage(BaseVectorStorage):
     async def query(self, query: str, top_k=5) -> Union[dict, list[dict]]:
         """从向量数据库中查询数据"""
         embeddings = await self.embedding_func([query])
-        embedding = embeddings[0]
+        return await self.query_by_embedding(embeddings[0], top_k=top_k)
+
+    async def query_by_embedding(
+        self, embedding: np.ndarray, top_k=5
+    ) -> Union[dict, list[dict]]:
         # 转换精度
         dtype = str(embedding.dtype).upper()
         dimension = embedding.shape[0]
@@ -402,6 +488,23 @@ class OracleGraphStorage(BaseGraphStorage):
         )
         # self._graph.add_edge(source_node_id, target_node_id, **edge_data)
 
+    async def delete_node(self, node_id: str):
+        """删除节点及其所有边"""
+        for template in ("delete_node_edges", "delete_node"):
+            SQL = SQL_TEMPLATES[template].format(
+                workspace=self.db.workspace, node_id=node_id.replace("'", "''")
+            )
+            await self.db.execute(SQL)
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        """删除边"""
+        SQL = SQL_TEMPLATES["delete_edge"].format(
+            workspace=self.db.workspace,
+            source_node_id=source_node_id.replace("'", "''"),
+            target_node_id=target_node_id.replace("'", "''"),
+        )
+        await self.db.execute(SQL)
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         """为节点生成向量"""
         if algorithm not in self._node_embed_algorithms:
@@ -525,6 +628,74 @@ class OracleGraphStorage(BaseGraphStorage):
                 # print("Node Edge not exist!",self.db.workspace, source_node_id)
                 return []
 
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        """一次查询获取多个节点的数据"""
+        if not node_ids:
+            return []
+        SQL = SQL_TEMPLATES["get_nodes"].format(
+            workspace=self.db.workspace, node_ids=_sql_in_list(node_ids)
+        )
+        res = await self.db.query(SQL, multirows=True) or []
+        nodes = {}
+        for row in res:
+            nodes.setdefault(row["name"], row)
+        return [nodes.get(node_id) for node_id in node_ids]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        """一次查询获取多个节点的度"""
+        if not node_ids:
+            return []
+        SQL = SQL_TEMPLATES["node_degrees"].format(
+            workspace=self.db.workspace, node_ids=_sql_in_list(node_ids)
+        )
+        res = await self.db.query(SQL, multirows=True) or []
+        degrees = {row["name"]: row["degree"] for row in res}
+        return [degrees.get(node_id, 0) for node_id in node_ids]
+
+    async def get_edges_batch(
+        self, pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        """一次查询获取多条边的数据"""
+        if not pairs:
+            return []
+        # graph pattern WHERE clauses take no row-value IN, the pairs are
+        # matched outside of the graph table
+        SQL = SQL_TEMPLATES["get_edges"].format(
+            workspace=self.db.workspace,
+            source_names=_sql_in_list(sorted({source for source, _ in pairs})),
+            pairs=", ".join(f"({_sql_in_list(pair)})" for pair in pairs),
+        )
+        res = await self.db.query(SQL, multirows=True) or []
+        edges = {}
+        for row in res:
+            key = (row.pop("source_name"), row.pop("target_name"))
+            edges.setdefault(key, row)
+        return [edges.get(tuple(pair)) for pair in pairs]
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        """一次查询获取多个节点的所有边"""
+        if not node_ids:
+            return []
+        existing = {
+            node_id
+            for node_id, node in zip(node_ids, await self.get_nodes_batch(node_ids))
+            if node is not None
+        }
+        SQL = SQL_TEMPLATES["get_nodes_edges"].format(
+            workspace=self.db.workspace, node_ids=_sql_in_list(node_ids)
+        )
+        res = await self.db.query(SQL, multirows=True) or []
+        edges = {node_id: [] for node_id in existing}
+        for row in res:
+            edges[row["source_name"]].append((row["source_name"], row["target_name"]))
+        return [edges.get(node_id) for node_id in node_ids]
+
+
+def _sql_in_list(values) -> str:
+    return ", ".join("'{}'".format(str(v).replace("'", "''")) for v in values)
+
 
 N_T = {
     "full_docs": "LIGHTRAG_DOC_FULL",
@@ -532,6 +703,12 @@ N_T = {
     "chunks": "LIGHTRAG_DOC_CHUNKS",
     "entities": "LIGHTRAG_GRAPH_NODES",
     "relationships": "LIGHTRAG_GRAPH_EDGES",
+    "llm_response_cache": "LIGHTRAG_KV_STORE",
+    "query_cache": "LIGHTRAG_KV_STORE",
+    "query_cache_generation": "LIGHTRAG_KV_STORE",
+    "chunk_extractions": "LIGHTRAG_KV_STORE",
+    "summary_queue": "LIGHTRAG_KV_STORE",
+    "entity_aliases": "LIGHTRAG_KV_STORE",
 }
 
 TABLES = {
@@ -589,6 +766,17 @@ TABLES = {
                     updatetime TIMESTAMP DEFAULT NULL
                     )"""
     },
+    "LIGHTRAG_KV_STORE": {
+        "ddl": """CREATE TABLE LIGHTRAG_KV_STORE (
+                    id varchar(256),
+                    workspace varchar(1024),
+                    namespace varchar(256),
+                    data CLOB,
+                    createtime TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updatetime TIMESTAMP DEFAULT NULL,
+                    PRIMARY KEY (workspace, namespace, id)
+                    )"""
+    },
     "LIGHTRAG_LLM_CACHE": {
         "ddl": """CREATE TABLE LIGHTRAG_LLM_CACHE (
                     id varchar(256) PRIMARY KEY,
@@ -623,7 +811,20 @@ SQL_TEMPLATES = {
     "get_by_id_text_chunks": "select ID,TOKENS,NVL(content,'') as content,CHUNK_ORDER_INDEX,FULL_DOC_ID from LIGHTRAG_DOC_CHUNKS where workspace='{workspace}' and ID='{id}'",
     "get_by_ids_full_docs": "select ID,NVL(content,'') as content from LIGHTRAG_DOC_FULL where workspace='{workspace}' and ID in ({ids})",
     "get_by_ids_text_chunks": "select ID,TOKENS,NVL(content,'') as content,CHUNK_ORDER_INDEX,FULL_DOC_ID  from LIGHTRAG_DOC_CHUNKS where workspace='{workspace}' and ID in ({ids})",
+    "get_fields_by_ids": "select ID,{fields} from {table_name} where workspace='{workspace}' and ID in ({ids})",
     "filter_keys": "select id from {table_name} where workspace='{workspace}' and id in ({ids})",
+    "all_keys": "select id from {table_name} where workspace='{workspace}'",
+    "delete_by_ids": "delete from {table_name} where workspace='{workspace}' and id in ({ids})",
+    "get_by_ids_kv": "select ID,NVL(data,'null') as data from LIGHTRAG_KV_STORE where workspace='{workspace}' and namespace='{namespace}' and ID in ({ids})",
+    "filter_keys_kv": "select id from LIGHTRAG_KV_STORE where workspace='{workspace}' and namespace='{namespace}' and id in ({ids})",
+    "all_keys_kv": "select id from LIGHTRAG_KV_STORE where workspace='{workspace}' and namespace='{namespace}'",
+    "delete_by_ids_kv": "delete from LIGHTRAG_KV_STORE where workspace='{workspace}' and namespace='{namespace}' and id in ({ids})",
+    "merge_kv": """MERGE INTO LIGHTRAG_KV_STORE a
+                    USING DUAL
+                    ON (a.workspace = '{workspace}' and a.namespace = '{namespace}' and a.id = '{check_id}')
+                    WHEN NOT MATCHED THEN
+                    INSERT(id,workspace,namespace,data) values(:1,:2,:3,:4)
+                    """,
     "merge_doc_full": """ MERGE INTO LIGHTRAG_DOC_FULL a
                     USING DUAL
                     ON (a.id = '{check_id}')
@@ -685,6 +886,41 @@ SQL_TEMPLATES = {
             WHERE e.workspace='{workspace}' and a.workspace='{workspace}' and b.workspace='{workspace}'
             AND a.name='{source_node_id}'
             COLUMNS (a.name as source_name,b.name as target_name))""",
+    "get_nodes": """SELECT t1.name,t2.entity_type,t2.source_chunk_id as source_id,NVL(t2.description,'') AS description
+        FROM GRAPH_TABLE (lightrag_graph
+        MATCH (a)
+        WHERE a.workspace='{workspace}' AND a.name IN ({node_ids})
+        COLUMNS (a.name)
+        ) t1 JOIN LIGHTRAG_GRAPH_NODES t2 on t1.name=t2.name
+        WHERE t2.workspace='{workspace}'""",
+    "node_degrees": """SELECT name, count(1) as degree FROM (
+        SELECT source_name as name FROM GRAPH_TABLE (lightrag_graph
+            MATCH (a)-[e]->(b)
+            WHERE e.workspace='{workspace}' and a.workspace='{workspace}' and b.workspace='{workspace}'
+            AND a.name IN ({node_ids})
+            COLUMNS (a.name as source_name))
+        UNION ALL
+        SELECT target_name as name FROM GRAPH_TABLE (lightrag_graph
+            MATCH (a)-[e]->(b)
+            WHERE e.workspace='{workspace}' and a.workspace='{workspace}' and b.workspace='{workspace}'
+            AND b.name IN ({node_ids})
+            COLUMNS (b.name as target_name))
+        ) GROUP BY name""",
+    "get_edges": """SELECT t1.source_name,t1.target_name,t2.weight,t2.source_chunk_id as source_id,
+        NVL(t2.description,'') AS description,NVL(t2.KEYWORDS,'') AS keywords
+        FROM GRAPH_TABLE (lightrag_graph
+        MATCH (a)-[e]->(b)
+        WHERE e.workspace='{workspace}' and a.workspace='{workspace}' and b.workspace='{workspace}'
+        AND a.name IN ({source_names})
+        COLUMNS (e.id,a.name as source_name,b.name as target_name)
+        ) t1 JOIN LIGHTRAG_GRAPH_EDGES t2 on t1.id=t2.id
+        WHERE (t1.source_name, t1.target_name) IN ({pairs})""",
+    "get_nodes_edges": """SELECT source_name,target_name
+            FROM GRAPH_TABLE (lightrag_graph
+            MATCH (a)-[e]->(b)
+            WHERE e.workspace='{workspace}' and a.workspace='{workspace}' and b.workspace='{workspace}'
+            AND a.name IN ({node_ids})
+            COLUMNS (a.name as source_name,b.name as target_name))""",
     "merge_node": """MERGE INTO LIGHTRAG_GRAPH_NODES a
                     USING DUAL
                     ON (a.workspace = '{workspace}' and a.name='{name}' and a.source_chunk_id='{source_chunk_id}')
@@ -697,4 +933,9 @@ SQL_TEMPLATES = {
                 WHEN NOT MATCHED THEN
                     INSERT(workspace,source_name,target_name,weight,keywords,description,source_chunk_id,content,content_vector)
                     values (:1,:2,:3,:4,:5,:6,:7,:8,:9) """,
+    "delete_node": "delete from LIGHTRAG_GRAPH_NODES where workspace='{workspace}' and name='{node_id}'",
+    "delete_node_edges": """delete from LIGHTRAG_GRAPH_EDGES where workspace='{workspace}'
+        and (source_name='{node_id}' or target_name='{node_id}')""",
+    "delete_edge": """delete from LIGHTRAG_GRAPH_EDGES where workspace='{workspace}'
+        and source_name='{source_node_id}' and target_name='{target_node_id}'""",
 }
@@ -1,5 +1,8 @@
 import asyncio
+import atexit
 import os
+import time
+import weakref
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from functools import partial
@@ -10,8 +13,11 @@ from .llm import (
     openai_embedding,
 )
 from .operate import (
-    chunking_by_token_size,
+    achunk_documents,
+    attach_chunk_ids,
     extract_entities,
+    remove_chunk_sources,
+    summarize_queued_descriptions,
     local_query,
     global_query,
     hybrid_query,
@@ -19,8 +25,30 @@ from .operate import (
     direct_query,
 )
 
+from .aliases import EntityAliasIndex
+from .dedup import (
+    NearDuplicateIndex,
+    link_near_duplicates,
+    staged_near_duplicates,
+)
+from .journal import IngestionJournal
+from .metrics import (
+    NOOP_COLLECTOR,
+    MetricsCollector,
+    count_llm_tokens,
+    increment,
+    instrument_async_func,
+    instrument_storage,
+    metric_tags,
+    timed,
+)
+from .pipeline import IngestionPipeline
+from .query_cache import QueryCache
+from .batch import BatchIngestor
+
 from .utils import (
     EmbeddingFunc,
+    KeyedLock,
     compute_mdhash_id,
     limit_async_func_call,
     convert_response_to_json,
@@ -39,6 +67,9 @@ from .storage import (
     JsonKVStorage,
     NanoVectorDBStorage,
     NetworkXStorage,
+    ShardedJsonKVStorage,
+    ShardedNanoVectorDBStorage,
+    ShardedNetworkXStorage,
 )
 
 from .kg.neo4j_impl import Neo4JStorage
@@ -64,10 +95,28 @@ def always_get_an_event_loop() -> asyncio.AbstractEventLoop:
         return loop
 
 
+def _flush_at_exit(rag_ref: weakref.ref):
+    rag = rag_ref()
+    if rag is None or not rag._inserts_since_flush:
+        return
+    logger.info(f"Flushing {rag._inserts_since_flush} pending inserts at exit")
+    try:
+        loop = always_get_an_event_loop()
+        if loop.is_closed():
+            loop = asyncio.new_event_loop()
+        if rag._flush_timer is not None:
+            rag._flush_timer.cancel()
+        loop.run_until_complete(rag.aflush())
+    except Exception:
+        logger.exception("Failed to flush pending inserts at exit")
+
+
 @dataclass
 class LightRAG:
     working_dir: str = field(
-        default_factory=lambda: f"./lightrag_cache_{datetime.now().strftime('%Y-%m-%d-%H:%M:%S')}"
+        default_factory=lambda: (
+            f"./lightrag_cache_{datetime.now().strftime('%Y-%m-%d-%H:%M:%S')}"
+        )
     )
 
     kv_storage: str = field(default="JsonKVStorage")
@@ -81,10 +130,56 @@ class LightRAG:
     chunk_token_size: int = 1200
     chunk_overlap_token_size: int = 100
     tiktoken_model_name: str = "gpt-4o-mini"
+    # "token_size": fixed windows of chunk_token_size tokens
+    # "content_defined": boundaries picked by a rolling hash of the text, so an
+    # edited document keeps the chunks (and their extractions) of unchanged parts
+    # "sentence", "markdown", "recursive": whole paragraphs/sentences, markdown
+    # sections or separator-delimited pieces packed into chunks
+    # or any name added with lightrag.chunking.register_chunker
+    chunk_strategy: str = "token_size"
+    # documents are chunked off the event loop: batches of at least
+    # chunking_parallel_min_chars characters are split over a "process" or
+    # "thread" pool of chunking_max_workers (default: one per core), smaller
+    # ones go to a single thread; "inline" chunks in the event loop
+    chunking_executor: str = "process"
+    chunking_max_workers: int = None
+    chunking_parallel_min_chars: int = 1_000_000
 
     # entity extraction
     entity_extract_max_gleaning: int = 1
+    # gleaning rounds are skipped for chunks of fewer tokens than this, after
+    # a round that found fewer new entities and relationships than
+    # gleaning_min_new_records, and when they would push the tokens sent and
+    # received for the chunk past gleaning_max_tokens_per_chunk (0: no cap)
+    gleaning_min_chunk_tokens: int = 0
+    gleaning_min_new_records: int = 0
+    gleaning_max_tokens_per_chunk: int = 0
+    # extract up to entity_extract_pack_max_chunks consecutive chunks of
+    # together at most entity_extract_pack_max_tokens tokens in one request,
+    # so small chunks share the few-shot prompt (1: a request per chunk)
+    entity_extract_pack_max_chunks: int = 1
+    entity_extract_pack_max_tokens: int = 1200
+    # call llm_model_func with stream=True for extraction, records are then
+    # parsed while the completion is generated; ignored unless the function
+    # has a true supports_stream attribute, like the OpenAI ones
+    entity_extract_stream: bool = False
     entity_summary_to_max_tokens: int = 500
+    # leave descriptions that reach entity_summary_to_max_tokens to grow
+    # during inserts and summarize each once before the next flush, with
+    # entity_summary_batch_size of them per LLM request
+    entity_summary_deferred: bool = False
+    entity_summary_batch_size: int = 8
+    # merge entities extracted under different spellings ("OPENAI INC.",
+    # "OPEN AI") into one canonical node: same name up to case, spacing,
+    # punctuation and legal form. Fuzzy matches, names of the same type and
+    # numbers whose character trigrams reach entity_alias_similarity, also
+    # need the entities vdb to find the canonical entity at
+    # entity_alias_embedding_similarity (> 0), unless
+    # entity_alias_fuzzy_without_embedding; see EntityAliasIndex
+    enable_entity_aliases: bool = False
+    entity_alias_similarity: float = 0.8
+    entity_alias_embedding_similarity: float = 0.0
+    entity_alias_fuzzy_without_embedding: bool = False
 
     # node embedding
     node_embedding_algorithm: str = "node2vec"
@@ -116,6 +211,62 @@ class LightRAG:
 
     enable_llm_cache: bool = True
 
+    # cache the keywords and context of queries until the next insert/delete,
+    # so repeated questions skip keyword extraction and retrieval
+    enable_query_cache: bool = True
+    query_cache_max_entries: int = 1024
+    # 0 keeps entries until the index changes
+    query_cache_ttl_seconds: float = 0
+    # also keep the cache in the kv storage, to survive restarts
+    query_cache_persistent: bool = False
+
+    # storage persistence: flushes append deltas to per-storage logs, which are
+    # compacted into the main file once they outgrow it by this ratio
+    storage_log_compaction_ratio: float = 1.0
+    # flush after every N inserts, or once this many seconds passed (0 disables)
+    storage_flush_every_n_inserts: int = 1
+    storage_flush_interval_seconds: float = 0.0
+
+    # split JsonKVStorage, NanoVectorDBStorage and NetworkXStorage data into
+    # this many shard files by key hash; shards load on first use, or all at
+    # once (in parallel) at startup with storage_preload_shards
+    storage_num_shards: int = 1
+    storage_preload_shards: bool = False
+
+    # record per-chunk progress so an interrupted insert resumes where it stopped
+    enable_ingestion_journal: bool = True
+
+    # link chunks whose word shingles are at least near_duplicate_threshold
+    # similar (Jaccard, estimated with MinHash/LSH) to a stored chunk to it,
+    # instead of embedding and extracting them again
+    enable_near_duplicate_filter: bool = False
+    near_duplicate_threshold: float = 0.9
+    near_duplicate_num_perm: int = 128
+    near_duplicate_shingle_size: int = 5
+
+    # streaming ingestion (ainsert_stream)
+    pipeline_queue_size: int = 64
+    pipeline_embed_max_async: int = 4
+    pipeline_extract_max_async: int = 16
+    pipeline_merge_batch_size: int = 32
+    pipeline_checkpoint_interval: int = 256
+
+    # batch ingestion (ainsert_batch)
+    batch_max_docs_in_flight: int = 8
+    # chunks extracted at once across all in-flight documents; defaults to
+    # twice llm_model_max_async so the LLM never waits on a new chunk
+    batch_max_chunks_in_flight: int = None
+    batch_checkpoint_interval: int = 100
+
+    # metrics: LLM calls and tokens, cache hits, embedding batches, storage
+    # lookups, flush and query latencies, tagged by stage and query mode
+    metrics_collector: MetricsCollector = None
+
+    # merges of an entity or relationship take turns on its lock, merges of
+    # unrelated ones run in parallel; give instances sharing storages the
+    # same KeyedLock to serialize their merges with each other too
+    merge_locks: KeyedLock = field(default_factory=KeyedLock)
+
     # extension
     addon_params: dict = field(default_factory=dict)
     convert_response_to_json_func: callable = convert_response_to_json
@@ -132,20 +283,61 @@ class LightRAG:
 
         # @TODO: should move all storage setup here to leverage initial start params attached to self.
 
+        storage_names = [self.kv_storage, self.vector_storage, self.graph_storage]
+        if self.storage_num_shards > 1:
+            storage_names = [
+                f"Sharded{name}"
+                if f"Sharded{name}" in self._get_storage_class()
+                else name
+                for name in storage_names
+            ]
         self.key_string_value_json_storage_cls: Type[BaseKVStorage] = (
-            self._get_storage_class()[self.kv_storage]
+            self._get_storage_class()[storage_names[0]]
         )
         self.vector_db_storage_cls: Type[BaseVectorStorage] = self._get_storage_class()[
-            self.vector_storage
+            storage_names[1]
         ]
         self.graph_storage_cls: Type[BaseGraphStorage] = self._get_storage_class()[
-            self.graph_storage
+            storage_names[2]
         ]
 
+        if self.entity_extract_stream and not getattr(
+            self.llm_model_func, "supports_stream", False
+        ):
+            logger.warning(
+                f"{getattr(self.llm_model_func, '__name__', type(self.llm_model_func).__name__)} "
+                "doesn't support streaming, entity_extract_stream is ignored"
+            )
+            self.entity_extract_stream = False
+
         if not os.path.exists(self.working_dir):
             logger.info(f"Creating working directory {self.working_dir}")
             os.makedirs(self.working_dir)
 
+        self._inserts_since_flush = 0
+        self._last_flush_time = time.monotonic()
+        self._flush_timer: asyncio.Task = None
+        # inserts not flushed yet when the interpreter exits are flushed then
+        atexit.register(_flush_at_exit, weakref.ref(self))
+        self._metrics = self.metrics_collector or NOOP_COLLECTOR
+
+        self.ingestion_journal = (
+            IngestionJournal(os.path.join(self.working_dir, "ingest_journal.jsonl"))
+            if self.enable_ingestion_journal
+            else None
+        )
+
+        self.near_duplicates = (
+            NearDuplicateIndex(
+                os.path.join(self.working_dir, "chunk_minhash.jsonl"),
+                threshold=self.near_duplicate_threshold,
+                num_perm=self.near_duplicate_num_perm,
+                shingle_size=self.near_duplicate_shingle_size,
+            )
+            if self.enable_near_duplicate_filter
+            else None
+        )
+
         self.llm_response_cache = (
             self.key_string_value_json_storage_cls(
                 namespace="llm_response_cache",
@@ -156,8 +348,36 @@ class LightRAG:
             else None
         )
 
+        self.query_cache = (
+            QueryCache(
+                max_entries=self.query_cache_max_entries,
+                ttl_seconds=self.query_cache_ttl_seconds,
+                storage=self.key_string_value_json_storage_cls(
+                    namespace="query_cache",
+                    global_config=asdict(self),
+                    embedding_func=None,
+                )
+                if self.query_cache_persistent
+                else None,
+                generation_storage=self.key_string_value_json_storage_cls(
+                    namespace="query_cache_generation",
+                    global_config=asdict(self),
+                    embedding_func=None,
+                )
+                if self.query_cache_persistent
+                else None,
+            )
+            if self.enable_query_cache
+            else None
+        )
+
         self.embedding_func = limit_async_func_call(self.embedding_func_max_async)(
-            self.embedding_func
+            instrument_async_func(
+                self.embedding_func,
+                self._metrics,
+                "embedding",
+                count_func=lambda args, kwargs, result: {"texts": len(args[0])},
+            )
         )
 
         ####
@@ -173,6 +393,42 @@ class LightRAG:
             global_config=asdict(self),
             embedding_func=self.embedding_func,
         )
+        # entities and relationships whose description awaits its summary
+        self.summary_queue = (
+            self.key_string_value_json_storage_cls(
+                namespace="summary_queue",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            if self.entity_summary_deferred
+            else None
+        )
+        # every extracted entity name and the canonical name it maps to
+        self.entity_aliases = (
+            self.key_string_value_json_storage_cls(
+                namespace="entity_aliases",
+                global_config=asdict(self),
+                embedding_func=None,
+            )
+            if self.enable_entity_aliases
+            else None
+        )
+        self.alias_index = (
+            EntityAliasIndex(
+                self.entity_aliases,
+                similarity=self.entity_alias_similarity,
+                embedding_similarity=self.entity_alias_embedding_similarity,
+                fuzzy_without_embedding=self.entity_alias_fuzzy_without_embedding,
+            )
+            if self.enable_entity_aliases
+            else None
+        )
+        # what every chunk yielded, to rebuild entities when it is deleted
+        self.chunk_extractions = self.key_string_value_json_storage_cls(
+            namespace="chunk_extractions",
+            global_config=asdict(self),
+            embedding_func=None,
+        )
         self.chunk_entity_relation_graph = self.graph_storage_cls(
             namespace="chunk_entity_relation",
             global_config=asdict(self),
@@ -201,23 +457,89 @@ class LightRAG:
         )
 
         self.llm_model_func = limit_async_func_call(self.llm_model_max_async)(
-            partial(
-                self.llm_model_func,
-                hashing_kv=self.llm_response_cache,
-                **self.llm_model_kwargs,
+            instrument_async_func(
+                partial(
+                    self.llm_model_func,
+                    hashing_kv=self.llm_response_cache,
+                    **self.llm_model_kwargs,
+                ),
+                self._metrics,
+                "llm",
+                count_func=partial(
+                    count_llm_tokens, model_name=self.tiktoken_model_name
+                ),
             )
         )
+        self._instrument_storages()
+
+    def _instrument_storages(self):
+        graph_lookups = [
+            "has_node",
+            "has_edge",
+            "get_node",
+            "get_edge",
+            "node_degree",
+            "edge_degree",
+            "get_node_edges",
+            "get_nodes_batch",
+            "node_degrees_batch",
+            "get_edges_batch",
+            "get_nodes_edges_batch",
+        ]
+        instrument_storage(
+            self.chunk_entity_relation_graph,
+            self._metrics,
+            {
+                **{method: "graph.lookup" for method in graph_lookups},
+                "upsert_node": "graph.write",
+                "upsert_edge": "graph.write",
+                "index_done_callback": "storage.flush",
+            },
+        )
+        for vdb in [self.entities_vdb, self.relationships_vdb, self.chunks_vdb]:
+            instrument_storage(
+                vdb,
+                self._metrics,
+                {
+                    # query embeds and calls query_by_embedding
+                    "query_by_embedding": "vector.query",
+                    "upsert": "vector.upsert",
+                    "index_done_callback": "storage.flush",
+                },
+            )
+        for kv in [
+            self.full_docs,
+            self.text_chunks,
+            self.chunk_extractions,
+            self.summary_queue,
+            self.entity_aliases,
+            self.llm_response_cache,
+        ]:
+            if kv is None:
+                continue
+            instrument_storage(
+                kv,
+                self._metrics,
+                {
+                    "get_by_id": "kv.lookup",
+                    "get_by_ids": "kv.lookup",
+                    "index_done_callback": "storage.flush",
+                },
+            )
 
     def _get_storage_class(self) -> Type[BaseGraphStorage]:
         return {
             # kv storage
             "JsonKVStorage": JsonKVStorage,
+            "ShardedJsonKVStorage": ShardedJsonKVStorage,
             "OracleKVStorage": OracleKVStorage,
             # vector storage
             "NanoVectorDBStorage": NanoVectorDBStorage,
+            "ShardedNanoVectorDBStorage": ShardedNanoVectorDBStorage,
             "OracleVectorDBStorage": OracleVectorDBStorage,
             # graph storage
             "NetworkXStorage": NetworkXStorage,
+            "ShardedNetworkXStorage": ShardedNetworkXStorage,
             "Neo4JStorage": Neo4JStorage,
             "OracleGraphStorage": OracleGraphStorage,
             # "ArangoDBStorage": ArangoDBStorage
@@ -245,21 +567,11 @@ class LightRAG:
             update_storage = True
             logger.info(f"[New Docs] inserting {len(new_docs)} docs")
 
-            inserting_chunks = {}
-            for doc_key, doc in new_docs.items():
-                chunks = {
-                    compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                        **dp,
-                        "full_doc_id": doc_key,
-                    }
-                    for dp in chunking_by_token_size(
-                        doc["content"],
-                        overlap_token_size=self.chunk_overlap_token_size,
-                        max_token_size=self.chunk_token_size,
-                        tiktoken_model=self.tiktoken_model_name,
-                    )
-                }
-                inserting_chunks.update(chunks)
+            global_config = asdict(self)
+            inserting_chunks = await achunk_documents(
+                {doc_key: doc["content"] for doc_key, doc in new_docs.items()},
+                global_config,
+            )
             _add_chunk_keys = await self.text_chunks.filter_keys(
                 list(inserting_chunks.keys())
             )
@@ -269,31 +581,60 @@ class LightRAG:
             if not len(inserting_chunks):
                 logger.warning("All chunks are already in the storage")
                 return
+            new_docs = attach_chunk_ids(new_docs, inserting_chunks)
             logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
+            increment(self._metrics, "insert.docs", len(new_docs))
+            increment(self._metrics, "insert.chunks", len(inserting_chunks))
+            if not await self._insert_chunks(inserting_chunks, global_config):
+                return
+            await self.full_docs.upsert(new_docs)
+        finally:
+            if update_storage:
+                await self._insert_done()
+
+    async def _insert_chunks(self, chunks: dict[str, dict], global_config: dict):
+        """Embed and extract new chunks and store them; returns False if
+        nothing was extracted from them"""
+        if self.near_duplicates is not None:
+            chunks = await link_near_duplicates(
+                chunks, self.near_duplicates, self.text_chunks, self._metrics
+            )
+            if not len(chunks):
+                logger.info("All chunks are near-duplicates of stored chunks")
+                return True
+        async with staged_near_duplicates(
+            chunks, self.near_duplicates, self.text_chunks
+        ):
+            if self.ingestion_journal is not None:
+                self.ingestion_journal.record_chunked(chunks)
 
-            await self.chunks_vdb.upsert(inserting_chunks)
+            await self._upsert_chunk_vectors(chunks)
 
             logger.info("[Entity Extraction]...")
             maybe_new_kg = await extract_entities(
-                inserting_chunks,
+                chunks,
                 knowledge_graph_inst=self.chunk_entity_relation_graph,
                 entity_vdb=self.entities_vdb,
                 relationships_vdb=self.relationships_vdb,
-                global_config=asdict(self),
+                global_config=global_config,
+                journal=self.ingestion_journal,
+                chunk_extractions=self.chunk_extractions,
+                summary_queue=self.summary_queue,
+                alias_index=self.alias_index,
             )
             if maybe_new_kg is None:
                 logger.warning("No new entities and relationships found")
-                return
+                return False
             self.chunk_entity_relation_graph = maybe_new_kg
 
-            await self.full_docs.upsert(new_docs)
-            await self.text_chunks.upsert(inserting_chunks)
-        finally:
-            if update_storage:
-                await self._insert_done()
+            await self.text_chunks.upsert(chunks)
+            if self.ingestion_journal is not None:
+                self.ingestion_journal.mark(list(chunks.keys()), "merged")
+            if self.near_duplicates is not None:
+                self.near_duplicates.confirm(list(chunks.keys()))
+            return True
 
     async def ainsert_seq(self, string_or_strings):
-        update_storage = False
         if isinstance(string_or_strings, str):
             string_or_strings = [string_or_strings]
         new_docs = {
@@ -305,23 +646,12 @@ class LightRAG:
         if not len(new_docs):
             logger.warning("All docs are already in the storage")
             return
-        update_storage = True
         logger.info(f"[New Docs] inserting {len(new_docs)} docs")
-        inserting_chunks = {}
-        for doc_key, doc in new_docs.items():
-            chunks = {
-                compute_mdhash_id(dp["content"], prefix="chunk-"): {
-                    **dp,
-                    "full_doc_id": doc_key,
-                }
-                for dp in chunking_by_token_size(
-                    doc["content"],
-                    overlap_token_size=self.chunk_overlap_token_size,
-                    max_token_size=self.chunk_token_size,
-                    tiktoken_model=self.tiktoken_model_name,
-                )
-            }
-            inserting_chunks.update(chunks)
+        global_config = asdict(self)
+        inserting_chunks = await achunk_documents(
+            {doc_key: doc["content"] for doc_key, doc in new_docs.items()},
+            global_config,
+        )
         _add_chunk_keys = await self.text_chunks.filter_keys(
             list(inserting_chunks.keys())
         )
@@ -331,119 +661,346 @@ class LightRAG:
         if not len(inserting_chunks):
             logger.warning("All chunks are already in the storage")
             return
+        new_docs = attach_chunk_ids(new_docs, inserting_chunks)
         logger.info(f"[New Chunks] inserting {len(inserting_chunks)} chunks")
+        increment(self._metrics, "insert.docs", len(new_docs))
+        increment(self._metrics, "insert.chunks", len(inserting_chunks))
+        if self.near_duplicates is not None:
+            inserting_chunks = await link_near_duplicates(
+                inserting_chunks, self.near_duplicates, self.text_chunks, self._metrics
+            )
+            if not len(inserting_chunks):
+                await self.full_docs.upsert(new_docs)
+                await self._insert_done()
+                return
+        if self.ingestion_journal is not None:
+            self.ingestion_journal.record_chunked(inserting_chunks)
 
-        await self.chunks_vdb.upsert(inserting_chunks)
+        completed_chunks = 0
+        try:
+            async with staged_near_duplicates(
+                inserting_chunks, self.near_duplicates, self.text_chunks
+            ):
+                await self._upsert_chunk_vectors(inserting_chunks)
 
-        logger.info("Upserted the embedded chunks to the vector db")
+                logger.info("Upserted the embedded chunks to the vector db")
 
-        logger.info("[Entity Extraction]...")
+                logger.info("[Entity Extraction]...")
 
-        completed_chunks = 0
-        for chunk_id, chunk in inserting_chunks.items():
-            try:
-                logger.info(f"Extracting entities from chunk {completed_chunks + 1} / {len(inserting_chunks)}")
-                inserting_chunk = {chunk_id: chunk}
-                maybe_new_kg = await extract_entities(
-                    inserting_chunk,
-                    knowledge_graph_inst=self.chunk_entity_relation_graph,
-                    entity_vdb=self.entities_vdb,
-                    relationships_vdb=self.relationships_vdb,
-                    global_config=asdict(self),
-                )
-                logger.info(f"Extracted entities from chunk {completed_chunks + 1} / {len(inserting_chunks)}")
-                if maybe_new_kg is None:
-                    logger.warning("No new entities and relationships found")
-                    return
-                self.chunk_entity_relation_graph = maybe_new_kg
+                for chunk_id, chunk in inserting_chunks.items():
+                    logger.info(
+                        f"Extracting entities from chunk {completed_chunks + 1} / {len(inserting_chunks)}"
+                    )
+                    inserting_chunk = {chunk_id: chunk}
+                    maybe_new_kg = await extract_entities(
+                        inserting_chunk,
+                        knowledge_graph_inst=self.chunk_entity_relation_graph,
+                        entity_vdb=self.entities_vdb,
+                        relationships_vdb=self.relationships_vdb,
+                        global_config=global_config,
+                        journal=self.ingestion_journal,
+                        chunk_extractions=self.chunk_extractions,
+                        summary_queue=self.summary_queue,
+                        alias_index=self.alias_index,
+                    )
+                    logger.info(
+                        f"Extracted entities from chunk {completed_chunks + 1} / {len(inserting_chunks)}"
+                    )
+                    if maybe_new_kg is None:
+                        logger.warning("No new entities and relationships found")
+                        return
+                    self.chunk_entity_relation_graph = maybe_new_kg
 
-                await self.full_docs.upsert(new_docs)
-                logger.info("Upserted the embedded docs to the vector db")
-                await self.text_chunks.upsert(inserting_chunks)
-                logger.info("Upserted the embedded chunks to the vector db")
-                completed_chunks += 1
-            
-            finally:
-                if update_storage:
+                    # only this chunk: the ones after it are not extracted yet
+                    await self.text_chunks.upsert(inserting_chunk)
+                    logger.info("Upserted the embedded chunk to the vector db")
+                    if self.ingestion_journal is not None:
+                        self.ingestion_journal.mark([chunk_id], "merged")
+                    if self.near_duplicates is not None:
+                        self.near_duplicates.confirm([chunk_id])
+                    completed_chunks += 1
                     await self._insert_done()
-            
-            logger.info(f"Inserted {completed_chunks} chunks")
 
-    async def _insert_done(self):
+                    logger.info(f"Inserted {completed_chunks} chunks")
+        finally:
+            if completed_chunks < len(inserting_chunks):
+                # a chunk failed or had nothing extracted from it
+                await self._insert_done()
+
+        # stored once all of their chunks are, or a retry would skip them
+        await self.full_docs.upsert(new_docs)
+        logger.info("Upserted the embedded docs to the vector db")
+        await self._insert_done()
+
+    def insert_stream(self, documents):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.ainsert_stream(documents))
+
+    async def ainsert_stream(self, documents):
+        """Insert an iterable (or async iterable) of documents through the
+        pipelined ingestion engine, so chunking, embedding, extraction and
+        merging of different chunks overlap instead of running batch by batch.
+        """
+        pipeline = IngestionPipeline(
+            full_docs=self.full_docs,
+            text_chunks=self.text_chunks,
+            chunks_vdb=self.chunks_vdb,
+            entities_vdb=self.entities_vdb,
+            relationships_vdb=self.relationships_vdb,
+            knowledge_graph_inst=self.chunk_entity_relation_graph,
+            global_config=asdict(self),
+            checkpoint_func=self.aflush,
+            journal=self.ingestion_journal,
+            chunk_extractions=self.chunk_extractions,
+            near_duplicates=self.near_duplicates,
+            summary_queue=self.summary_queue,
+            alias_index=self.alias_index,
+            queue_size=self.pipeline_queue_size,
+            embed_max_async=self.pipeline_embed_max_async,
+            extract_max_async=self.pipeline_extract_max_async,
+            merge_batch_size=self.pipeline_merge_batch_size,
+            checkpoint_interval=self.pipeline_checkpoint_interval,
+        )
+        return await pipeline.run(documents)
+
+    def insert_batch(self, documents, **kwargs):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.ainsert_batch(documents, **kwargs))
+
+    async def ainsert_batch(
+        self,
+        documents,
+        max_docs_in_flight: int = None,
+        max_chunks_in_flight: int = None,
+        checkpoint_interval: int = None,
+    ):
+        """Insert an iterable (or async iterable) of documents, a bounded
+        number at a time, and return a ``DocumentInsertResult`` per document.
+
+        A failing document is reported in its result instead of aborting the
+        whole batch; its finished chunks are resumed on the next insert.
+        """
+        if max_chunks_in_flight is None:
+            max_chunks_in_flight = (
+                self.batch_max_chunks_in_flight or 2 * self.llm_model_max_async
+            )
+        ingestor = BatchIngestor(
+            full_docs=self.full_docs,
+            text_chunks=self.text_chunks,
+            chunks_vdb=self.chunks_vdb,
+            entities_vdb=self.entities_vdb,
+            relationships_vdb=self.relationships_vdb,
+            knowledge_graph_inst=self.chunk_entity_relation_graph,
+            global_config=asdict(self),
+            checkpoint_func=self.aflush,
+            journal=self.ingestion_journal,
+            chunk_extractions=self.chunk_extractions,
+            near_duplicates=self.near_duplicates,
+            summary_queue=self.summary_queue,
+            alias_index=self.alias_index,
+            max_docs_in_flight=max_docs_in_flight or self.batch_max_docs_in_flight,
+            max_chunks_in_flight=max_chunks_in_flight,
+            checkpoint_interval=self.batch_checkpoint_interval
+            if checkpoint_interval is None
+            else checkpoint_interval,
+        )
+        return await ingestor.run(documents)
+
+    def flush(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aflush())
+
+    async def aflush(self):
+        """Persist all pending storage changes regardless of the flush policy"""
+        await self._insert_done(force=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._inserts_since_flush:
+            await self.aflush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._inserts_since_flush:
+            self.flush()
+
+    async def _insert_done(self, force: bool = False):
+        self._inserts_since_flush += 1
+        flush = force or self._flush_due()
+        if flush and self.summary_queue is not None:
+            await self.asummarize_pending()
+        if self.query_cache is not None:
+            await self.query_cache.invalidate()
+        if not flush:
+            self._schedule_flush()
+            return
+        if self.ingestion_journal is not None:
+            flushed_statuses = self.ingestion_journal.pending_count
+        if self.near_duplicates is not None:
+            flushed_signatures = self.near_duplicates.pending_count
+        with timed(self._metrics, "insert.flush"):
+            await self._flush_storages()
+        self._inserts_since_flush = 0
+        self._last_flush_time = time.monotonic()
+        if self.ingestion_journal is not None:
+            # statuses staged before this flush are durable now
+            self.ingestion_journal.commit(flushed_statuses)
+        if self.near_duplicates is not None:
+            self.near_duplicates.commit(flushed_signatures)
+
+    def summarize_pending(self):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.asummarize_pending())
+
+    async def asummarize_pending(self) -> int:
+        """Summarize the descriptions deferred by entity_summary_deferred;
+        this runs before every flush, so call it only to have them
+        summarized earlier"""
+        if self.summary_queue is None:
+            return 0
+        with timed(self._metrics, "insert.summarize_latency"):
+            return await summarize_queued_descriptions(
+                self.summary_queue,
+                self.chunk_entity_relation_graph,
+                self.entities_vdb,
+                self.relationships_vdb,
+                asdict(self),
+            )
+
+    async def _flush_storages(self):
         tasks = []
         for storage_inst in [
             self.full_docs,
             self.text_chunks,
+            self.chunk_extractions,
+            self.summary_queue,
+            self.entity_aliases,
             self.llm_response_cache,
             self.entities_vdb,
             self.relationships_vdb,
             self.chunks_vdb,
             self.chunk_entity_relation_graph,
+            self.query_cache,
         ]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
         await asyncio.gather(*tasks)
 
+    def _schedule_flush(self):
+        """Flush storage_flush_interval_seconds after the last flush even if no
+        insert follows to trigger it, as long as the event loop runs"""
+        if self.storage_flush_interval_seconds <= 0 or self._flush_timer is not None:
+            return
+        self._flush_timer = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            while self._inserts_since_flush:
+                delay = (
+                    self._last_flush_time
+                    + self.storage_flush_interval_seconds
+                    - time.monotonic()
+                )
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    await self.aflush()
+        finally:
+            self._flush_timer = None
+
+    def _flush_due(self) -> bool:
+        if self._inserts_since_flush >= self.storage_flush_every_n_inserts:
+            return True
+        return (
+            self.storage_flush_interval_seconds > 0
+            and time.monotonic() - self._last_flush_time
+            >= self.storage_flush_interval_seconds
+        )
+
+    async def _upsert_chunk_vectors(self, chunks: dict[str, dict]):
+        if self.ingestion_journal is not None:
+            chunks = {
+                k: v
+                for k, v in chunks.items()
+                if not self.ingestion_journal.is_embedded(k)
+            }
+        if not len(chunks):
+            return
+        with metric_tags(stage="embed"):
+            await self.chunks_vdb.upsert(chunks)
+        if self.ingestion_journal is not None:
+            self.ingestion_journal.mark(list(chunks.keys()), "embedded")
+
     def query(self, query: str, param: QueryParam = QueryParam()):
         loop = always_get_an_event_loop()
         return loop.run_until_complete(self.aquery(query, param))
 
     async def aquery(self, query: str, param: QueryParam = QueryParam()):
-        if param.mode == "local":
-            response = await local_query(
-                query,
-                self.chunk_entity_relation_graph,
-                self.entities_vdb,
-                self.relationships_vdb,
-                self.text_chunks,
-                param,
-                asdict(self),
-            )
-        elif param.mode == "global":
-            response = await global_query(
-                query,
-                self.chunk_entity_relation_graph,
-                self.entities_vdb,
-                self.relationships_vdb,
-                self.text_chunks,
-                param,
-                asdict(self),
-            )
-        elif param.mode == "hybrid":
-            response = await hybrid_query(
-                query,
-                self.chunk_entity_relation_graph,
-                self.entities_vdb,
-                self.relationships_vdb,
-                self.text_chunks,
-                param,
-                asdict(self),
-            )
-        elif param.mode == "naive":
-            response = await naive_query(
-                query,
-                self.chunks_vdb,
-                self.text_chunks,
-                param,
-                asdict(self),
-            )
-        elif param.mode == "direct":
-            response = await direct_query(
-                query,
-                self.chunks_vdb,
-                self.text_chunks,
-                param,
-                asdict(self),
-            )
-        else:
-            raise ValueError(f"Unknown mode {param.mode}")
+        increment(self._metrics, "query.calls", mode=param.mode)
+        with metric_tags(mode=param.mode), timed(self._metrics, "query.latency"):
+            if param.mode == "local":
+                response = await local_query(
+                    query,
+                    self.chunk_entity_relation_graph,
+                    self.entities_vdb,
+                    self.relationships_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                    query_cache=self.query_cache,
+                )
+            elif param.mode == "global":
+                response = await global_query(
+                    query,
+                    self.chunk_entity_relation_graph,
+                    self.entities_vdb,
+                    self.relationships_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                    query_cache=self.query_cache,
+                )
+            elif param.mode == "hybrid":
+                response = await hybrid_query(
+                    query,
+                    self.chunk_entity_relation_graph,
+                    self.entities_vdb,
+                    self.relationships_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                    query_cache=self.query_cache,
+                )
+            elif param.mode == "naive":
+                response = await naive_query(
+                    query,
+                    self.chunks_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                    query_cache=self.query_cache,
+                )
+            elif param.mode == "direct":
+                response = await direct_query(
+                    query,
+                    self.chunks_vdb,
+                    self.text_chunks,
+                    param,
+                    asdict(self),
+                )
+            else:
+                raise ValueError(f"Unknown mode {param.mode}")
         await self._query_done()
         return response
 
     async def _query_done(self):
         tasks = []
-        for storage_inst in [self.llm_response_cache]:
+        for storage_inst in [self.llm_response_cache, self.query_cache]:
             if storage_inst is None:
                 continue
             tasks.append(cast(StorageNameSpace, storage_inst).index_done_callback())
@@ -464,16 +1021,150 @@ class LightRAG:
             logger.info(
                 f"Entity '{entity_name}' and its relationships have been deleted."
             )
+            if self.query_cache is not None:
+                await self.query_cache.invalidate()
             await self._delete_by_entity_done()
         except Exception as e:
             logger.error(f"Error while deleting entity '{entity_name}': {e}")
 
+    def delete_document(self, doc_id: str):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.adelete_document(doc_id))
+
+    async def adelete_document(self, doc_id: str) -> bool:
+        """Delete a document and its chunks, and strip them from the graph.
+
+        Entities and relationships only found in the document are dropped,
+        the others are re-summarized from the chunks still referencing them.
+        Returns False if there is no such document.
+        """
+        doc = await self.full_docs.get_by_id(doc_id)
+        if doc is None:
+            logger.warning(f"Document {doc_id} not found")
+            return False
+        chunk_ids = await self._get_document_chunk_ids(doc_id, doc)
+        await self._delete_chunks(chunk_ids)
+        await self.full_docs.delete([doc_id])
+        await self.aflush()
+        logger.info(f"Deleted {doc_id} with {len(chunk_ids)} chunks")
+        return True
+
+    def update_document(self, doc_id: str, new_text: str):
+        loop = always_get_an_event_loop()
+        return loop.run_until_complete(self.aupdate_document(doc_id, new_text))
+
+    async def aupdate_document(self, doc_id: str, new_text: str) -> str:
+        """Replace a document with its new version and return the new doc id.
+
+        Chunks found in both versions keep their vectors and extractions,
+        only removed chunks are stripped from the graph and only new ones are
+        extracted. With chunk_strategy="content_defined" an edit changes just
+        the chunks around it.
+        """
+        new_content = new_text.strip()
+        new_doc_id = compute_mdhash_id(new_content, prefix="doc-")
+        if new_doc_id == doc_id:
+            return doc_id
+        new_chunks = await achunk_documents({new_doc_id: new_content}, asdict(self))
+        doc = await self.full_docs.get_by_id(doc_id)
+        if doc is not None:
+            chunk_ids = await self._get_document_chunk_ids(doc_id, doc)
+            kept_chunk_ids = [k for k in chunk_ids if k in new_chunks]
+            await self._delete_chunks([k for k in chunk_ids if k not in new_chunks])
+            # kept chunks move to the new version of the document
+            await self.text_chunks.delete(kept_chunk_ids)
+            await self.text_chunks.upsert({k: new_chunks[k] for k in kept_chunk_ids})
+            await self.full_docs.delete([doc_id])
+            logger.info(
+                f"Updating {doc_id}: reusing {len(kept_chunk_ids)} of "
+                f"{len(new_chunks)} chunks"
+            )
+        await self.ainsert(new_content)
+        # ainsert only records the chunks it inserted, or skips the document
+        # when all of its chunks were kept
+        chunks = await self.text_chunks.get_by_ids(
+            list(new_chunks.keys()), fields={"full_doc_id"}
+        )
+        await self.full_docs.delete([new_doc_id])
+        await self.full_docs.upsert(
+            {
+                new_doc_id: {
+                    "content": new_content,
+                    "chunk_ids": [
+                        k
+                        for k, dp in zip(new_chunks.keys(), chunks)
+                        if dp is not None and dp["full_doc_id"] == new_doc_id
+                    ],
+                }
+            }
+        )
+        await self.aflush()
+        return new_doc_id
+
+    async def _get_document_chunk_ids(self, doc_id: str, doc: dict) -> list[str]:
+        """The chunks stored for a document, as recorded when it was
+        inserted; documents inserted before chunk ids were recorded are
+        looked up by the ``full_doc_id`` of all stored chunks"""
+        if "chunk_ids" in doc:
+            chunk_ids = doc["chunk_ids"]
+        else:
+            chunk_ids = await self.text_chunks.all_keys()
+        chunks = await self.text_chunks.get_by_ids(chunk_ids, fields={"full_doc_id"})
+        # a chunk shared with another document belongs to the one inserting it
+        doc_chunk_ids = [
+            k
+            for k, dp in zip(chunk_ids, chunks)
+            if dp is not None and dp["full_doc_id"] == doc_id
+        ]
+        if "chunk_ids" not in doc and not doc_chunk_ids:
+            raise ValueError(f"No chunks of document {doc_id} found in text_chunks")
+        return doc_chunk_ids
+
+    async def _delete_chunks(self, chunk_ids: list[str]):
+        if not chunk_ids:
+            return
+        extracted_chunk_ids, orphan_ids = chunk_ids, []
+        if self.near_duplicates is not None:
+            # near-duplicates were never extracted
+            extracted_chunk_ids = [
+                k for k in chunk_ids if not self.near_duplicates.is_duplicate(k)
+            ]
+            orphan_ids = self.near_duplicates.remove(chunk_ids)
+        touched_entities, touched_relations = await remove_chunk_sources(
+            extracted_chunk_ids,
+            self.chunk_extractions,
+            knowledge_graph_inst=self.chunk_entity_relation_graph,
+            entity_vdb=self.entities_vdb,
+            relationships_vdb=self.relationships_vdb,
+            global_config=asdict(self),
+        )
+        await self.chunks_vdb.delete(chunk_ids)
+        await self.text_chunks.delete(chunk_ids)
+        await self.chunk_extractions.delete(chunk_ids)
+        logger.info(
+            f"Deleted {len(chunk_ids)} chunks, updated {touched_entities} "
+            f"entities and {touched_relations} relationships"
+        )
+        if orphan_ids:
+            # near-duplicates of deleted chunks stand in for them now
+            orphans = {
+                k: {f: v for f, v in dp.items() if f != "duplicate_of"}
+                for k, dp in zip(
+                    orphan_ids, await self.text_chunks.get_by_ids(orphan_ids)
+                )
+                if dp is not None
+            }
+            await self.text_chunks.delete(list(orphans.keys()))
+            logger.info(f"Extracting {len(orphans)} near-duplicates of deleted chunks")
+            await self._insert_chunks(orphans, asdict(self))
+
     async def _delete_by_entity_done(self):
         tasks = []
         for storage_inst in [
             self.entities_vdb,
             self.relationships_vdb,
             self.chunk_entity_relation_graph,
+            self.query_cache,
         ]:
             if storage_inst is None:
                 continue
@@ -27,13 +27,46 @@ from tenacity import (
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
 from pydantic import BaseModel, Field
-from typing import List, Dict, Callable, Any
+from typing import List, Dict, Callable, Any, AsyncIterator
 from .base import BaseKVStorage
+from .metrics import get_collector, increment, mark_served_from_cache
 from .utils import compute_args_hash, wrap_embedding_func_with_attrs
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
+def _count_cache_lookup(hashing_kv: BaseKVStorage, hit: bool):
+    increment(
+        get_collector(hashing_kv.global_config),
+        "llm.cache_hit" if hit else "llm.cache_miss",
+    )
+    if hit:
+        # a cached answer costs no tokens
+        mark_served_from_cache()
+
+
+def _supports_stream(func):
+    """Mark a completion function that accepts ``stream=True`` and then
+    returns an async iterator of text pieces"""
+    func.supports_stream = True
+    return func
+
+
+async def _stream_openai_response(
+    response, hashing_kv: BaseKVStorage, args_hash: str, model: str
+) -> AsyncIterator[str]:
+    """Yield the text of a streamed completion, caching it once complete"""
+    pieces = []
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            pieces.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    if hashing_kv is not None:
+        await hashing_kv.upsert(
+            {args_hash: {"return": "".join(pieces), "model": model}}
+        )
+
+
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_exponential(multiplier=1, min=4, max=10),
@@ -63,12 +96,17 @@ async def openai_complete_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
 
     response = await openai_async_client.chat.completions.create(
         model=model, messages=messages, **kwargs
     )
+    if kwargs.get("stream"):
+        return _stream_openai_response(
+            response, hashing_kv, args_hash if hashing_kv is not None else None, model
+        )
 
     if hashing_kv is not None:
         await hashing_kv.upsert(
@@ -112,12 +150,17 @@ async def azure_openai_complete_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
 
     response = await openai_async_client.chat.completions.create(
         model=model, messages=messages, **kwargs
     )
+    if kwargs.get("stream"):
+        return _stream_openai_response(
+            response, hashing_kv, args_hash if hashing_kv is not None else None, model
+        )
 
     if hashing_kv is not None:
         await hashing_kv.upsert(
@@ -191,6 +234,7 @@ async def bedrock_complete_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
 
@@ -244,6 +288,7 @@ async def hf_model_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
     input_prompt = ""
@@ -313,6 +358,7 @@ async def ollama_model_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
 
@@ -431,6 +477,7 @@ async def lmdeploy_model_if_cache(
     if hashing_kv is not None:
         args_hash = compute_args_hash(model, messages)
         if_cache_return = await hashing_kv.get_by_id(args_hash)
+        _count_cache_lookup(hashing_kv, if_cache_return is not None)
         if if_cache_return is not None:
             return if_cache_return["return"]
 
@@ -455,6 +502,7 @@ async def lmdeploy_model_if_cache(
     return response
 
 
+@_supports_stream
 async def gpt_4o_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -467,6 +515,7 @@ async def gpt_4o_complete(
     )
 
 
+@_supports_stream
 async def gpt_4o_mini_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -479,6 +528,7 @@ async def gpt_4o_mini_complete(
     )
 
 
+@_supports_stream
 async def azure_openai_complete(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+import numpy as np
+
+from .utils import count_tokens
+
+# Tags attached to every metric recorded in the current context, e.g. the
+# query mode and the stage. asyncio tasks inherit them from their creator.
+_metric_tags: ContextVar[dict] = ContextVar("lightrag_metric_tags", default={})
+# Set by an LLM completion function answering from the LLM cache, so the
+# instrumented call it ran in doesn't count the tokens of that answer
+_served_from_cache: ContextVar[bool] = ContextVar(
+    "lightrag_served_from_cache", default=False
+)
+
+
+class MetricsCollector:
+    """Receives counters and histogram observations; this base drops them.
+
+    Subclass it to export to Prometheus, StatsD, OpenTelemetry, ... and pass
+    an instance as ``LightRAG(metrics_collector=...)``.
+    """
+
+    enabled = False
+
+    def increment(self, name: str, value: float, tags: dict):
+        pass
+
+    def observe(self, name: str, value: float, tags: dict):
+        pass
+
+    def __deepcopy__(self, memo):
+        # global_config is a deep copy of the LightRAG fields, but it must
+        # reach the very same collector
+        return self
+
+
+class InMemoryMetricsCollector(MetricsCollector):
+    """Keeps every counter and observation in memory, for tests, benchmarks
+    and ad-hoc profiling.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = defaultdict(list)
+
+    @staticmethod
+    def _key(name: str, tags: dict) -> tuple:
+        return name, tuple(sorted(tags.items()))
+
+    def increment(self, name: str, value: float, tags: dict):
+        with self._lock:
+            self._counters[self._key(name, tags)] += value
+
+    def observe(self, name: str, value: float, tags: dict):
+        with self._lock:
+            self._histograms[self._key(name, tags)].append(value)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def counter(self, name: str, **tags) -> float:
+        """Sum of a counter over every tag set containing ``tags``"""
+        with self._lock:
+            return sum(
+                value
+                for (n, t), value in self._counters.items()
+                if n == name and tags.items() <= dict(t).items()
+            )
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = [
+                {"name": name, "tags": dict(tags), "value": value}
+                for (name, tags), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {
+                    "name": name,
+                    "tags": dict(tags),
+                    "count": len(values),
+                    "sum": float(np.sum(values)),
+                    "p50": float(np.percentile(values, 50)),
+                    "p99": float(np.percentile(values, 99)),
+                    "max": float(np.max(values)),
+                }
+                for (name, tags), values in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+
+NOOP_COLLECTOR = MetricsCollector()
+
+
+def get_collector(global_config: dict) -> MetricsCollector:
+    return global_config.get("metrics_collector") or NOOP_COLLECTOR
+
+
+@contextmanager
+def metric_tags(**tags):
+    """Tag every metric recorded inside the block, including in tasks
+    started from it"""
+    token = _metric_tags.set({**_metric_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        _metric_tags.reset(token)
+
+
+def increment(collector: MetricsCollector, name: str, value: float = 1, **tags):
+    if collector.enabled:
+        collector.increment(name, value, {**_metric_tags.get(), **tags})
+
+
+def observe(collector: MetricsCollector, name: str, value: float, **tags):
+    if collector.enabled:
+        collector.observe(name, value, {**_metric_tags.get(), **tags})
+
+
+@contextmanager
+def timed(collector: MetricsCollector, name: str, **tags):
+    """Observe the duration of the block in seconds"""
+    if not collector.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(collector, name, time.perf_counter() - start, **tags)
+
+
+def mark_served_from_cache():
+    """Called by a completion function whose result comes from the LLM
+    cache: the ``count_func`` of the instrumented call is skipped"""
+    _served_from_cache.set(True)
+
+
+def instrument_async_func(
+    func, collector: MetricsCollector, name: str, count_func: callable = None, **tags
+):
+    """Count calls of an async function and observe their duration under
+    ``{name}.calls`` and ``{name}.latency``. ``count_func(args, kwargs,
+    result)`` may return more counters to add, as ``{suffix: value}``,
+    unless the function called ``mark_served_from_cache``.
+
+    A call returning an async iterator of text pieces is recorded once the
+    stream is exhausted, with the joined text as its result.
+    """
+    if not collector.enabled:
+        return func
+
+    def record(args, kwargs, result, start, cached=False):
+        increment(collector, f"{name}.calls", **tags)
+        observe(collector, f"{name}.latency", time.perf_counter() - start, **tags)
+        if count_func is not None and not cached:
+            for suffix, value in count_func(args, kwargs, result).items():
+                increment(collector, f"{name}.{suffix}", value, **tags)
+
+    async def stream(args, kwargs, response, start):
+        pieces = []
+        try:
+            async for piece in response:
+                pieces.append(piece)
+                yield piece
+        except Exception:
+            increment(collector, f"{name}.errors", **tags)
+            raise
+        record(args, kwargs, "".join(pieces), start)
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        # func runs in this context, so whatever it marks is seen here
+        token = _served_from_cache.set(False)
+        try:
+            result = await func(*args, **kwargs)
+            cached = _served_from_cache.get()
+        except Exception:
+            increment(collector, f"{name}.errors", **tags)
+            raise
+        finally:
+            _served_from_cache.reset(token)
+        if hasattr(result, "__aiter__"):
+            return stream(args, kwargs, result, start)
+        record(args, kwargs, result, start, cached)
+        return result
+
+    return wrapper
+
+
+def count_llm_tokens(
+    args: tuple, kwargs: dict, result, model_name: str = "gpt-4o"
+) -> dict:
+    """``count_func`` for LLM completion functions, counting each message on
+    its own: the system prompt and history repeat across the rounds of a
+    conversation and their counts are memoized"""
+    prompt = [args[0] if args else kwargs.get("prompt", "")]
+    prompt.append(kwargs.get("system_prompt") or "")
+    prompt.extend(m["content"] for m in kwargs.get("history_messages") or [])
+    return {
+        "prompt_tokens": sum(count_tokens(p, model_name=model_name) for p in prompt),
+        "completion_tokens": count_tokens(result, model_name=model_name)
+        if isinstance(result, str)
+        else 0,
+    }
+
+
+def instrument_storage(storage, collector: MetricsCollector, methods: dict):
+    """Time the given async methods of a storage instance, ``methods`` maps
+    a method name to the metric it's recorded under."""
+    if not collector.enabled:
+        return
+    for method, name in methods.items():
+        setattr(
+            storage,
+            method,
+            instrument_async_func(
+                getattr(storage, method),
+                collector,
+                name,
+                namespace=storage.namespace,
+                op=method,
+            ),
+        )
@@ -1,21 +1,32 @@
 import asyncio
 import json
+import os
 import re
-from typing import Union
+import threading
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Awaitable, Callable, Iterable, Union
 from collections import Counter, defaultdict
+from functools import partial
 import warnings
+import numpy as np
 from .utils import (
     logger,
     clean_str,
     compute_mdhash_id,
+    count_tokens,
     decode_tokens_by_tiktoken,
     encode_string_by_tiktoken,
+    get_tokenizer,
     is_float_regex,
-    list_of_list_to_csv,
     pack_user_ass_to_openai_messages,
+    register_tokenizer,
+    registered_tokenizers,
     split_string_by_multi_markers,
     truncate_list_by_token_size,
-    process_combine_contexts,
     locate_json_string_body_from_string,
 )
 from .base import (
@@ -25,28 +36,168 @@ from .base import (
     TextChunkSchema,
     QueryParam,
 )
+from .aliases import EntityAliasIndex, canonicalize_extractions
+from .chunking import CHUNKERS, ContentDefinedChunker, TokenSizeChunker
+from .journal import IngestionJournal, pack_extraction
+from .metrics import get_collector, increment, metric_tags, observe, timed
 from .prompt import GRAPH_FIELD_SEP, PROMPTS
+from .query_cache import QueryCache
+from .context import ContextEntity, ContextRelation, ContextTextUnit, QueryContext
 
 
 def chunking_by_token_size(
     content: str, overlap_token_size=128, max_token_size=1024, tiktoken_model="gpt-4o"
 ):
-    tokens = encode_string_by_tiktoken(content, model_name=tiktoken_model)
-    results = []
-    for index, start in enumerate(
-        range(0, len(tokens), max_token_size - overlap_token_size)
-    ):
-        chunk_content = decode_tokens_by_tiktoken(
-            tokens[start : start + max_token_size], model_name=tiktoken_model
-        )
-        results.append(
-            {
-                "tokens": min(max_token_size, len(tokens) - start),
-                "content": chunk_content.strip(),
-                "chunk_order_index": index,
+    return TokenSizeChunker(
+        get_tokenizer(tiktoken_model), max_token_size, overlap_token_size
+    ).chunk(content)
+
+
+def chunking_by_content_defined(
+    content: str, overlap_token_size=128, max_token_size=1024, tiktoken_model="gpt-4o"
+):
+    return ContentDefinedChunker(
+        get_tokenizer(tiktoken_model), max_token_size, overlap_token_size
+    ).chunk(content)
+
+
+# the settings chunking depends on; chunk_documents only gets these, so they
+# can be sent to a worker process
+_CHUNKING_CONFIG = (
+    "chunk_strategy",
+    "chunk_token_size",
+    "chunk_overlap_token_size",
+    "tiktoken_model_name",
+)
+
+
+def chunk_documents(
+    docs: dict[str, str], global_config: dict
+) -> dict[str, TextChunkSchema]:
+    """Split documents, by key, into chunks keyed by the hash of their
+    content, with the chunker of ``chunk_strategy``"""
+    chunker = CHUNKERS[global_config["chunk_strategy"]](
+        get_tokenizer(global_config["tiktoken_model_name"]),
+        max_token_size=global_config["chunk_token_size"],
+        overlap_token_size=global_config["chunk_overlap_token_size"],
+    )
+    chunks = {}
+    for doc_key, doc_chunks in zip(docs, chunker.chunk_batch(list(docs.values()))):
+        for dp in doc_chunks:
+            chunks[compute_mdhash_id(dp["content"], prefix="chunk-")] = {
+                **dp,
+                "full_doc_id": doc_key,
             }
-        )
-    return results
+    return chunks
+
+
+def chunk_document(
+    doc_key: str, content: str, global_config: dict
+) -> dict[str, TextChunkSchema]:
+    """Split a document into chunks keyed by the hash of their content"""
+    return chunk_documents({doc_key: content}, global_config)
+
+
+# pools by kind and size, with the registered tokenizers they were started with
+_chunking_pools: dict[tuple[str, int], tuple[Executor, dict]] = {}
+_chunking_pools_lock = threading.Lock()
+
+
+def _register_tokenizers(tokenizers: dict):
+    """Initializer of chunking worker processes, which don't inherit the
+    registry when they are spawned rather than forked"""
+    for model_name, tokenizer in tokenizers.items():
+        register_tokenizer(model_name, tokenizer)
+
+
+def _get_chunking_pool(kind: str, max_workers: int) -> Executor:
+    tokenizers = registered_tokenizers() if kind == "process" else {}
+    with _chunking_pools_lock:
+        pool, pool_tokenizers = _chunking_pools.get((kind, max_workers), (None, {}))
+        if pool is None or pool_tokenizers != tokenizers:
+            if pool is not None:
+                # its workers have the tokenizers registered before
+                pool.shutdown(wait=False)
+            if kind == "process":
+                pool = ProcessPoolExecutor(
+                    max_workers=max_workers,
+                    initializer=_register_tokenizers,
+                    initargs=(tokenizers,),
+                )
+            else:
+                pool = ThreadPoolExecutor(max_workers=max_workers)
+            _chunking_pools[kind, max_workers] = pool, tokenizers
+        return pool
+
+
+def _split_documents(docs: dict[str, str], parts: int) -> list[dict[str, str]]:
+    """Consecutive groups of documents with about the same amount of text"""
+    target = sum(len(content) for content in docs.values()) / parts
+    groups, group, size = [], {}, 0
+    for doc_key, content in docs.items():
+        group[doc_key] = content
+        size += len(content)
+        if size >= target:
+            groups.append(group)
+            group, size = {}, 0
+    if group:
+        groups.append(group)
+    return groups
+
+
+async def achunk_documents(
+    docs: dict[str, str], global_config: dict
+) -> dict[str, TextChunkSchema]:
+    """``chunk_documents`` off the event loop, so LLM calls in flight aren't
+    held up by tokenization.
+
+    Batches of at least ``chunking_parallel_min_chars`` characters are split
+    over the ``chunking_executor`` pool ("process" or "thread"), smaller ones
+    are chunked in a single worker thread; "inline" chunks in the loop.
+    """
+    with timed(get_collector(global_config), "insert.chunking_latency"):
+        return await _achunk_documents(docs, global_config)
+
+
+async def _achunk_documents(
+    docs: dict[str, str], global_config: dict
+) -> dict[str, TextChunkSchema]:
+    config = {name: global_config[name] for name in _CHUNKING_CONFIG}
+    executor = global_config["chunking_executor"]
+    if executor == "inline" or not docs:
+        return chunk_documents(docs, config)
+    loop = asyncio.get_running_loop()
+    total_chars = sum(len(content) for content in docs.values())
+    if len(docs) == 1 or total_chars < global_config["chunking_parallel_min_chars"]:
+        return await loop.run_in_executor(None, chunk_documents, docs, config)
+
+    max_workers = global_config["chunking_max_workers"] or os.cpu_count() or 1
+    pool = _get_chunking_pool(executor, max_workers)
+    # a few groups per worker even out documents of different sizes
+    results = await asyncio.gather(
+        *[
+            loop.run_in_executor(pool, chunk_documents, group, config)
+            for group in _split_documents(docs, max_workers * 4)
+        ]
+    )
+    chunks = {}
+    for result in results:
+        chunks.update(result)
+    return chunks
+
+
+def attach_chunk_ids(
+    docs: dict[str, dict], chunks: dict[str, TextChunkSchema]
+) -> dict[str, dict]:
+    """``docs`` with the ids of the ``chunks`` stored for each of them, which
+    are what deleting the document removes"""
+    chunk_ids = defaultdict(list)
+    for chunk_key, chunk in chunks.items():
+        chunk_ids[chunk["full_doc_id"]].append(chunk_key)
+    return {
+        doc_key: {**doc, "chunk_ids": chunk_ids[doc_key]}
+        for doc_key, doc in docs.items()
+    }
 
 
 async def _handle_entity_relation_summary(
@@ -59,9 +210,11 @@ async def _handle_entity_relation_summary(
     tiktoken_model_name = global_config["tiktoken_model_name"]
     summary_max_tokens = global_config["entity_summary_to_max_tokens"]
 
-    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
-    if len(tokens) < summary_max_tokens:  # No need for summary
+    if (
+        count_tokens(description, model_name=tiktoken_model_name) < summary_max_tokens
+    ):  # No need for summary
         return description
+    tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
     prompt_template = PROMPTS["summarize_entity_descriptions"]
     use_description = decode_tokens_by_tiktoken(
         tokens[:llm_max_tokens], model_name=tiktoken_model_name
@@ -72,7 +225,8 @@ async def _handle_entity_relation_summary(
     )
     use_prompt = prompt_template.format(**context_base)
     logger.debug(f"Trigger summary: {entity_or_relation_name}")
-    summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
+    with metric_tags(stage="summarize"):
+        summary = await use_llm_func(use_prompt, max_tokens=summary_max_tokens)
     return summary
 
 
@@ -123,223 +277,855 @@ async def _handle_single_relationship_extraction(
     )
 
 
-async def _merge_nodes_then_upsert(
+async def _merge_nodes(
     entity_name: str,
     nodes_data: list[dict],
     knowledge_graph_inst: BaseGraphStorage,
     global_config: dict,
-):
-    already_entitiy_types = []
-    already_source_ids = []
-    already_description = []
-
-    already_node = await knowledge_graph_inst.get_node(entity_name)
-    if already_node is not None:
-        already_entitiy_types.append(already_node["entity_type"])
-        already_source_ids.extend(
-            split_string_by_multi_markers(already_node["source_id"], [GRAPH_FIELD_SEP])
+    summarize: bool = True,
+) -> dict:
+    """Merge ``nodes_data`` into the node in the graph, holding its merge
+    lock; a description grown too long is summarized once it is released.
+    Returns the node as merged, before any summary."""
+    async with global_config["merge_locks"].hold([("node", entity_name)]):
+        already_entitiy_types = []
+        already_source_ids = []
+        already_description = []
+
+        already_node = await knowledge_graph_inst.get_node(entity_name)
+        if already_node is not None:
+            already_entitiy_types.append(already_node["entity_type"])
+            already_source_ids.extend(
+                split_string_by_multi_markers(
+                    already_node["source_id"], [GRAPH_FIELD_SEP]
+                )
+            )
+            already_description.append(already_node["description"])
+
+        entity_type = sorted(
+            Counter(
+                [dp["entity_type"] for dp in nodes_data] + already_entitiy_types
+            ).items(),
+            key=lambda x: x[1],
+            reverse=True,
+        )[0][0]
+        description = GRAPH_FIELD_SEP.join(
+            sorted(set([dp["description"] for dp in nodes_data] + already_description))
+        )
+        source_id = GRAPH_FIELD_SEP.join(
+            set([dp["source_id"] for dp in nodes_data] + already_source_ids)
+        )
+        node_data = dict(
+            entity_type=entity_type,
+            description=description,
+            description_tokens=count_tokens(
+                description, model_name=global_config["tiktoken_model_name"]
+            ),
+            source_id=source_id,
+        )
+        await knowledge_graph_inst.upsert_node(entity_name, node_data=node_data)
+    if summarize:
+        await _summarize_merged(
+            entity_name,
+            node_data,
+            [("node", entity_name)],
+            lambda: knowledge_graph_inst.get_node(entity_name),
+            lambda data: knowledge_graph_inst.upsert_node(entity_name, data),
+            global_config,
         )
-        already_description.append(already_node["description"])
-
-    entity_type = sorted(
-        Counter(
-            [dp["entity_type"] for dp in nodes_data] + already_entitiy_types
-        ).items(),
-        key=lambda x: x[1],
-        reverse=True,
-    )[0][0]
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in nodes_data] + already_description))
-    )
-    source_id = GRAPH_FIELD_SEP.join(
-        set([dp["source_id"] for dp in nodes_data] + already_source_ids)
-    )
-    description = await _handle_entity_relation_summary(
-        entity_name, description, global_config
-    )
-    node_data = dict(
-        entity_type=entity_type,
-        description=description,
-        source_id=source_id,
-    )
-    await knowledge_graph_inst.upsert_node(
-        entity_name,
-        node_data=node_data,
-    )
-    node_data["entity_name"] = entity_name
     return node_data
 
 
-async def _merge_edges_then_upsert(
+async def _merge_edges(
     src_id: str,
     tgt_id: str,
     edges_data: list[dict],
     knowledge_graph_inst: BaseGraphStorage,
     global_config: dict,
-):
-    already_weights = []
-    already_source_ids = []
-    already_description = []
-    already_keywords = []
-
-    if await knowledge_graph_inst.has_edge(src_id, tgt_id):
-        already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
-        already_weights.append(already_edge["weight"])
-        already_source_ids.extend(
-            split_string_by_multi_markers(already_edge["source_id"], [GRAPH_FIELD_SEP])
+    summarize: bool = True,
+) -> dict:
+    """Merge ``edges_data`` into the edge in the graph, adding placeholders
+    for endpoints the graph doesn't have, holding the merge locks of the
+    edge and its endpoints; a description grown too long is summarized once
+    they are released. Returns the edge as merged, before any summary."""
+    edge_key = ("edge", *sorted([src_id, tgt_id]))
+    async with global_config["merge_locks"].hold(
+        [edge_key, ("node", src_id), ("node", tgt_id)]
+    ):
+        already_weights = []
+        already_source_ids = []
+        already_description = []
+        already_keywords = []
+
+        if await knowledge_graph_inst.has_edge(src_id, tgt_id):
+            already_edge = await knowledge_graph_inst.get_edge(src_id, tgt_id)
+            already_weights.append(already_edge["weight"])
+            already_source_ids.extend(
+                split_string_by_multi_markers(
+                    already_edge["source_id"], [GRAPH_FIELD_SEP]
+                )
+            )
+            already_description.append(already_edge["description"])
+            already_keywords.extend(
+                split_string_by_multi_markers(
+                    already_edge["keywords"], [GRAPH_FIELD_SEP]
+                )
+            )
+
+        weight = sum([dp["weight"] for dp in edges_data] + already_weights)
+        description = GRAPH_FIELD_SEP.join(
+            sorted(set([dp["description"] for dp in edges_data] + already_description))
         )
-        already_description.append(already_edge["description"])
-        already_keywords.extend(
-            split_string_by_multi_markers(already_edge["keywords"], [GRAPH_FIELD_SEP])
+        keywords = GRAPH_FIELD_SEP.join(
+            sorted(set([dp["keywords"] for dp in edges_data] + already_keywords))
         )
-
-    weight = sum([dp["weight"] for dp in edges_data] + already_weights)
-    description = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["description"] for dp in edges_data] + already_description))
-    )
-    keywords = GRAPH_FIELD_SEP.join(
-        sorted(set([dp["keywords"] for dp in edges_data] + already_keywords))
-    )
-    source_id = GRAPH_FIELD_SEP.join(
-        set([dp["source_id"] for dp in edges_data] + already_source_ids)
-    )
-    for need_insert_id in [src_id, tgt_id]:
-        if not (await knowledge_graph_inst.has_node(need_insert_id)):
-            await knowledge_graph_inst.upsert_node(
-                need_insert_id,
-                node_data={
-                    "source_id": source_id,
-                    "description": description,
-                    "entity_type": '"UNKNOWN"',
-                },
-            )
-    description = await _handle_entity_relation_summary(
-        (src_id, tgt_id), description, global_config
-    )
-    await knowledge_graph_inst.upsert_edge(
-        src_id,
-        tgt_id,
-        edge_data=dict(
+        source_id = GRAPH_FIELD_SEP.join(
+            set([dp["source_id"] for dp in edges_data] + already_source_ids)
+        )
+        for need_insert_id in [src_id, tgt_id]:
+            if not (await knowledge_graph_inst.has_node(need_insert_id)):
+                await knowledge_graph_inst.upsert_node(
+                    need_insert_id,
+                    node_data={
+                        "source_id": source_id,
+                        "description": description,
+                        "entity_type": '"UNKNOWN"',
+                    },
+                )
+        edge_data = dict(
             weight=weight,
             description=description,
+            description_tokens=count_tokens(
+                description, model_name=global_config["tiktoken_model_name"]
+            ),
             keywords=keywords,
             source_id=source_id,
-        ),
-    )
+        )
+        await knowledge_graph_inst.upsert_edge(src_id, tgt_id, edge_data=edge_data)
+    if summarize:
+        await _summarize_merged(
+            (src_id, tgt_id),
+            edge_data,
+            [edge_key],
+            lambda: knowledge_graph_inst.get_edge(src_id, tgt_id),
+            lambda data: knowledge_graph_inst.upsert_edge(src_id, tgt_id, data),
+            global_config,
+        )
+    return edge_data
+
 
-    edge_data = dict(
-        src_id=src_id,
-        tgt_id=tgt_id,
-        description=description,
-        keywords=keywords,
+async def _summarize_merged(
+    entity_or_relation_name: Union[str, tuple[str, str]],
+    merged: dict,
+    lock_keys: list[tuple],
+    get_merged: Callable[[], Awaitable[Union[dict, None]]],
+    upsert_merged: Callable[[dict], Awaitable[None]],
+    global_config: dict,
+):
+    """Summarize the description of a node or edge just merged without
+    holding its merge locks, and write the summary back unless it was merged
+    into again meanwhile: that merge summarizes the longer description"""
+    summary = await _handle_entity_relation_summary(
+        entity_or_relation_name, merged["description"], global_config
     )
+    if summary == merged["description"]:
+        return
+    async with global_config["merge_locks"].hold(lock_keys):
+        current = await get_merged()
+        if current is None or current["description"] != merged["description"]:
+            return
+        current = dict(
+            current,
+            description=summary,
+            description_tokens=count_tokens(
+                summary, model_name=global_config["tiktoken_model_name"]
+            ),
+        )
+        await upsert_merged(current)
 
-    return edge_data
 
+class ExtractionRecordParser:
+    """Splits extraction output into records while it is generated: a record
+    is parsed into its attributes as soon as the delimiter closing it
+    arrives, so only the unfinished record is buffered.
 
-async def extract_entities(
-    chunks: dict[str, TextChunkSchema],
-    knowledge_graph_inst: BaseGraphStorage,
-    entity_vdb: BaseVectorStorage,
-    relationships_vdb: BaseVectorStorage,
+    The ``("text"<|><text_id>)`` records heading the output of each text of
+    a packed extraction come out as ``['"text"', text_id]``.
+    """
+
+    def __init__(self, context_base: dict):
+        self._tuple_delimiter = context_base["tuple_delimiter"]
+        self._delimiters = re.compile(
+            "|".join(
+                re.escape(context_base[k])
+                for k in ("record_delimiter", "completion_delimiter")
+            )
+        )
+        self._header = re.compile(
+            r'\(\s*"?text"?\s*'
+            + re.escape(self._tuple_delimiter)
+            + r'\s*"?([^"()]*?)"?\s*\)'
+        )
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[list[str]]:
+        """The attributes of the records ``text`` completes"""
+        self._buffer += text
+        records, start = [], 0
+        for match in self._delimiters.finditer(self._buffer):
+            records.extend(self._parse(self._buffer[start : match.start()]))
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return records
+
+    def close(self) -> list[list[str]]:
+        """The attributes of a last record without a delimiter after it"""
+        records = self._parse(self._buffer)
+        self._buffer = ""
+        return records
+
+    def _parse(self, record: str) -> list[list[str]]:
+        # the LLM doesn't always put a delimiter after a header
+        parts = self._header.split(record)
+        records = []
+        for i, part in enumerate(parts):
+            if i % 2:
+                records.append(['"text"', part.strip()])
+                continue
+            match = re.search(r"\((.*)\)", part.strip())
+            if match is not None:
+                records.append(
+                    split_string_by_multi_markers(
+                        match.group(1), [self._tuple_delimiter]
+                    )
+                )
+        return records
+
+
+def pack_chunks(
+    chunks: list[tuple[str, TextChunkSchema]], global_config: dict
+) -> list[list[tuple[str, TextChunkSchema]]]:
+    """Group consecutive chunks into the requests of a packed extraction, up
+    to ``entity_extract_pack_max_chunks`` chunks and
+    ``entity_extract_pack_max_tokens`` tokens each; larger chunks stay alone"""
+    max_chunks = global_config["entity_extract_pack_max_chunks"]
+    max_tokens = global_config["entity_extract_pack_max_tokens"]
+    groups, tokens = [], 0
+    for chunk_key, chunk_dp in chunks:
+        chunk_tokens = chunk_dp.get("tokens", 0)
+        if (
+            groups
+            and len(groups[-1]) < max_chunks
+            and tokens + chunk_tokens <= max_tokens
+        ):
+            groups[-1].append((chunk_key, chunk_dp))
+            tokens += chunk_tokens
+        else:
+            groups.append([(chunk_key, chunk_dp)])
+            tokens = chunk_tokens
+    return groups
+
+
+def _gleaning_stop_reason(
+    chunk_tokens: int,
+    round_records: list[int],
+    spent_tokens: int,
+    next_round_tokens: int,
     global_config: dict,
-) -> Union[BaseGraphStorage, None]:
+) -> Union[str, None]:
+    """Why another gleaning round isn't worth it, None if it is"""
+    if chunk_tokens < global_config["gleaning_min_chunk_tokens"]:
+        return "short_chunk"
+    if round_records[-1] < global_config["gleaning_min_new_records"]:
+        return "low_yield"
+    max_tokens = global_config["gleaning_max_tokens_per_chunk"]
+    if max_tokens > 0 and spent_tokens + next_round_tokens > max_tokens:
+        return "token_cap"
+    return None
+
+
+async def extract_chunk_entities(
+    chunk_key: str,
+    chunk_dp: TextChunkSchema,
+    global_config: dict,
+    journal: IngestionJournal = None,
+) -> tuple[dict, dict]:
+    """Run the extraction (and gleaning) prompts over a single chunk.
+
+    Returns the parsed nodes and edges keyed by entity name and (src, tgt).
+    When a journal is given, a result recorded by an earlier, interrupted run
+    is reused instead of calling the LLM again.
+    """
+    [result] = await extract_packed_entities(
+        [(chunk_key, chunk_dp)], global_config, journal=journal
+    )
+    return result
+
+
+async def extract_packed_entities(
+    chunks: list[tuple[str, TextChunkSchema]],
+    global_config: dict,
+    journal: IngestionJournal = None,
+) -> list[tuple[dict, dict]]:
+    """Extract several chunks in one request, so they share the instructions
+    and examples of the prompt (see ``pack_chunks``).
+
+    The records of each chunk follow a header record naming it; a chunk the
+    output has no header for is extracted again on its own. Returns the
+    nodes and edges of every chunk, in order.
+    """
+    results = {}
+    if journal is not None:
+        for chunk_key, chunk_dp in chunks:
+            recorded = journal.get_extraction(chunk_key)
+            if recorded is not None:
+                logger.info(f"Reuse journaled extraction of {chunk_key}")
+                chunk_dp.update(journal.get_extraction_stats(chunk_key))
+                results[chunk_key] = recorded
+    todo = [(k, v) for k, v in chunks if k not in results]
+    if todo:
+        extracted = await _extract_chunks(todo, global_config)
+        missing = [(k, v) for k, v in todo if k not in extracted]
+        if missing:
+            logger.warning(
+                f"Couldn't attribute the packed extraction of {len(missing)} "
+                "chunks, extract them one by one"
+            )
+            increment(
+                get_collector(global_config),
+                "extract.packed_fallbacks",
+                len(missing),
+            )
+            for (chunk_key, _), result in zip(
+                missing,
+                await asyncio.gather(
+                    *[_extract_chunks([item], global_config) for item in missing]
+                ),
+            ):
+                extracted[chunk_key] = result[chunk_key]
+        if journal is not None:
+            todo_dps = dict(todo)
+            for chunk_key, (maybe_nodes, maybe_edges) in extracted.items():
+                journal.record_extracted(
+                    chunk_key,
+                    maybe_nodes,
+                    maybe_edges,
+                    {
+                        k: todo_dps[chunk_key][k]
+                        for k in _EXTRACTION_STATS
+                        if k in todo_dps[chunk_key]
+                    },
+                )
+        results.update(extracted)
+    return [results[k] for k, _ in chunks]
+
+
+# per-chunk statistics of the extraction, journaled with its records
+_EXTRACTION_STATS = ("extraction_rounds", "extraction_tokens")
+
+
+async def _extract_chunks(
+    chunks: list[tuple[str, TextChunkSchema]], global_config: dict
+) -> dict[str, tuple[dict, dict]]:
+    """The extraction and gleaning rounds of one request, over a single chunk
+    or packed chunks; returns the results of the chunks that could be told
+    apart in the output"""
     use_llm_func: callable = global_config["llm_model_func"]
     entity_extract_max_gleaning = global_config["entity_extract_max_gleaning"]
+    tiktoken_model_name = global_config["tiktoken_model_name"]
+    collector = get_collector(global_config)
 
-    ordered_chunks = list(chunks.items())
-
-    entity_extract_prompt = PROMPTS["entity_extraction"]
     context_base = dict(
         tuple_delimiter=PROMPTS["DEFAULT_TUPLE_DELIMITER"],
         record_delimiter=PROMPTS["DEFAULT_RECORD_DELIMITER"],
         completion_delimiter=PROMPTS["DEFAULT_COMPLETION_DELIMITER"],
         entity_types=",".join(PROMPTS["DEFAULT_ENTITY_TYPES"]),
     )
-    continue_prompt = PROMPTS["entiti_continue_extraction"]
+    packed = len(chunks) > 1
+    # chunks are numbered in the prompt, their keys would cost more tokens
+    text_ids = {str(i + 1): chunk_key for i, (chunk_key, _) in enumerate(chunks)}
+    if packed:
+        hint_prompt = PROMPTS["entity_extraction_packed"].format(
+            **context_base,
+            input_text="\n".join(
+                f"-----Text {text_id}-----\n{chunk_dp['content']}"
+                for text_id, (_, chunk_dp) in zip(text_ids, chunks)
+            ),
+        )
+        continue_prompt = PROMPTS["entiti_continue_extraction_packed"].format(
+            **context_base
+        )
+    else:
+        hint_prompt = PROMPTS["entity_extraction"].format(
+            **context_base, input_text=chunks[0][1]["content"]
+        )
+        continue_prompt = PROMPTS["entiti_continue_extraction"]
     if_loop_prompt = PROMPTS["entiti_if_loop_extraction"]
 
-    already_processed = 0
-    already_entities = 0
-    already_relations = 0
+    maybe_nodes = {k: defaultdict(list) for k, _ in chunks}
+    maybe_edges = {k: defaultdict(list) for k, _ in chunks}
+    attributed = set() if packed else {chunks[0][0]}
+    # records each round added that no earlier round had found, per chunk
+    round_records = {k: [] for k, _ in chunks}
+    history_tokens, spent_tokens = 0, 0
+
+    async def _call(prompt: str, on_text: callable = None) -> str:
+        """One LLM call; with ``on_text`` the completion is streamed into it
+        if ``entity_extract_stream`` is set, else passed in one piece"""
+        nonlocal history, history_tokens, spent_tokens
+        kwargs = {"history_messages": history} if history else {}
+        if on_text is not None and global_config["entity_extract_stream"]:
+            kwargs["stream"] = True
+        response = await use_llm_func(prompt, **kwargs)
+        if isinstance(response, str):
+            result = response
+            if on_text is not None:
+                await on_text(result)
+        else:
+            pieces = []
+            try:
+                async for piece in response:
+                    pieces.append(piece)
+                    await on_text(piece)
+            finally:
+                # releases the concurrency slot if on_text failed mid-stream
+                await response.aclose()
+            result = "".join(pieces)
+        prompt_tokens = count_tokens(prompt, model_name=tiktoken_model_name)
+        result_tokens = count_tokens(result, model_name=tiktoken_model_name)
+        spent_tokens += history_tokens + prompt_tokens + result_tokens
+        if entity_extract_max_gleaning > 0:
+            # only gleaning rounds need the conversation so far
+            history = history + pack_user_ass_to_openai_messages(prompt, result)
+        history_tokens += prompt_tokens + result_tokens
+        return result
+
+    async def _extraction_round(prompt: str) -> int:
+        """Runs an extraction or gleaning round, adding its records as they
+        are generated; returns the number that no earlier round had found"""
+        parser = ExtractionRecordParser(context_base)
+        added = {k: 0 for k, _ in chunks}
+        # records are attributed to the text of the last header before them
+        current = None if packed else chunks[0][0]
+        dropped = 0
+
+        async def _add(records: list[list[str]]):
+            nonlocal current, dropped
+            for record_attributes in records:
+                if record_attributes[0] == '"text"':
+                    if packed:
+                        current = text_ids.get(record_attributes[1])
+                        if current is not None:
+                            attributed.add(current)
+                    continue
+                if current is None:
+                    dropped += 1
+                    continue
+                if_entities = await _handle_single_entity_extraction(
+                    record_attributes, current
+                )
+                if if_entities is not None:
+                    nodes = maybe_nodes[current]
+                    added[current] += if_entities["entity_name"] not in nodes
+                    nodes[if_entities["entity_name"]].append(if_entities)
+                    continue
+                if_relation = await _handle_single_relationship_extraction(
+                    record_attributes, current
+                )
+                if if_relation is not None:
+                    edges = maybe_edges[current]
+                    edge_key = (if_relation["src_id"], if_relation["tgt_id"])
+                    added[current] += edge_key not in edges
+                    edges[edge_key].append(if_relation)
+
+        await _call(prompt, on_text=lambda text: _add(parser.feed(text)))
+        await _add(parser.close())
+        if dropped:
+            logger.warning(
+                f"Drop {dropped} records of a packed extraction without a text"
+            )
+        round_index = len(next(iter(round_records.values())))
+        for chunk_key, _ in chunks:
+            observe(
+                collector,
+                "extract.round_records",
+                added[chunk_key],
+                round=str(round_index),
+            )
+            round_records[chunk_key].append(added[chunk_key])
+        return sum(added.values())
 
-    async def _process_single_content(chunk_key_dp: tuple[str, TextChunkSchema]):
-        nonlocal already_processed, already_entities, already_relations
-        chunk_key = chunk_key_dp[0]
-        chunk_dp = chunk_key_dp[1]
-        content = chunk_dp["content"]
-        hint_prompt = entity_extract_prompt.format(**context_base, input_text=content)
+    history = []
+    chunk_tokens = sum(chunk_dp.get("tokens", 0) for _, chunk_dp in chunks)
+    total_records = []
+    with metric_tags(stage="extract"):
         logger.info("Start LLM inference with hint prompt.")
-        final_result = await use_llm_func(hint_prompt)
+        total_records.append(await _extraction_round(hint_prompt))
         logger.info("Finished LLM inference with result")
 
-        history = pack_user_ass_to_openai_messages(hint_prompt, final_result)
         for now_glean_index in range(entity_extract_max_gleaning):
+            stop_reason = _gleaning_stop_reason(
+                chunk_tokens,
+                # a packed request gleans while the chunks together yield
+                [records / len(chunks) for records in total_records],
+                spent_tokens,
+                history_tokens
+                + count_tokens(continue_prompt, model_name=tiktoken_model_name),
+                global_config,
+            )
+            if stop_reason is not None:
+                increment(collector, "extract.gleaning_skipped", reason=stop_reason)
+                break
+            if now_glean_index > 0:
+                logger.info("Start LLM inference with if_loop_result.")
+                if_loop_result = await _call(if_loop_prompt)
+                logger.info("Finished LLM inference with if_loop_result")
+                if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
+                if if_loop_result != "yes":
+                    break
+
             logger.info("Start LLM inference with continue_prompt")
-            glean_result = await use_llm_func(continue_prompt, history_messages=history)
+            total_records.append(await _extraction_round(continue_prompt))
             logger.info("Finished LLM inference with glean_result")
 
-            history += pack_user_ass_to_openai_messages(continue_prompt, glean_result)
-            final_result += glean_result
-            if now_glean_index == entity_extract_max_gleaning - 1:
-                break
-            
-            logger.info("Start LLM inference with if_loop_result.")
-            if_loop_result: str = await use_llm_func(
-                if_loop_prompt, history_messages=history
+    results = {}
+    for chunk_key, chunk_dp in chunks:
+        if chunk_key not in attributed:
+            continue
+        # the per-round yield, to tune the gleaning settings against; packed
+        # chunks share the tokens of their request by size
+        chunk_dp["extraction_rounds"] = round_records[chunk_key]
+        chunk_dp["extraction_tokens"] = (
+            spent_tokens * chunk_dp.get("tokens", 0) // max(chunk_tokens, 1)
+            if packed
+            else spent_tokens
+        )
+        results[chunk_key] = (
+            dict(maybe_nodes[chunk_key]),
+            dict(maybe_edges[chunk_key]),
+        )
+    return results
+
+
+def _merge_lock_keys(
+    entity_names: Iterable[str], edge_keys: Iterable[tuple[str, str]]
+) -> list[tuple]:
+    """Keys of the ``merge_locks`` guarding read-modify-writes of entities
+    and (undirected) relationships"""
+    return [("node", name) for name in entity_names] + [
+        ("edge", *sorted(edge_key)) for edge_key in edge_keys
+    ]
+
+
+async def merge_extracted_entities(
+    maybe_nodes: dict[str, list[dict]],
+    maybe_edges: dict[tuple[str, str], list[dict]],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    summary_queue: BaseKVStorage = None,
+) -> tuple[list[dict], list[dict]]:
+    """Merge the records extracted from one or more chunks into the graph
+    and upsert the touched entities and relationships to the vector dbs.
+
+    With a ``summary_queue``, descriptions that grow too long are not
+    summarized right away but queued for ``summarize_queued_descriptions``.
+    """
+    with (
+        metric_tags(stage="merge"),
+        timed(get_collector(global_config), "insert.merge_latency"),
+    ):
+        return await _merge_extracted_entities(
+            maybe_nodes,
+            maybe_edges,
+            knowledge_graph_inst,
+            entity_vdb,
+            relationships_vdb,
+            global_config,
+            summary_queue,
+        )
+
+
+async def _merge_extracted_entities(
+    maybe_nodes: dict[str, list[dict]],
+    maybe_edges: dict[tuple[str, str], list[dict]],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    summary_queue: BaseKVStorage = None,
+) -> tuple[list[dict], list[dict]]:
+    summarize = summary_queue is None
+    # each merge holds the locks of its own keys only, so merges sharing a
+    # hub entity wait for each other's graph writes but not summaries
+    merged_nodes = await asyncio.gather(
+        *[
+            _merge_nodes(k, v, knowledge_graph_inst, global_config, summarize)
+            for k, v in maybe_nodes.items()
+        ]
+    )
+    # after the nodes, so edges only add placeholders for nodes not extracted
+    merged_edges = await asyncio.gather(
+        *[
+            _merge_edges(k[0], k[1], v, knowledge_graph_inst, global_config, summarize)
+            for k, v in maybe_edges.items()
+        ]
+    )
+
+    if summary_queue is not None:
+        summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+        queued = {
+            compute_mdhash_id(k, prefix="ent-"): {"entity_name": k}
+            for k, node_data in zip(maybe_nodes, merged_nodes)
+            if node_data["description_tokens"] >= summary_max_tokens
+        }
+        queued.update(
+            {
+                compute_mdhash_id(k[0] + k[1], prefix="rel-"): {
+                    "src_id": k[0],
+                    "tgt_id": k[1],
+                }
+                for k, edge_data in zip(maybe_edges, merged_edges)
+                if edge_data["description_tokens"] >= summary_max_tokens
+            }
+        )
+        if queued:
+            await summary_queue.upsert(queued)
+
+    # the vector dbs are written from what the graph has under the locks of
+    # all the keys, so they end up with the descriptions the graph ends up
+    # with; that is one batched embedding, no LLM call
+    async with global_config["merge_locks"].hold(
+        _merge_lock_keys(maybe_nodes, maybe_edges)
+    ):
+        nodes = await knowledge_graph_inst.get_nodes_batch(list(maybe_nodes))
+        edges = await knowledge_graph_inst.get_edges_batch(list(maybe_edges))
+        # merged into by a deletion since, which dropped or rewrote them
+        all_entities_data = [
+            {**node_data, "entity_name": k}
+            for k, node_data in zip(maybe_nodes, nodes)
+            if node_data is not None
+        ]
+        all_relationships_data = [
+            dict(
+                src_id=k[0],
+                tgt_id=k[1],
+                description=edge_data["description"],
+                keywords=edge_data["keywords"],
             )
-            logger.info("Finished LLM inference with if_loop_result")
-            if_loop_result = if_loop_result.strip().strip('"').strip("'").lower()
-            if if_loop_result != "yes":
-                break
+            for k, edge_data in zip(maybe_edges, edges)
+            if edge_data is not None
+        ]
+        if entity_vdb is not None and len(all_entities_data):
+            data_for_vdb = {
+                compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
+                    "content": dp["entity_name"] + dp["description"],
+                    "entity_name": dp["entity_name"],
+                }
+                for dp in all_entities_data
+            }
+            await entity_vdb.upsert(data_for_vdb)
+
+        if relationships_vdb is not None and len(all_relationships_data):
+            data_for_vdb = {
+                compute_mdhash_id(dp["src_id"] + dp["tgt_id"], prefix="rel-"): {
+                    "src_id": dp["src_id"],
+                    "tgt_id": dp["tgt_id"],
+                    "content": dp["keywords"]
+                    + dp["src_id"]
+                    + dp["tgt_id"]
+                    + dp["description"],
+                }
+                for dp in all_relationships_data
+            }
+            await relationships_vdb.upsert(data_for_vdb)
+
+    return all_entities_data, all_relationships_data
 
-        records = split_string_by_multi_markers(
-            final_result,
-            [context_base["record_delimiter"], context_base["completion_delimiter"]],
+
+async def summarize_queued_descriptions(
+    summary_queue: BaseKVStorage,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+) -> int:
+    """Summarize the descriptions queued by merges, each once however often
+    it grew since, ``entity_summary_batch_size`` of them per LLM request.
+
+    Returns the number of entities and relationships summarized.
+    """
+    keys = await summary_queue.all_keys()
+    if not keys:
+        return 0
+    entries = await summary_queue.get_by_ids(keys)
+    queued = [(k, entry) for k, entry in zip(keys, entries) if entry is not None]
+    batch_size = max(global_config["entity_summary_batch_size"], 1)
+    with metric_tags(stage="summarize"):
+        summarized = await asyncio.gather(
+            *[
+                _summarize_queued_group(
+                    queued[i : i + batch_size],
+                    summary_queue,
+                    knowledge_graph_inst,
+                    entity_vdb,
+                    relationships_vdb,
+                    global_config,
+                )
+                for i in range(0, len(queued), batch_size)
+            ]
         )
+    logger.info(f"Summarized {sum(summarized)} queued descriptions")
+    return sum(summarized)
 
-        maybe_nodes = defaultdict(list)
-        maybe_edges = defaultdict(list)
-        for record in records:
-            record = re.search(r"\((.*)\)", record)
-            if record is None:
-                continue
-            record = record.group(1)
-            record_attributes = split_string_by_multi_markers(
-                record, [context_base["tuple_delimiter"]]
+
+async def _summarize_queued_group(
+    queued: list[tuple[str, dict]],
+    summary_queue: BaseKVStorage,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+) -> int:
+    entity_names = [e["entity_name"] for _, e in queued if "entity_name" in e]
+    edge_keys = [(e["src_id"], e["tgt_id"]) for _, e in queued if "src_id" in e]
+    # merges of these keys wait, so the summary replaces what the graph has
+    async with global_config["merge_locks"].hold(
+        _merge_lock_keys(entity_names, edge_keys)
+    ):
+        nodes = await knowledge_graph_inst.get_nodes_batch(entity_names)
+        edges = await knowledge_graph_inst.get_edges_batch(edge_keys)
+        summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+        tiktoken_model_name = global_config["tiktoken_model_name"]
+        # skip what was deleted since, or summarized by a deletion rebuilding it
+        nodes = {
+            k: node
+            for k, node in zip(entity_names, nodes)
+            if node is not None
+            and _description_tokens(node, tiktoken_model_name) >= summary_max_tokens
+        }
+        edges = {
+            k: edge
+            for k, edge in zip(edge_keys, edges)
+            if edge is not None
+            and _description_tokens(edge, tiktoken_model_name) >= summary_max_tokens
+        }
+        summaries = await _summarize_descriptions(
+            [(k, node["description"]) for k, node in nodes.items()]
+            + [(k, edge["description"]) for k, edge in edges.items()],
+            global_config,
+        )
+        for node_or_edge, summary in zip(
+            list(nodes.values()) + list(edges.values()), summaries
+        ):
+            node_or_edge["description"] = summary
+            node_or_edge["description_tokens"] = count_tokens(
+                summary, model_name=tiktoken_model_name
             )
-            if_entities = await _handle_single_entity_extraction(
-                record_attributes, chunk_key
+        await knowledge_graph_inst.upsert_nodes_batch(nodes)
+        await knowledge_graph_inst.upsert_edges_batch(edges)
+        if entity_vdb is not None and nodes:
+            await entity_vdb.upsert(
+                {
+                    compute_mdhash_id(k, prefix="ent-"): {
+                        "content": k + node["description"],
+                        "entity_name": k,
+                    }
+                    for k, node in nodes.items()
+                }
             )
-            if if_entities is not None:
-                maybe_nodes[if_entities["entity_name"]].append(if_entities)
-                continue
-
-            if_relation = await _handle_single_relationship_extraction(
-                record_attributes, chunk_key
+        if relationships_vdb is not None and edges:
+            await relationships_vdb.upsert(
+                {
+                    compute_mdhash_id(k[0] + k[1], prefix="rel-"): {
+                        "src_id": k[0],
+                        "tgt_id": k[1],
+                        "content": edge["keywords"] + k[0] + k[1] + edge["description"],
+                    }
+                    for k, edge in edges.items()
+                }
             )
-            if if_relation is not None:
-                maybe_edges[(if_relation["src_id"], if_relation["tgt_id"])].append(
-                    if_relation
-                )
-        already_processed += 1
-        already_entities += len(maybe_nodes)
-        already_relations += len(maybe_edges)
-        now_ticks = PROMPTS["process_tickers"][
-            already_processed % len(PROMPTS["process_tickers"])
+        await summary_queue.delete([k for k, _ in queued])
+    return len(nodes) + len(edges)
+
+
+async def _summarize_descriptions(
+    items: list[tuple[Union[str, tuple[str, str]], str]], global_config: dict
+) -> list[str]:
+    """Summaries of the descriptions of several entities or relationships,
+    asked for in one request; those the output has no summary for are
+    summarized one by one"""
+    if len(items) <= 1:
+        return [
+            await _handle_entity_relation_summary(name, description, global_config)
+            for name, description in items
         ]
-        print(
-            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
-            end="",
-            flush=True,
+    use_llm_func: callable = global_config["llm_model_func"]
+    tiktoken_model_name = global_config["tiktoken_model_name"]
+    summary_max_tokens = global_config["entity_summary_to_max_tokens"]
+    # the items share the context window
+    item_max_tokens = global_config["llm_model_max_token_size"] // len(items)
+    item_list = []
+    for i, (name, description) in enumerate(items):
+        tokens = encode_string_by_tiktoken(description, model_name=tiktoken_model_name)
+        use_description = decode_tokens_by_tiktoken(
+            tokens[:item_max_tokens], model_name=tiktoken_model_name
         )
-        return dict(maybe_nodes), dict(maybe_edges)
-
-    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
-    results = await asyncio.gather(
-        *[_process_single_content(c) for c in ordered_chunks]
+        item_list.append(
+            f"-----Item {i + 1}-----\nEntities: {name}\n"
+            f"Description List: {use_description.split(GRAPH_FIELD_SEP)}"
+        )
+    use_prompt = PROMPTS["summarize_entity_descriptions_packed"].format(
+        item_list="\n".join(item_list)
     )
-    print()  # clear the progress bar
+    logger.debug(f"Trigger summary of {len(items)} descriptions")
+    result = await use_llm_func(use_prompt, max_tokens=summary_max_tokens * len(items))
+    parts = re.split(r"-----\s*Summary\s*(\d+)\s*-----", result)
+    summaries = {}
+    for item_id, summary in zip(parts[1::2], parts[2::2]):
+        if summary.strip():
+            summaries[int(item_id) - 1] = summary.strip()
+    missing = [i for i in range(len(items)) if i not in summaries]
+    if missing:
+        increment(
+            get_collector(global_config), "summarize.packed_fallbacks", len(missing)
+        )
+        for i, summary in zip(
+            missing,
+            await asyncio.gather(
+                *[
+                    _handle_entity_relation_summary(*items[i], global_config)
+                    for i in missing
+                ]
+            ),
+        ):
+            summaries[i] = summary
+    return [summaries[i] for i in range(len(items))]
+
+
+async def record_chunk_extractions(
+    chunk_extractions: BaseKVStorage,
+    chunk_keys: list[str],
+    results: list[tuple[dict, dict]],
+):
+    """Keep what was extracted from every chunk, so the entities and
+    relationships of a chunk can be rebuilt once it is deleted.
+    """
+    if chunk_extractions is None:
+        return
+    await chunk_extractions.upsert(
+        {
+            chunk_key: pack_extraction(maybe_nodes, maybe_edges)
+            for chunk_key, (maybe_nodes, maybe_edges) in zip(chunk_keys, results)
+        }
+    )
+
+
+def combine_extracted_results(
+    results: list[tuple[dict, dict]],
+) -> tuple[dict, dict]:
+    """Group per-chunk extraction results by entity name and undirected edge"""
     maybe_nodes = defaultdict(list)
     maybe_edges = defaultdict(list)
     for m_nodes, m_edges in results:
@@ -347,75 +1133,362 @@ async def extract_entities(
             maybe_nodes[k].extend(v)
         for k, v in m_edges.items():
             maybe_edges[tuple(sorted(k))].extend(v)
-    all_entities_data = await asyncio.gather(
+    return maybe_nodes, maybe_edges
+
+
+async def remove_chunk_sources(
+    chunk_ids: list[str],
+    chunk_extractions: BaseKVStorage,
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+) -> tuple[int, int]:
+    """Strip deleted chunks from the ``source_id`` of what was extracted from
+    them. Relationships and entities left without sources are dropped, the
+    rest get their description rebuilt from their remaining chunks, which is
+    summarized without holding their merge locks, like a merge.
+
+    Returns the number of entities and relationships that were touched.
+    """
+    removed = set(chunk_ids)
+    records = await chunk_extractions.get_by_ids(chunk_ids)
+    entity_names, edge_keys = set(), set()
+    for chunk_id, record in zip(chunk_ids, records):
+        if record is None:
+            logger.warning(f"No extraction record of {chunk_id}, skip its entities")
+            continue
+        entity_names.update(dp["entity_name"] for dp in record["nodes"])
+        for dp in record["edges"]:
+            # endpoints may be placeholder nodes sourced by the edge alone
+            entity_names.update([dp["src_id"], dp["tgt_id"]])
+            edge_keys.add(tuple(sorted([dp["src_id"], dp["tgt_id"]])))
+
+    lock_keys = _merge_lock_keys(entity_names, edge_keys)
+    async with global_config["merge_locks"].hold(lock_keys):
+        (
+            deleted_entity_ids,
+            deleted_relation_ids,
+            nodes,
+            edges,
+        ) = await _strip_chunk_sources(
+            removed,
+            sorted(entity_names),
+            sorted(edge_keys),
+            chunk_extractions,
+            knowledge_graph_inst,
+            global_config,
+        )
+
+    await asyncio.gather(
         *[
-            _merge_nodes_then_upsert(k, v, knowledge_graph_inst, global_config)
-            for k, v in maybe_nodes.items()
+            _summarize_merged(
+                entity_name,
+                node,
+                [("node", entity_name)],
+                partial(knowledge_graph_inst.get_node, entity_name),
+                partial(knowledge_graph_inst.upsert_node, entity_name),
+                global_config,
+            )
+            for entity_name, node in nodes.items()
+        ],
+        *[
+            _summarize_merged(
+                edge_key,
+                edge,
+                _merge_lock_keys([], [edge_key]),
+                partial(knowledge_graph_inst.get_edge, *edge_key),
+                partial(knowledge_graph_inst.upsert_edge, *edge_key),
+                global_config,
+            )
+            for edge_key, edge in edges.items()
+        ],
+    )
+
+    async with global_config["merge_locks"].hold(lock_keys):
+        entities_for_vdb = {
+            compute_mdhash_id(entity_name, prefix="ent-"): {
+                "content": entity_name + node["description"],
+                "entity_name": entity_name,
+            }
+            for entity_name, node in zip(
+                nodes, await knowledge_graph_inst.get_nodes_batch(list(nodes))
+            )
+            if node is not None
+        }
+        relationships_for_vdb = {
+            compute_mdhash_id(src_id + tgt_id, prefix="rel-"): {
+                "src_id": src_id,
+                "tgt_id": tgt_id,
+                "content": edge["keywords"] + src_id + tgt_id + edge["description"],
+            }
+            for (src_id, tgt_id), edge in zip(
+                edges, await knowledge_graph_inst.get_edges_batch(list(edges))
+            )
+            if edge is not None
+        }
+        if deleted_entity_ids:
+            await entity_vdb.delete(deleted_entity_ids)
+        if entities_for_vdb:
+            await entity_vdb.upsert(entities_for_vdb)
+        if deleted_relation_ids:
+            await relationships_vdb.delete(deleted_relation_ids)
+        if relationships_for_vdb:
+            await relationships_vdb.upsert(relationships_for_vdb)
+    return (
+        len(deleted_entity_ids) + len(nodes),
+        len(deleted_relation_ids) // 2 + len(edges),
+    )
+
+
+async def _strip_chunk_sources(
+    removed: set[str],
+    entity_names: list[str],
+    edge_keys: list[tuple[str, str]],
+    chunk_extractions: BaseKVStorage,
+    knowledge_graph_inst: BaseGraphStorage,
+    global_config: dict,
+) -> tuple[list[str], list[str], dict[str, dict], dict[tuple[str, str], dict]]:
+    """Drop the edges and nodes left without sources and rewrite the others,
+    unsummarized, from their remaining sources. Returns the ids of the
+    deleted entities and relationships and the rewritten nodes and edges."""
+    tiktoken_model_name = global_config["tiktoken_model_name"]
+
+    def _remaining_sources(source_id: str) -> list[str]:
+        return [
+            k
+            for k in split_string_by_multi_markers(source_id, [GRAPH_FIELD_SEP])
+            if k not in removed
         ]
+
+    async def _get_records(source_ids: Iterable[str]) -> dict[str, dict]:
+        source_ids = sorted(set(source_ids))
+        return dict(zip(source_ids, await chunk_extractions.get_by_ids(source_ids)))
+
+    deleted_relation_ids, edges = [], {}
+    current_edges = await knowledge_graph_inst.get_edges_batch(edge_keys)
+    edge_sources = {
+        edge_key: _remaining_sources(edge["source_id"])
+        for edge_key, edge in zip(edge_keys, current_edges)
+        if edge is not None
+    }
+    records = await _get_records(k for ks in edge_sources.values() for k in ks)
+    for (src_id, tgt_id), edge in zip(edge_keys, current_edges):
+        if edge is None:
+            continue
+        source_ids = edge_sources[(src_id, tgt_id)]
+        if not source_ids:
+            await knowledge_graph_inst.delete_edge(src_id, tgt_id)
+            deleted_relation_ids += [
+                compute_mdhash_id(src_id + tgt_id, prefix="rel-"),
+                compute_mdhash_id(tgt_id + src_id, prefix="rel-"),
+            ]
+            continue
+        edges_data = [
+            dp
+            for k in source_ids
+            if records[k]
+            for dp in records[k]["edges"]
+            if tuple(sorted([dp["src_id"], dp["tgt_id"]])) == (src_id, tgt_id)
+        ]
+        edge = dict(edge)
+        if edges_data:
+            edge.update(
+                weight=sum(dp["weight"] for dp in edges_data),
+                description=GRAPH_FIELD_SEP.join(
+                    sorted(set(dp["description"] for dp in edges_data))
+                ),
+                keywords=GRAPH_FIELD_SEP.join(
+                    sorted(set(dp["keywords"] for dp in edges_data))
+                ),
+            )
+        edge["source_id"] = GRAPH_FIELD_SEP.join(source_ids)
+        edge["description_tokens"] = count_tokens(
+            edge["description"], model_name=tiktoken_model_name
+        )
+        await knowledge_graph_inst.upsert_edge(src_id, tgt_id, edge_data=edge)
+        edges[(src_id, tgt_id)] = edge
+
+    # read after the edges above were rewritten or dropped
+    current_nodes = await knowledge_graph_inst.get_nodes_batch(entity_names)
+    nodes_edges = await knowledge_graph_inst.get_nodes_edges_batch(entity_names)
+    node_sources = {
+        entity_name: _remaining_sources(node["source_id"])
+        for entity_name, node in zip(entity_names, current_nodes)
+        if node is not None
+    }
+    records = await _get_records(k for ks in node_sources.values() for k in ks)
+    # the relationships still linking nodes left without sources of their own
+    linking_pairs = sorted(
+        {
+            pair
+            for entity_name, node_edges in zip(entity_names, nodes_edges)
+            if entity_name in node_sources and not node_sources[entity_name]
+            for pair in node_edges or []
+        }
     )
-    all_relationships_data = await asyncio.gather(
-        *[
-            _merge_edges_then_upsert(k[0], k[1], v, knowledge_graph_inst, global_config)
-            for k, v in maybe_edges.items()
+    linking_edges = dict(
+        zip(linking_pairs, await knowledge_graph_inst.get_edges_batch(linking_pairs))
+    )
+
+    deleted_entity_ids, nodes = [], {}
+    for entity_name, node, node_edges in zip(entity_names, current_nodes, nodes_edges):
+        if node is None:
+            continue
+        source_ids = node_sources[entity_name]
+        if not source_ids and not node_edges:
+            await knowledge_graph_inst.delete_node(entity_name)
+            deleted_entity_ids.append(compute_mdhash_id(entity_name, prefix="ent-"))
+            continue
+        node = dict(node)
+        if source_ids:
+            nodes_data = [
+                dp
+                for k in source_ids
+                if records[k]
+                for dp in records[k]["nodes"]
+                if dp["entity_name"] == entity_name
+            ]
+            if nodes_data:
+                node.update(
+                    entity_type=Counter(
+                        dp["entity_type"] for dp in nodes_data
+                    ).most_common(1)[0][0],
+                    description=GRAPH_FIELD_SEP.join(
+                        sorted(set(dp["description"] for dp in nodes_data))
+                    ),
+                )
+        else:
+            # only linked by relationships now: its own description came from
+            # the deleted chunks, rebuild it like the placeholder _merge_edges
+            # creates, from the relationships
+            linking = [
+                linking_edges[pair] for pair in node_edges if linking_edges[pair]
+            ]
+            source_ids = sorted(
+                {k for edge in linking for k in _remaining_sources(edge["source_id"])}
+            )
+            node.update(
+                entity_type='"UNKNOWN"',
+                description=GRAPH_FIELD_SEP.join(
+                    sorted(set(edge["description"] for edge in linking))
+                ),
+            )
+        node["source_id"] = GRAPH_FIELD_SEP.join(source_ids)
+        node["description_tokens"] = count_tokens(
+            node["description"], model_name=tiktoken_model_name
+        )
+        await knowledge_graph_inst.upsert_node(entity_name, node_data=node)
+        nodes[entity_name] = node
+    return deleted_entity_ids, deleted_relation_ids, nodes, edges
+
+
+async def extract_entities(
+    chunks: dict[str, TextChunkSchema],
+    knowledge_graph_inst: BaseGraphStorage,
+    entity_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    global_config: dict,
+    journal: IngestionJournal = None,
+    chunk_extractions: BaseKVStorage = None,
+    summary_queue: BaseKVStorage = None,
+    alias_index: EntityAliasIndex = None,
+) -> Union[BaseGraphStorage, None]:
+    ordered_chunks = list(chunks.items())
+
+    already_processed = 0
+    already_entities = 0
+    already_relations = 0
+
+    async def _process_packed_content(group: list[tuple[str, TextChunkSchema]]):
+        nonlocal already_processed, already_entities, already_relations
+        group_results = await extract_packed_entities(
+            group, global_config, journal=journal
+        )
+        already_processed += len(group)
+        for maybe_nodes, maybe_edges in group_results:
+            already_entities += len(maybe_nodes)
+            already_relations += len(maybe_edges)
+        now_ticks = PROMPTS["process_tickers"][
+            already_processed % len(PROMPTS["process_tickers"])
         ]
+        print(
+            f"{now_ticks} Processed {already_processed} chunks, {already_entities} entities(duplicated), {already_relations} relations(duplicated)\r",
+            end="",
+            flush=True,
+        )
+        return group_results
+
+    # use_llm_func is wrapped in ascynio.Semaphore, limiting max_async callings
+    results = [
+        result
+        for group_results in await asyncio.gather(
+            *[
+                _process_packed_content(group)
+                for group in pack_chunks(ordered_chunks, global_config)
+            ]
+        )
+        for result in group_results
+    ]
+    print()  # clear the progress bar
+    if alias_index is not None:
+        results = await canonicalize_extractions(
+            results,
+            alias_index,
+            knowledge_graph_inst,
+            entity_vdb,
+            get_collector(global_config),
+        )
+    await record_chunk_extractions(
+        chunk_extractions, [k for k, _ in ordered_chunks], results
     )
-    if not len(all_entities_data):
+    maybe_nodes, maybe_edges = combine_extracted_results(results)
+    if not len(maybe_nodes):
         logger.warning("Didn't extract any entities, maybe your LLM is not working")
         return None
-    if not len(all_relationships_data):
+    if not len(maybe_edges):
         logger.warning(
             "Didn't extract any relationships, maybe your LLM is not working"
         )
         return None
 
-    if entity_vdb is not None:
-        data_for_vdb = {
-            compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
-                "content": dp["entity_name"] + dp["description"],
-                "entity_name": dp["entity_name"],
-            }
-            for dp in all_entities_data
-        }
-        await entity_vdb.upsert(data_for_vdb)
-
-    if relationships_vdb is not None:
-        data_for_vdb = {
-            compute_mdhash_id(dp["src_id"] + dp["tgt_id"], prefix="rel-"): {
-                "src_id": dp["src_id"],
-                "tgt_id": dp["tgt_id"],
-                "content": dp["keywords"]
-                + dp["src_id"]
-                + dp["tgt_id"]
-                + dp["description"],
-            }
-            for dp in all_relationships_data
-        }
-        await relationships_vdb.upsert(data_for_vdb)
-
+    await merge_extracted_entities(
+        maybe_nodes,
+        maybe_edges,
+        knowledge_graph_inst,
+        entity_vdb,
+        relationships_vdb,
+        global_config,
+        summary_queue=summary_queue,
+    )
     return knowledge_graph_inst
 
 
-async def local_query(
-    query,
-    knowledge_graph_inst: BaseGraphStorage,
-    entities_vdb: BaseVectorStorage,
-    relationships_vdb: BaseVectorStorage,
-    text_chunks_db: BaseKVStorage[TextChunkSchema],
-    query_param: QueryParam,
-    global_config: dict,
-) -> str:
-    context = None
+async def _get_query_keywords(
+    query: str, global_config: dict, query_cache: QueryCache = None
+) -> Union[dict, None]:
+    """High and low level keywords of the query, None if the LLM's answer
+    can't be parsed"""
+    if query_cache is not None:
+        cache_key = QueryCache.keywords_key(query)
+        generation = await query_cache.current_generation()
+        keywords_data = await query_cache.get(cache_key)
+        increment(
+            get_collector(global_config),
+            "query_cache.hit" if keywords_data is not None else "query_cache.miss",
+            kind="keywords",
+        )
+        if keywords_data is not None:
+            return keywords_data
     use_model_func = global_config["llm_model_func"]
 
     kw_prompt_temp = PROMPTS["keywords_extraction"]
     kw_prompt = kw_prompt_temp.format(query=query)
-    result = await use_model_func(kw_prompt)
+    with metric_tags(stage="keywords"):
+        result = await use_model_func(kw_prompt)
     json_text = locate_json_string_body_from_string(result)
-
     try:
         keywords_data = json.loads(json_text)
-        keywords = keywords_data.get("low_level_keywords", [])
-        keywords = ", ".join(keywords)
     except json.JSONDecodeError:
         try:
             result = (
@@ -425,22 +1498,159 @@ async def local_query(
                 .strip()
             )
             result = "{" + result.split("{")[1].split("}")[0] + "}"
-
             keywords_data = json.loads(result)
-            keywords = keywords_data.get("low_level_keywords", [])
-            keywords = ", ".join(keywords)
         # Handle parsing error
         except json.JSONDecodeError as e:
             print(f"JSON parsing error: {e}")
-            return PROMPTS["fail_response"]
-    if keywords:
-        context = await _build_local_query_context(
-            keywords,
-            knowledge_graph_inst,
-            entities_vdb,
-            text_chunks_db,
-            query_param,
+            return None
+    keywords_data = {
+        "high_level_keywords": keywords_data.get("high_level_keywords", []),
+        "low_level_keywords": keywords_data.get("low_level_keywords", []),
+    }
+    if query_cache is not None:
+        await query_cache.put(cache_key, keywords_data, generation)
+    return keywords_data
+
+
+async def _get_cached_context(
+    query: str,
+    query_param: QueryParam,
+    global_config: dict,
+    query_cache: QueryCache = None,
+) -> tuple[Union[str, None], Union[str, None]]:
+    """The cached context of the query if any, and the index generation a
+    newly built one belongs to"""
+    if query_cache is None:
+        return None, None
+    generation = await query_cache.current_generation()
+    context = await query_cache.get(QueryCache.context_key(query, query_param))
+    increment(
+        get_collector(global_config),
+        "query_cache.hit" if context is not None else "query_cache.miss",
+        kind="context",
+    )
+    return context, generation
+
+
+async def _cache_context(
+    query: str,
+    query_param: QueryParam,
+    query_cache: Union[QueryCache, None],
+    context: Union[str, None],
+    generation: Union[str, None],
+):
+    if query_cache is None or context is None:
+        return
+    await query_cache.put(
+        QueryCache.context_key(query, query_param), context, generation
+    )
+
+
+class _GraphLookupCache:
+    """Read-only view of a graph storage that fetches every node, edge,
+    degree and adjacency list once per query, even when it is requested
+    again while the first lookup is still running. Lookups go through the
+    storage's batched methods, one call for all keys not fetched yet.
+    """
+
+    def __init__(self, graph: BaseGraphStorage):
+        self._graph = graph
+        self._lookups: dict[tuple, asyncio.Future] = {}
+
+    async def _lookup_batch(self, method: str, keys: list) -> list:
+        missing = list(
+            dict.fromkeys(k for k in keys if (method, k) not in self._lookups)
         )
+        if missing:
+            loop = asyncio.get_event_loop()
+            futures = [loop.create_future() for _ in missing]
+            for key, future in zip(missing, futures):
+                self._lookups[(method, key)] = future
+            try:
+                results = await getattr(self._graph, method)(missing)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                    # whoever awaits it sees the error, nobody else has to
+                    future.exception()
+                raise
+            for future, result in zip(futures, results):
+                future.set_result(result)
+        return await asyncio.gather(*[self._lookups[(method, k)] for k in keys])
+
+    def get_nodes_batch(self, node_ids: list[str]):
+        return self._lookup_batch("get_nodes_batch", node_ids)
+
+    def node_degrees_batch(self, node_ids: list[str]):
+        return self._lookup_batch("node_degrees_batch", node_ids)
+
+    def get_edges_batch(self, pairs: list[tuple[str, str]]):
+        return self._lookup_batch("get_edges_batch", [tuple(p) for p in pairs])
+
+    def get_nodes_edges_batch(self, node_ids: list[str]):
+        return self._lookup_batch("get_nodes_edges_batch", node_ids)
+
+    async def edge_degrees_batch(self, pairs: list[tuple[str, str]]) -> list[int]:
+        """Degree of the source plus degree of the target, as edge_degree"""
+        degrees = await self.node_degrees_batch([n for pair in pairs for n in pair])
+        return [
+            (degrees[2 * i] or 0) + (degrees[2 * i + 1] or 0) for i in range(len(pairs))
+        ]
+
+
+async def _embed_query_keywords(
+    keywords: list[str], vdbs: list[BaseVectorStorage]
+) -> list[Union[np.ndarray, None]]:
+    """Embed the keywords searched in each of ``vdbs`` in a single call.
+
+    Returns None for a branch without keywords, and for all of them if the
+    storages use different embedding functions.
+    """
+    to_embed = [k for k in keywords if k]
+    if len(to_embed) < 2 or len({id(vdb.embedding_func) for vdb in vdbs}) > 1:
+        return [None] * len(keywords)
+    embeddings = iter(await vdbs[0].embedding_func(to_embed))
+    return [next(embeddings) if k else None for k in keywords]
+
+
+async def local_query(
+    query,
+    knowledge_graph_inst: BaseGraphStorage,
+    entities_vdb: BaseVectorStorage,
+    relationships_vdb: BaseVectorStorage,
+    text_chunks_db: BaseKVStorage[TextChunkSchema],
+    query_param: QueryParam,
+    global_config: dict,
+    query_cache: QueryCache = None,
+) -> str:
+    use_model_func = global_config["llm_model_func"]
+
+    context, generation = await _get_cached_context(
+        query, query_param, global_config, query_cache
+    )
+    if context is None:
+        keywords_data = await _get_query_keywords(query, global_config, query_cache)
+        if keywords_data is None:
+            return PROMPTS["fail_response"]
+        keywords = ", ".join(keywords_data.get("low_level_keywords", []))
+        if keywords:
+            with (
+                metric_tags(stage="context"),
+                timed(
+                    get_collector(global_config), "query.context_build", context="local"
+                ),
+            ):
+                query_context = await _build_local_query_context(
+                    keywords,
+                    _GraphLookupCache(knowledge_graph_inst),
+                    entities_vdb,
+                    text_chunks_db,
+                    query_param,
+                    global_config["tiktoken_model_name"],
+                )
+            if query_context is not None:
+                context = query_context.render()
+        await _cache_context(query, query_param, query_cache, context, generation)
     if query_param.only_need_context:
         return context
     if context is None:
@@ -449,10 +1659,11 @@ async def local_query(
     sys_prompt = sys_prompt_temp.format(
         context_data=context, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with metric_tags(stage="answer"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
     if len(response) > len(sys_prompt):
         response = (
             response.replace(sys_prompt, "")
@@ -469,99 +1680,87 @@ async def local_query(
 
 async def _build_local_query_context(
     query,
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
     entities_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    tiktoken_model_name: str,
+    query_embedding: np.ndarray = None,
 ):
-    results = await entities_vdb.query(query, top_k=query_param.top_k)
+    if query_embedding is not None:
+        results = await entities_vdb.query_by_embedding(
+            query_embedding, top_k=query_param.top_k
+        )
+    else:
+        results = await entities_vdb.query(query, top_k=query_param.top_k)
 
     if not len(results):
         return None
-    node_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(r["entity_name"]) for r in results]
+    entity_names = [r["entity_name"] for r in results]
+    node_datas, node_degrees = await asyncio.gather(
+        knowledge_graph_inst.get_nodes_batch(entity_names),
+        knowledge_graph_inst.node_degrees_batch(entity_names),
     )
     if not all([n is not None for n in node_datas]):
         logger.warning("Some nodes are missing, maybe the storage is damaged")
-    node_degrees = await asyncio.gather(
-        *[knowledge_graph_inst.node_degree(r["entity_name"]) for r in results]
-    )
     node_datas = [
         {**n, "entity_name": k["entity_name"], "rank": d}
         for k, n, d in zip(results, node_datas, node_degrees)
         if n is not None
     ]  # what is this text_chunks_db doing.  dont remember it in airvx.  check the diagram.
     use_text_units = await _find_most_related_text_unit_from_entities(
-        node_datas, query_param, text_chunks_db, knowledge_graph_inst
+        node_datas,
+        query_param,
+        text_chunks_db,
+        knowledge_graph_inst,
+        tiktoken_model_name,
     )
     use_relations = await _find_most_related_edges_from_entities(
-        node_datas, query_param, knowledge_graph_inst
+        node_datas, query_param, knowledge_graph_inst, tiktoken_model_name
     )
     logger.info(
         f"Local query uses {len(node_datas)} entites, {len(use_relations)} relations, {len(use_text_units)} text units"
     )
-    entites_section_list = [["id", "entity", "type", "description", "rank"]]
-    for i, n in enumerate(node_datas):
-        entites_section_list.append(
-            [
-                i,
-                n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN"),
-                n["rank"],
-            ]
-        )
-    entities_context = list_of_list_to_csv(entites_section_list)
-
-    relations_section_list = [
-        ["id", "source", "target", "description", "keywords", "weight", "rank"]
-    ]
-    for i, e in enumerate(use_relations):
-        relations_section_list.append(
-            [
-                i,
-                e["src_tgt"][0],
-                e["src_tgt"][1],
-                e["description"],
-                e["keywords"],
-                e["weight"],
-                e["rank"],
-            ]
-        )
-    relations_context = list_of_list_to_csv(relations_section_list)
-
-    text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
-        text_units_section_list.append([i, t["content"]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
-    return f"""
------Entities-----
-```csv
-{entities_context}
-```
------Relationships-----
-```csv
-{relations_context}
-```
------Sources-----
-```csv
-{text_units_context}
-```
-"""
+    return QueryContext(
+        entities=[
+            ContextEntity(
+                entity_name=n["entity_name"],
+                entity_type=n.get("entity_type", "UNKNOWN"),
+                description=n.get("description", "UNKNOWN"),
+                rank=n["rank"],
+                tokens=_description_tokens(n, tiktoken_model_name),
+            )
+            for n in node_datas
+        ],
+        relations=[
+            ContextRelation(
+                src_id=e["src_tgt"][0],
+                tgt_id=e["src_tgt"][1],
+                description=e["description"],
+                keywords=e["keywords"],
+                weight=e["weight"],
+                rank=e["rank"],
+                tokens=_description_tokens(e, tiktoken_model_name),
+            )
+            for e in use_relations
+        ],
+        text_units=use_text_units,
+    )
 
 
 async def _find_most_related_text_unit_from_entities(
     node_datas: list[dict],
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
+    tiktoken_model_name: str,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
         for dp in node_datas
     ]
-    edges = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
+    edges = await knowledge_graph_inst.get_nodes_edges_batch(
+        [dp["entity_name"] for dp in node_datas]
     )
     all_one_hop_nodes = set()
     for this_edges in edges:
@@ -570,8 +1769,8 @@ async def _find_most_related_text_unit_from_entities(
         all_one_hop_nodes.update([e[1] for e in this_edges])
 
     all_one_hop_nodes = list(all_one_hop_nodes)
-    all_one_hop_nodes_data = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(e) for e in all_one_hop_nodes]
+    all_one_hop_nodes_data = await knowledge_graph_inst.get_nodes_batch(
+        all_one_hop_nodes
     )
 
     # Add null check for node data
@@ -581,6 +1780,10 @@ async def _find_most_related_text_unit_from_entities(
         if v is not None and "source_id" in v  # Add source_id check
     }
 
+    chunk_datas = await _get_text_units(
+        [c_id for this_text_units in text_units for c_id in this_text_units],
+        text_chunks_db,
+    )
     all_text_units_lookup = {}
     for index, (this_text_units, this_edges) in enumerate(zip(text_units, edges)):
         for c_id in this_text_units:
@@ -595,7 +1798,7 @@ async def _find_most_related_text_unit_from_entities(
                     ):
                         relation_counts += 1
 
-            chunk_data = await text_chunks_db.get_by_id(c_id)
+            chunk_data = chunk_datas.get(c_id)
             if chunk_data is not None and "content" in chunk_data:  # Add content check
                 all_text_units_lookup[c_id] = {
                     "data": chunk_data,
@@ -622,19 +1825,55 @@ async def _find_most_related_text_unit_from_entities(
         all_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        token_count=lambda x: x["data"].get("tokens"),
+        model_name=tiktoken_model_name,
     )
 
-    all_text_units = [t["data"] for t in all_text_units]
-    return all_text_units
+    return [
+        ContextTextUnit(
+            id=t["id"],
+            content=t["data"]["content"],
+            tokens=t["data"].get("tokens")
+            or count_tokens(t["data"]["content"], model_name=tiktoken_model_name),
+        )
+        for t in all_text_units
+    ]
+
+
+def _description_tokens(data: dict, tiktoken_model_name: str) -> int:
+    """Stored token count of a node or edge description, counted for graphs
+    written before it was stored"""
+    return data.get("description_tokens") or count_tokens(
+        data.get("description", "UNKNOWN"), model_name=tiktoken_model_name
+    )
+
+
+async def _get_text_units(
+    chunk_ids: list[str], text_chunks_db: BaseKVStorage[TextChunkSchema]
+) -> dict[str, dict]:
+    """Content and token count of the given chunks in one read, by chunk id;
+    missing chunks are left out"""
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    if not chunk_ids:
+        return {}
+    chunk_datas = await text_chunks_db.get_by_ids(
+        chunk_ids, fields={"content", "tokens"}
+    )
+    return {
+        c_id: chunk_data
+        for c_id, chunk_data in zip(chunk_ids, chunk_datas)
+        if chunk_data is not None
+    }
 
 
 async def _find_most_related_edges_from_entities(
     node_datas: list[dict],
     query_param: QueryParam,
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
+    tiktoken_model_name: str,
 ):
-    all_related_edges = await asyncio.gather(
-        *[knowledge_graph_inst.get_node_edges(dp["entity_name"]) for dp in node_datas]
+    all_related_edges = await knowledge_graph_inst.get_nodes_edges_batch(
+        [dp["entity_name"] for dp in node_datas]
     )
     all_edges = []
     seen = set()
@@ -646,11 +1885,9 @@ async def _find_most_related_edges_from_entities(
                 seen.add(sorted_edge)
                 all_edges.append(sorted_edge)
 
-    all_edges_pack = await asyncio.gather(
-        *[knowledge_graph_inst.get_edge(e[0], e[1]) for e in all_edges]
-    )
-    all_edges_degree = await asyncio.gather(
-        *[knowledge_graph_inst.edge_degree(e[0], e[1]) for e in all_edges]
+    all_edges_pack, all_edges_degree = await asyncio.gather(
+        knowledge_graph_inst.get_edges_batch(all_edges),
+        knowledge_graph_inst.edge_degrees_batch(all_edges),
     )
     all_edges_data = [
         {"src_tgt": k, "rank": d, **v}
@@ -664,6 +1901,8 @@ async def _find_most_related_edges_from_entities(
         all_edges_data,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_global_context,
+        token_count=lambda x: x.get("description_tokens"),
+        model_name=tiktoken_model_name,
     )
     return all_edges_data
 
@@ -676,46 +1915,39 @@ async def global_query(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
+    query_cache: QueryCache = None,
 ) -> str:
-    context = None
     use_model_func = global_config["llm_model_func"]
 
-    kw_prompt_temp = PROMPTS["keywords_extraction"]
-    kw_prompt = kw_prompt_temp.format(query=query)
-    result = await use_model_func(kw_prompt)
-    json_text = locate_json_string_body_from_string(result)
-
-    try:
-        keywords_data = json.loads(json_text)
-        keywords = keywords_data.get("high_level_keywords", [])
-        keywords = ", ".join(keywords)
-    except json.JSONDecodeError:
-        try:
-            result = (
-                result.replace(kw_prompt[:-1], "")
-                .replace("user", "")
-                .replace("model", "")
-                .strip()
-            )
-            result = "{" + result.split("{")[1].split("}")[0] + "}"
-
-            keywords_data = json.loads(result)
-            keywords = keywords_data.get("high_level_keywords", [])
-            keywords = ", ".join(keywords)
-
-        except json.JSONDecodeError as e:
-            # Handle parsing error
-            print(f"JSON parsing error: {e}")
+    context, generation = await _get_cached_context(
+        query, query_param, global_config, query_cache
+    )
+    if context is None:
+        keywords_data = await _get_query_keywords(query, global_config, query_cache)
+        if keywords_data is None:
             return PROMPTS["fail_response"]
-    if keywords:
-        context = await _build_global_query_context(
-            keywords,
-            knowledge_graph_inst,
-            entities_vdb,
-            relationships_vdb,
-            text_chunks_db,
-            query_param,
-        )
+        keywords = ", ".join(keywords_data.get("high_level_keywords", []))
+        if keywords:
+            with (
+                metric_tags(stage="context"),
+                timed(
+                    get_collector(global_config),
+                    "query.context_build",
+                    context="global",
+                ),
+            ):
+                query_context = await _build_global_query_context(
+                    keywords,
+                    _GraphLookupCache(knowledge_graph_inst),
+                    entities_vdb,
+                    relationships_vdb,
+                    text_chunks_db,
+                    query_param,
+                    global_config["tiktoken_model_name"],
+                )
+            if query_context is not None:
+                context = query_context.render()
+        await _cache_context(query, query_param, query_cache, context, generation)
 
     if query_param.only_need_context:
         return context
@@ -726,10 +1958,11 @@ async def global_query(
     sys_prompt = sys_prompt_temp.format(
         context_data=context, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with metric_tags(stage="answer"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
     if len(response) > len(sys_prompt):
         response = (
             response.replace(sys_prompt, "")
@@ -746,26 +1979,32 @@ async def global_query(
 
 async def _build_global_query_context(
     keywords,
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
     entities_vdb: BaseVectorStorage,
     relationships_vdb: BaseVectorStorage,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
+    tiktoken_model_name: str,
+    query_embedding: np.ndarray = None,
 ):
-    results = await relationships_vdb.query(keywords, top_k=query_param.top_k)
+    if query_embedding is not None:
+        results = await relationships_vdb.query_by_embedding(
+            query_embedding, top_k=query_param.top_k
+        )
+    else:
+        results = await relationships_vdb.query(keywords, top_k=query_param.top_k)
 
     if not len(results):
         return None
 
-    edge_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_edge(r["src_id"], r["tgt_id"]) for r in results]
+    pairs = [(r["src_id"], r["tgt_id"]) for r in results]
+    edge_datas, edge_degree = await asyncio.gather(
+        knowledge_graph_inst.get_edges_batch(pairs),
+        knowledge_graph_inst.edge_degrees_batch(pairs),
     )
 
     if not all([n is not None for n in edge_datas]):
         logger.warning("Some edges are missing, maybe the storage is damaged")
-    edge_degree = await asyncio.gather(
-        *[knowledge_graph_inst.edge_degree(r["src_id"], r["tgt_id"]) for r in results]
-    )
     edge_datas = [
         {"src_id": k["src_id"], "tgt_id": k["tgt_id"], "rank": d, **v}
         for k, v, d in zip(results, edge_datas, edge_degree)
@@ -778,72 +2017,55 @@ async def _build_global_query_context(
         edge_datas,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_global_context,
+        token_count=lambda x: x.get("description_tokens"),
+        model_name=tiktoken_model_name,
     )
 
     use_entities = await _find_most_related_entities_from_relationships(
-        edge_datas, query_param, knowledge_graph_inst
+        edge_datas, query_param, knowledge_graph_inst, tiktoken_model_name
     )
     use_text_units = await _find_related_text_unit_from_relationships(
-        edge_datas, query_param, text_chunks_db, knowledge_graph_inst
+        edge_datas,
+        query_param,
+        text_chunks_db,
+        knowledge_graph_inst,
+        tiktoken_model_name,
     )
     logger.info(
         f"Global query uses {len(use_entities)} entites, {len(edge_datas)} relations, {len(use_text_units)} text units"
     )
-    relations_section_list = [
-        ["id", "source", "target", "description", "keywords", "weight", "rank"]
-    ]
-    for i, e in enumerate(edge_datas):
-        relations_section_list.append(
-            [
-                i,
-                e["src_id"],
-                e["tgt_id"],
-                e["description"],
-                e["keywords"],
-                e["weight"],
-                e["rank"],
-            ]
-        )
-    relations_context = list_of_list_to_csv(relations_section_list)
-
-    entites_section_list = [["id", "entity", "type", "description", "rank"]]
-    for i, n in enumerate(use_entities):
-        entites_section_list.append(
-            [
-                i,
-                n["entity_name"],
-                n.get("entity_type", "UNKNOWN"),
-                n.get("description", "UNKNOWN"),
-                n["rank"],
-            ]
-        )
-    entities_context = list_of_list_to_csv(entites_section_list)
-
-    text_units_section_list = [["id", "content"]]
-    for i, t in enumerate(use_text_units):
-        text_units_section_list.append([i, t["content"]])
-    text_units_context = list_of_list_to_csv(text_units_section_list)
-
-    return f"""
------Entities-----
-```csv
-{entities_context}
-```
------Relationships-----
-```csv
-{relations_context}
-```
------Sources-----
-```csv
-{text_units_context}
-```
-"""
+    return QueryContext(
+        entities=[
+            ContextEntity(
+                entity_name=n["entity_name"],
+                entity_type=n.get("entity_type", "UNKNOWN"),
+                description=n.get("description", "UNKNOWN"),
+                rank=n["rank"],
+                tokens=_description_tokens(n, tiktoken_model_name),
+            )
+            for n in use_entities
+        ],
+        relations=[
+            ContextRelation(
+                src_id=e["src_id"],
+                tgt_id=e["tgt_id"],
+                description=e["description"],
+                keywords=e["keywords"],
+                weight=e["weight"],
+                rank=e["rank"],
+                tokens=_description_tokens(e, tiktoken_model_name),
+            )
+            for e in edge_datas
+        ],
+        text_units=use_text_units,
+    )
 
 
 async def _find_most_related_entities_from_relationships(
     edge_datas: list[dict],
     query_param: QueryParam,
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
+    tiktoken_model_name: str,
 ):
     entity_names = []
     seen = set()
@@ -856,12 +2078,9 @@ async def _find_most_related_entities_from_relationships(
             entity_names.append(e["tgt_id"])
             seen.add(e["tgt_id"])
 
-    node_datas = await asyncio.gather(
-        *[knowledge_graph_inst.get_node(entity_name) for entity_name in entity_names]
-    )
-
-    node_degrees = await asyncio.gather(
-        *[knowledge_graph_inst.node_degree(entity_name) for entity_name in entity_names]
+    node_datas, node_degrees = await asyncio.gather(
+        knowledge_graph_inst.get_nodes_batch(entity_names),
+        knowledge_graph_inst.node_degrees_batch(entity_names),
     )
     node_datas = [
         {**n, "entity_name": k, "rank": d}
@@ -872,6 +2091,8 @@ async def _find_most_related_entities_from_relationships(
         node_datas,
         key=lambda x: x["description"],
         max_token_size=query_param.max_token_for_local_context,
+        token_count=lambda x: x.get("description_tokens"),
+        model_name=tiktoken_model_name,
     )
 
     return node_datas
@@ -881,37 +2102,51 @@ async def _find_related_text_unit_from_relationships(
     edge_datas: list[dict],
     query_param: QueryParam,
     text_chunks_db: BaseKVStorage[TextChunkSchema],
-    knowledge_graph_inst: BaseGraphStorage,
+    knowledge_graph_inst: _GraphLookupCache,
+    tiktoken_model_name: str,
 ):
     text_units = [
         split_string_by_multi_markers(dp["source_id"], [GRAPH_FIELD_SEP])
         for dp in edge_datas
     ]
 
+    chunk_datas = await _get_text_units(
+        [c_id for unit_list in text_units for c_id in unit_list], text_chunks_db
+    )
     all_text_units_lookup = {}
 
     for index, unit_list in enumerate(text_units):
         for c_id in unit_list:
             if c_id not in all_text_units_lookup:
                 all_text_units_lookup[c_id] = {
-                    "data": await text_chunks_db.get_by_id(c_id),
+                    "data": chunk_datas.get(c_id),
                     "order": index,
                 }
 
-    if any([v is None for v in all_text_units_lookup.values()]):
+    if any([v["data"] is None for v in all_text_units_lookup.values()]):
         logger.warning("Text chunks are missing, maybe the storage is damaged")
     all_text_units = [
-        {"id": k, **v} for k, v in all_text_units_lookup.items() if v is not None
+        {"id": k, **v}
+        for k, v in all_text_units_lookup.items()
+        if v["data"] is not None
     ]
     all_text_units = sorted(all_text_units, key=lambda x: x["order"])
     all_text_units = truncate_list_by_token_size(
         all_text_units,
         key=lambda x: x["data"]["content"],
         max_token_size=query_param.max_token_for_text_unit,
+        token_count=lambda x: x["data"].get("tokens"),
+        model_name=tiktoken_model_name,
     )
-    all_text_units: list[TextChunkSchema] = [t["data"] for t in all_text_units]
-
-    return all_text_units
+    return [
+        ContextTextUnit(
+            id=t["id"],
+            content=t["data"]["content"],
+            tokens=t["data"].get("tokens")
+            or count_tokens(t["data"]["content"], model_name=tiktoken_model_name),
+        )
+        for t in all_text_units
+    ]
 
 
 async def hybrid_query(
@@ -922,61 +2157,65 @@ async def hybrid_query(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
+    query_cache: QueryCache = None,
 ) -> str:
-    low_level_context = None
-    high_level_context = None
     use_model_func = global_config["llm_model_func"]
 
-    kw_prompt_temp = PROMPTS["keywords_extraction"]
-    kw_prompt = kw_prompt_temp.format(query=query)
-
-    result = await use_model_func(kw_prompt)
-    json_text = locate_json_string_body_from_string(result)
-    try:
-        keywords_data = json.loads(json_text)
-        hl_keywords = keywords_data.get("high_level_keywords", [])
-        ll_keywords = keywords_data.get("low_level_keywords", [])
-        hl_keywords = ", ".join(hl_keywords)
-        ll_keywords = ", ".join(ll_keywords)
-    except json.JSONDecodeError:
-        try:
-            result = (
-                result.replace(kw_prompt[:-1], "")
-                .replace("user", "")
-                .replace("model", "")
-                .strip()
-            )
-            result = "{" + result.split("{")[1].split("}")[0] + "}"
-            keywords_data = json.loads(result)
-            hl_keywords = keywords_data.get("high_level_keywords", [])
-            ll_keywords = keywords_data.get("low_level_keywords", [])
-            hl_keywords = ", ".join(hl_keywords)
-            ll_keywords = ", ".join(ll_keywords)
-        # Handle parsing error
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error: {e}")
+    context, generation = await _get_cached_context(
+        query, query_param, global_config, query_cache
+    )
+    if context is None:
+        keywords_data = await _get_query_keywords(query, global_config, query_cache)
+        if keywords_data is None:
             return PROMPTS["fail_response"]
+        hl_keywords = ", ".join(keywords_data.get("high_level_keywords", []))
+        ll_keywords = ", ".join(keywords_data.get("low_level_keywords", []))
+
+        collector = get_collector(global_config)
+        # both branches read the graph through one cache, so entities they
+        # have in common are fetched once
+        graph = _GraphLookupCache(knowledge_graph_inst)
+
+        async def _build_low_level_context():
+            if not ll_keywords:
+                return None
+            with timed(collector, "query.context_build", context="local"):
+                return await _build_local_query_context(
+                    ll_keywords,
+                    graph,
+                    entities_vdb,
+                    text_chunks_db,
+                    query_param,
+                    global_config["tiktoken_model_name"],
+                    query_embedding=ll_embedding,
+                )
 
-    if ll_keywords:
-        low_level_context = await _build_local_query_context(
-            ll_keywords,
-            knowledge_graph_inst,
-            entities_vdb,
-            text_chunks_db,
-            query_param,
-        )
+        async def _build_high_level_context():
+            if not hl_keywords:
+                return None
+            with timed(collector, "query.context_build", context="global"):
+                return await _build_global_query_context(
+                    hl_keywords,
+                    graph,
+                    entities_vdb,
+                    relationships_vdb,
+                    text_chunks_db,
+                    query_param,
+                    global_config["tiktoken_model_name"],
+                    query_embedding=hl_embedding,
+                )
 
-    if hl_keywords:
-        high_level_context = await _build_global_query_context(
-            hl_keywords,
-            knowledge_graph_inst,
-            entities_vdb,
-            relationships_vdb,
-            text_chunks_db,
-            query_param,
-        )
+        with metric_tags(stage="context"):
+            ll_embedding, hl_embedding = await _embed_query_keywords(
+                [ll_keywords, hl_keywords], [entities_vdb, relationships_vdb]
+            )
+            low_level_context, high_level_context = await asyncio.gather(
+                _build_low_level_context(), _build_high_level_context()
+            )
 
-    context = combine_contexts(high_level_context, low_level_context)
+            with timed(collector, "query.context_build", context="combine"):
+                context = combine_contexts(high_level_context, low_level_context)
+        await _cache_context(query, query_param, query_cache, context, generation)
 
     if query_param.only_need_context:
         return context
@@ -987,10 +2226,11 @@ async def hybrid_query(
     sys_prompt = sys_prompt_temp.format(
         context_data=context, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with metric_tags(stage="answer"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
     if len(response) > len(sys_prompt):
         response = (
             response.replace(sys_prompt, "")
@@ -1004,70 +2244,21 @@ async def hybrid_query(
     return sys_prompt, response
 
 
-def combine_contexts(high_level_context, low_level_context):
-    # Function to extract entities, relationships, and sources from context strings
-
-    def extract_sections(context):
-        entities_match = re.search(
-            r"-----Entities-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-        relationships_match = re.search(
-            r"-----Relationships-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-        sources_match = re.search(
-            r"-----Sources-----\s*```csv\s*(.*?)\s*```", context, re.DOTALL
-        )
-
-        entities = entities_match.group(1) if entities_match else ""
-        relationships = relationships_match.group(1) if relationships_match else ""
-        sources = sources_match.group(1) if sources_match else ""
-
-        return entities, relationships, sources
-
-    # Extract sections from both contexts
-
+def combine_contexts(
+    high_level_context: Union[QueryContext, None],
+    low_level_context: Union[QueryContext, None],
+) -> str:
     if high_level_context is None:
         warnings.warn(
             "High Level context is None. Return empty High entity/relationship/source"
         )
-        hl_entities, hl_relationships, hl_sources = "", "", ""
-    else:
-        hl_entities, hl_relationships, hl_sources = extract_sections(high_level_context)
-
+        high_level_context = QueryContext()
     if low_level_context is None:
         warnings.warn(
             "Low Level context is None. Return empty Low entity/relationship/source"
         )
-        ll_entities, ll_relationships, ll_sources = "", "", ""
-    else:
-        ll_entities, ll_relationships, ll_sources = extract_sections(low_level_context)
-
-    # Combine and deduplicate the entities
-    combined_entities = process_combine_contexts(hl_entities, ll_entities)
-
-    # Combine and deduplicate the relationships
-    combined_relationships = process_combine_contexts(
-        hl_relationships, ll_relationships
-    )
-
-    # Combine and deduplicate the sources
-    combined_sources = process_combine_contexts(hl_sources, ll_sources)
-
-    # Format the combined context
-    return f"""
------Entities-----
-```csv
-{combined_entities}
-```
------Relationships-----
-```csv
-{combined_relationships}
-```
------Sources-----
-```csv
-{combined_sources}
-```
-"""
+        low_level_context = QueryContext()
+    return high_level_context.merge(low_level_context).render()
 
 
 async def naive_query(
@@ -1076,31 +2267,46 @@ async def naive_query(
     text_chunks_db: BaseKVStorage[TextChunkSchema],
     query_param: QueryParam,
     global_config: dict,
+    query_cache: QueryCache = None,
 ):
     use_model_func = global_config["llm_model_func"]
-    results = await chunks_vdb.query(query, top_k=query_param.top_k)
-    if not len(results):
-        return PROMPTS["fail_response"]
-    chunks_ids = [r["id"] for r in results]
-    chunks = await text_chunks_db.get_by_ids(chunks_ids)
-
-    maybe_trun_chunks = truncate_list_by_token_size(
-        chunks,
-        key=lambda x: x["content"],
-        max_token_size=query_param.max_token_for_text_unit,
+    section, generation = await _get_cached_context(
+        query, query_param, global_config, query_cache
     )
-    logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
-    section = "--New Chunk--\n".join([c["content"] for c in maybe_trun_chunks])
+    if section is None:
+        with (
+            metric_tags(stage="context"),
+            timed(get_collector(global_config), "query.context_build", context="naive"),
+        ):
+            results = await chunks_vdb.query(query, top_k=query_param.top_k)
+            if not len(results):
+                return PROMPTS["fail_response"]
+            chunks_ids = [r["id"] for r in results]
+            chunks = [
+                c for c in await text_chunks_db.get_by_ids(chunks_ids) if c is not None
+            ]
+
+            maybe_trun_chunks = truncate_list_by_token_size(
+                chunks,
+                key=lambda x: x["content"],
+                max_token_size=query_param.max_token_for_text_unit,
+                token_count=lambda x: x.get("tokens"),
+                model_name=global_config["tiktoken_model_name"],
+            )
+            logger.info(f"Truncate {len(chunks)} to {len(maybe_trun_chunks)} chunks")
+            section = "--New Chunk--\n".join([c["content"] for c in maybe_trun_chunks])
+        await _cache_context(query, query_param, query_cache, section, generation)
     if query_param.only_need_context:
         return section
     sys_prompt_temp = PROMPTS["naive_rag_response"]
     sys_prompt = sys_prompt_temp.format(
         content_data=section, response_type=query_param.response_type
     )
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with metric_tags(stage="answer"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
 
     if len(response) > len(sys_prompt):
         response = (
@@ -1126,10 +2332,11 @@ async def direct_query(
 ):
     use_model_func = global_config["llm_model_func"]
     sys_prompt = ""
-    response = await use_model_func(
-        query,
-        system_prompt=sys_prompt,
-    )
+    with metric_tags(stage="answer"):
+        response = await use_model_func(
+            query,
+            system_prompt=sys_prompt,
+        )
 
     if len(response) > len(sys_prompt):
         response = (
@@ -0,0 +1,348 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Iterable, Union
+
+from .base import (
+    BaseGraphStorage,
+    BaseKVStorage,
+    BaseVectorStorage,
+    TextChunkSchema,
+)
+from .aliases import EntityAliasIndex, canonicalize_extractions
+from .dedup import (
+    NearDuplicateIndex,
+    link_near_duplicates,
+    staged_near_duplicates,
+)
+from .journal import IngestionJournal
+from .metrics import get_collector, increment, metric_tags
+from .operate import (
+    achunk_documents,
+    combine_extracted_results,
+    extract_packed_entities,
+    merge_extracted_entities,
+    pack_chunks,
+    record_chunk_extractions,
+)
+from .utils import compute_mdhash_id, logger
+
+# Marks the end of a stage's output; each downstream worker consumes one.
+_STAGE_DONE = object()
+
+
+async def _iterate_documents(
+    documents: Union[str, Iterable[str], AsyncIterable[str]],
+):
+    if isinstance(documents, str):
+        documents = [documents]
+    if hasattr(documents, "__aiter__"):
+        async for doc in documents:
+            yield doc
+    else:
+        for doc in documents:
+            yield doc
+
+
+async def _get_batch(queue: asyncio.Queue, max_size: int) -> tuple[list, bool]:
+    """Block for one item, then drain whatever else is ready up to max_size.
+
+    Returns the batch and whether the end-of-stage marker was reached.
+    """
+    item = await queue.get()
+    if item is _STAGE_DONE:
+        return [], True
+    batch = [item]
+    while len(batch) < max_size:
+        try:
+            item = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+        if item is _STAGE_DONE:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+@dataclass
+class IngestionPipeline:
+    """Streaming ingestion: chunk -> embed -> extract -> merge -> persist.
+
+    Every stage runs concurrently with the others and hands its output to the
+    next one through a bounded queue, so a slow stage applies backpressure
+    instead of letting the backlog grow in memory.
+    """
+
+    full_docs: BaseKVStorage
+    text_chunks: BaseKVStorage[TextChunkSchema]
+    chunks_vdb: BaseVectorStorage
+    entities_vdb: BaseVectorStorage
+    relationships_vdb: BaseVectorStorage
+    knowledge_graph_inst: BaseGraphStorage
+    global_config: dict
+    # coroutine function persisting all storages, e.g. LightRAG.aflush
+    checkpoint_func: callable
+    journal: IngestionJournal = None
+    chunk_extractions: BaseKVStorage = None
+    near_duplicates: NearDuplicateIndex = None
+    summary_queue: BaseKVStorage = None
+    alias_index: EntityAliasIndex = None
+
+    queue_size: int = 64
+    embed_max_async: int = 4
+    extract_max_async: int = 16
+    merge_batch_size: int = 32
+    checkpoint_interval: int = 256
+
+    stats: dict = field(
+        default_factory=lambda: {
+            "docs": 0,
+            "chunks": 0,
+            "embedded": 0,
+            "extracted": 0,
+            "merged": 0,
+            "checkpoints": 0,
+        }
+    )
+
+    def __post_init__(self):
+        self._pending_docs: dict[str, dict] = {}
+        self._seen_chunks: set[str] = set()
+        self._dirty = False
+
+    async def run(self, documents: Union[str, Iterable[str], AsyncIterable[str]]):
+        embed_queue = asyncio.Queue(maxsize=self.queue_size)
+        extract_queue = asyncio.Queue(maxsize=self.queue_size)
+        merge_queue = asyncio.Queue(maxsize=self.queue_size)
+        persist_queue = asyncio.Queue(maxsize=self.queue_size)
+
+        stages = [
+            self._run_stage(
+                [self._chunk_worker(documents, embed_queue)],
+                embed_queue,
+                self.embed_max_async,
+            ),
+            self._run_stage(
+                [
+                    self._embed_worker(embed_queue, extract_queue)
+                    for _ in range(self.embed_max_async)
+                ],
+                extract_queue,
+                self.extract_max_async,
+            ),
+            self._run_stage(
+                [
+                    self._extract_worker(extract_queue, merge_queue)
+                    for _ in range(self.extract_max_async)
+                ],
+                merge_queue,
+                1,
+            ),
+            self._run_stage(
+                [self._merge_worker(merge_queue, persist_queue)], persist_queue, 1
+            ),
+            self._run_stage([self._persist_worker(persist_queue)], None, 0),
+        ]
+        try:
+            async with staged_near_duplicates(
+                self._seen_chunks, self.near_duplicates, self.text_chunks
+            ):
+                await self._run_stages(stages)
+        finally:
+            if self._dirty:
+                await self._checkpoint()
+        logger.info(f"[Pipeline] finished: {self.stats}")
+        return self.stats
+
+    async def _run_stages(self, stages: list):
+        """Run the stages until all are done or one fails, which cancels the
+        others"""
+        tasks = [asyncio.ensure_future(s) for s in stages]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_stage(
+        self, workers: list, out_queue: Union[asyncio.Queue, None], downstream: int
+    ):
+        tasks = [asyncio.ensure_future(w) for w in workers]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # a failing worker stops its siblings, which would otherwise wait
+            # on their queues forever
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for _ in range(downstream):
+            await out_queue.put(_STAGE_DONE)
+
+    async def _chunk_worker(self, documents, out_queue: asyncio.Queue):
+        async for doc in _iterate_documents(documents):
+            content = doc.strip()
+            doc_key = compute_mdhash_id(content, prefix="doc-")
+            if doc_key in self._pending_docs:
+                continue
+            if not len(await self.full_docs.filter_keys([doc_key])):
+                logger.info(f"[Pipeline] {doc_key} is already in the storage")
+                continue
+            chunks = await achunk_documents({doc_key: content}, self.global_config)
+            _add_chunk_keys = await self.text_chunks.filter_keys(list(chunks.keys()))
+            chunks = {
+                k: v
+                for k, v in chunks.items()
+                if k in _add_chunk_keys and k not in self._seen_chunks
+            }
+            chunk_ids = list(chunks.keys())
+            self.stats["docs"] += 1
+            increment(get_collector(self.global_config), "insert.docs")
+            increment(get_collector(self.global_config), "insert.chunks", len(chunks))
+            if self.near_duplicates is not None and len(chunks):
+                chunks = await link_near_duplicates(
+                    chunks,
+                    self.near_duplicates,
+                    self.text_chunks,
+                    get_collector(self.global_config),
+                )
+            if not len(chunks):
+                await self.full_docs.upsert(
+                    {doc_key: {"content": content, "chunk_ids": chunk_ids}}
+                )
+                self._dirty = True
+                continue
+            self._pending_docs[doc_key] = {
+                "content": content,
+                "chunk_ids": chunk_ids,
+                "left": len(chunks),
+            }
+            self._seen_chunks.update(chunks.keys())
+            if self.journal is not None:
+                self.journal.record_chunked(chunks)
+            for item in chunks.items():
+                self.stats["chunks"] += 1
+                await out_queue.put(item)
+
+    async def _embed_worker(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        batch_size = self.global_config["embedding_batch_num"]
+        while True:
+            batch, finished = await _get_batch(in_queue, batch_size)
+            if batch:
+                self._dirty = True
+                to_embed = {
+                    k: v
+                    for k, v in batch
+                    if self.journal is None or not self.journal.is_embedded(k)
+                }
+                if len(to_embed):
+                    with metric_tags(stage="embed"):
+                        await self.chunks_vdb.upsert(to_embed)
+                    if self.journal is not None:
+                        self.journal.mark(list(to_embed.keys()), "embedded")
+                self.stats["embedded"] += len(batch)
+                for item in batch:
+                    await out_queue.put(item)
+            if finished:
+                return
+
+    async def _extract_worker(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        # packs what is ready, rather than waiting for chunks to fill a request
+        pack_max_chunks = self.global_config["entity_extract_pack_max_chunks"]
+        while True:
+            batch, finished = await _get_batch(in_queue, pack_max_chunks)
+            for group in pack_chunks(batch, self.global_config):
+                results = await extract_packed_entities(
+                    group, self.global_config, journal=self.journal
+                )
+                self.stats["extracted"] += len(group)
+                for (chunk_key, chunk_dp), (maybe_nodes, maybe_edges) in zip(
+                    group, results
+                ):
+                    await out_queue.put((chunk_key, chunk_dp, maybe_nodes, maybe_edges))
+            if finished:
+                return
+
+    async def _merge_worker(self, in_queue: asyncio.Queue, out_queue: asyncio.Queue):
+        # a single merger, so read-modify-write on the graph never interleaves
+        while True:
+            batch, finished = await _get_batch(in_queue, self.merge_batch_size)
+            if batch:
+                results = [(nodes, edges) for _, _, nodes, edges in batch]
+                if self.alias_index is not None:
+                    results = await canonicalize_extractions(
+                        results,
+                        self.alias_index,
+                        self.knowledge_graph_inst,
+                        self.entities_vdb,
+                        get_collector(self.global_config),
+                    )
+                await record_chunk_extractions(
+                    self.chunk_extractions,
+                    [chunk_key for chunk_key, _, _, _ in batch],
+                    results,
+                )
+                maybe_nodes, maybe_edges = combine_extracted_results(results)
+                await merge_extracted_entities(
+                    maybe_nodes,
+                    maybe_edges,
+                    self.knowledge_graph_inst,
+                    self.entities_vdb,
+                    self.relationships_vdb,
+                    self.global_config,
+                    summary_queue=self.summary_queue,
+                )
+                await self.text_chunks.upsert(
+                    {chunk_key: chunk_dp for chunk_key, chunk_dp, _, _ in batch}
+                )
+                await self._finish_docs([chunk_dp for _, chunk_dp, _, _ in batch])
+                if self.journal is not None:
+                    self.journal.mark(
+                        [chunk_key for chunk_key, _, _, _ in batch], "merged"
+                    )
+                if self.near_duplicates is not None:
+                    self.near_duplicates.confirm(
+                        [chunk_key for chunk_key, _, _, _ in batch]
+                    )
+                self.stats["merged"] += len(batch)
+                await out_queue.put(len(batch))
+            if finished:
+                return
+
+    async def _finish_docs(self, chunk_dps: list[TextChunkSchema]):
+        finished_docs = {}
+        for chunk_dp in chunk_dps:
+            doc_key = chunk_dp["full_doc_id"]
+            doc = self._pending_docs[doc_key]
+            doc["left"] -= 1
+            if doc["left"] == 0:
+                finished_docs[doc_key] = {
+                    "content": doc["content"],
+                    "chunk_ids": doc["chunk_ids"],
+                }
+                self._pending_docs.pop(doc_key)
+        if finished_docs:
+            await self.full_docs.upsert(finished_docs)
+
+    async def _persist_worker(self, in_queue: asyncio.Queue):
+        since_checkpoint = 0
+        while True:
+            item = await in_queue.get()
+            if item is _STAGE_DONE:
+                return
+            since_checkpoint += item
+            if since_checkpoint >= self.checkpoint_interval:
+                await self._checkpoint()
+                since_checkpoint = 0
+
+    async def _checkpoint(self):
+        await self.checkpoint_func()
+        self._dirty = False
+        self.stats["checkpoints"] += 1
+        logger.info(
+            f"[Pipeline] checkpoint: {self.stats['merged']}/{self.stats['chunks']} chunks merged"
+        )
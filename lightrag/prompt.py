@@ -116,6 +116,21 @@ Text: {input_text}
 Output:
 """
 
+# several small chunks in one request share the instructions and examples
+PROMPTS["entity_extraction_packed"] = (
+    PROMPTS["entity_extraction"].split("-Real Data-")[0]
+    + """-Real Data-
+The data below holds several texts, each introduced by a line "-----Text <text_id>-----". Extract the entities and relationships of every text on its own, following the steps above.
+Before the records of each text, output ("text"{tuple_delimiter}<text_id>){record_delimiter} so that every record can be traced back to its text. Output {completion_delimiter} only once, after the records of the last text.
+######################
+Entity_types: {entity_types}
+Texts:
+{input_text}
+######################
+Output:
+"""
+)
+
 PROMPTS[
     "summarize_entity_descriptions"
 ] = """You are a helpful assistant responsible for generating a comprehensive summary of the data provided below.
@@ -132,11 +147,32 @@ Description List: {description_list}
 Output:
 """
 
+PROMPTS[
+    "summarize_entity_descriptions_packed"
+] = """You are a helpful assistant responsible for generating comprehensive summaries of the data provided below.
+Each numbered item below gives one or two entities, and a list of descriptions, all related to the same entity or group of entities.
+For every item, please concatenate all of its descriptions into a single, comprehensive description. Make sure to include information collected from all the descriptions of the item, and nothing from other items.
+If the provided descriptions are contradictory, please resolve the contradictions and provide a single, coherent summary.
+Make sure it is written in third person, and include the entity names so we the have full context.
+Write the summary of each item after a line "-----Summary <item_id>-----".
+
+#######
+-Data-
+{item_list}
+#######
+Output:
+"""
+
 PROMPTS[
     "entiti_continue_extraction"
 ] = """MANY entities were missed in the last extraction.  Add them below using the same format:
 """
 
+PROMPTS[
+    "entiti_continue_extraction_packed"
+] = """MANY entities were missed in the last extraction.  Add them below using the same format, with the records of each text after its ("text"{tuple_delimiter}<text_id>) record:
+"""
+
 PROMPTS[
     "entiti_if_loop_extraction"
 ] = """It appears some entities may have still been missed.  Answer YES | NO if there are still entities that need to be added.
@@ -0,0 +1,178 @@
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Union
+
+from .base import BaseKVStorage, QueryParam
+from .utils import compute_args_hash
+
+# QueryParam fields that change the retrieved context; response_type and
+# only_need_context only affect what is done with it
+_CONTEXT_PARAMS = (
+    "top_k",
+    "max_token_for_text_unit",
+    "max_token_for_global_context",
+    "max_token_for_local_context",
+)
+
+_GENERATION_KEY = "generation"
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+class QueryCache:
+    """Caches the extracted keywords and the assembled context of queries.
+
+    Keywords are keyed by the normalized query alone (every mode extracts
+    them with the same prompt), contexts by the normalized query, the mode
+    and the QueryParam fields that shape retrieval. Both are only valid for
+    the index they were computed from: ``invalidate`` moves to a new
+    generation and drops every entry, every entry is tagged with the
+    generation it was computed under, and one computed under another
+    generation is neither stored nor served.
+
+    Entries are kept in an LRU of ``max_entries`` and expire after
+    ``ttl_seconds`` (0 keeps them until invalidated). With a ``storage`` they
+    are also written to that KV storage, which keeps at most ``max_entries``
+    of them, and survive restarts. The current generation is then written to
+    ``generation_storage`` as soon as it changes, before the index change is
+    flushed, so entries written before a crash or by another instance that
+    did not see the change are rejected after a restart.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 0,
+        storage: BaseKVStorage = None,
+        generation_storage: BaseKVStorage = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.generation = uuid.uuid4().hex
+        self._storage = storage
+        self._generation_storage = generation_storage
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        # keys written to the storage, oldest first
+        self._stored: OrderedDict[str, None] = OrderedDict()
+        self._loaded = storage is None and generation_storage is None
+
+    @staticmethod
+    def keywords_key(query: str) -> str:
+        return compute_args_hash("keywords", normalize_query(query))
+
+    @staticmethod
+    def context_key(query: str, query_param: QueryParam) -> str:
+        return compute_args_hash(
+            "context",
+            normalize_query(query),
+            query_param.mode,
+            *[getattr(query_param, name) for name in _CONTEXT_PARAMS],
+        )
+
+    def _expired(self, entry: dict) -> bool:
+        return (
+            self.ttl_seconds > 0
+            and time.time() - entry["created_at"] > self.ttl_seconds
+        )
+
+    async def _load(self):
+        """Read the persisted generation and the keys of the stored entries
+        once, dropping the entries of any other generation"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if self._generation_storage is not None:
+            stored = await self._generation_storage.get_by_id(_GENERATION_KEY)
+            if stored is None:
+                await self._persist_generation()
+            else:
+                self.generation = stored["generation"]
+        if self._storage is None:
+            return
+        keys = await self._storage.all_keys()
+        entries = await self._storage.get_by_ids(keys)
+        current = sorted(
+            (entry["created_at"], key)
+            for key, entry in zip(keys, entries)
+            if entry is not None and entry.get("generation") == self.generation
+        )
+        self._stored.update((key, None) for _, key in current)
+        stale = [key for key in keys if key not in self._stored]
+        stale.extend(self._evict_stored())
+        if stale:
+            await self._storage.delete(stale)
+
+    async def _persist_generation(self):
+        # upserts don't overwrite existing keys
+        await self._generation_storage.delete([_GENERATION_KEY])
+        await self._generation_storage.upsert(
+            {_GENERATION_KEY: {"generation": self.generation}}
+        )
+        await self._generation_storage.index_done_callback()
+
+    async def current_generation(self) -> str:
+        """The generation a value computed from the index now belongs to"""
+        await self._load()
+        return self.generation
+
+    async def get(self, key: str) -> Union[Any, None]:
+        await self._load()
+        entry = self._entries.get(key)
+        if entry is None and self._storage is not None:
+            entry = await self._storage.get_by_id(key)
+        if entry is None:
+            return None
+        if entry.get("generation") != self.generation or self._expired(entry):
+            self._entries.pop(key, None)
+            if self._storage is not None:
+                self._stored.pop(key, None)
+                await self._storage.delete([key])
+            return None
+        self._remember(key, entry)
+        return entry["value"]
+
+    async def put(self, key: str, value: Any, generation: str):
+        """Store a value computed while the index was at ``generation``"""
+        await self._load()
+        if generation != self.generation:
+            return
+        entry = {"value": value, "created_at": time.time(), "generation": generation}
+        self._remember(key, entry)
+        if self._storage is not None:
+            # upserts don't overwrite existing keys
+            await self._storage.delete([key])
+            await self._storage.upsert({key: entry})
+            self._stored[key] = None
+            self._stored.move_to_end(key)
+            evicted = self._evict_stored()
+            if evicted:
+                await self._storage.delete(evicted)
+
+    def _evict_stored(self) -> list[str]:
+        evicted = []
+        while len(self._stored) > self.max_entries:
+            evicted.append(self._stored.popitem(last=False)[0])
+        return evicted
+
+    def _remember(self, key: str, entry: dict):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def invalidate(self):
+        await self._load()
+        self.generation = uuid.uuid4().hex
+        self._entries.clear()
+        self._stored.clear()
+        if self._generation_storage is not None:
+            await self._persist_generation()
+        if self._storage is not None:
+            await self._storage.drop()
+
+    async def index_done_callback(self):
+        if self._storage is not None:
+            await self._storage.index_done_callback()
@@ -1,16 +1,22 @@
 import asyncio
 import html
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from hashlib import md5
 from typing import Any, Union, cast
 import networkx as nx
 import numpy as np
 from nano_vectordb import NanoVectorDB
+from nano_vectordb.dbs import array_to_buffer_string, buffer_string_to_array
 
 from .utils import (
     logger,
     load_json,
     write_json,
+    load_json_lines,
+    append_json_lines,
     compute_mdhash_id,
 )
 
@@ -21,19 +27,61 @@ from .base import (
 )
 
 
+# Below this many lines a delta log is never worth compacting.
+_MIN_COMPACTION_LOG_LINES = 1000
+
+
+def _needs_compaction(log_lines: int, live_items: int, global_config: dict) -> bool:
+    """Compact once the delta log outgrows the live data by the configured
+    ratio, which keeps the amortized cost of a flush proportional to its delta.
+    """
+    ratio = global_config.get("storage_log_compaction_ratio", 1.0)
+    return log_lines > max(live_items * ratio, _MIN_COMPACTION_LOG_LINES)
+
+
 @dataclass
 class JsonKVStorage(BaseKVStorage):
     def __post_init__(self):
         working_dir = self.global_config["working_dir"]
         self._file_name = os.path.join(working_dir, f"kv_store_{self.namespace}.json")
+        self._log_file_name = os.path.join(
+            working_dir, f"kv_store_{self.namespace}.log.jsonl"
+        )
         self._data = load_json(self._file_name) or {}
+        log_entries = load_json_lines(self._log_file_name)
+        for entry in log_entries:
+            if entry.get("deleted"):
+                self._data.pop(entry["key"], None)
+            else:
+                self._data[entry["key"]] = entry["value"]
+        self._log_lines = len(log_entries)
+        self._dirty_keys: set[str] = set()
+        self._needs_rewrite = False
         logger.info(f"Load KV {self.namespace} with {len(self._data)} data")
 
     async def all_keys(self) -> list[str]:
         return list(self._data.keys())
 
     async def index_done_callback(self):
-        write_json(self._data, self._file_name)
+        if self._needs_rewrite or _needs_compaction(
+            self._log_lines + len(self._dirty_keys), len(self._data), self.global_config
+        ):
+            write_json(self._data, self._file_name)
+            open(self._log_file_name, "w").close()
+            self._log_lines = 0
+        elif self._dirty_keys:
+            append_json_lines(
+                [
+                    {"key": k, "value": self._data[k]}
+                    if k in self._data
+                    else {"key": k, "deleted": True}
+                    for k in self._dirty_keys
+                ],
+                self._log_file_name,
+            )
+            self._log_lines += len(self._dirty_keys)
+        self._dirty_keys = set()
+        self._needs_rewrite = False
 
     async def get_by_id(self, id):
         return self._data.get(id, None)
@@ -56,10 +104,18 @@ class JsonKVStorage(BaseKVStorage):
     async def upsert(self, data: dict[str, dict]):
         left_data = {k: v for k, v in data.items() if k not in self._data}
         self._data.update(left_data)
+        self._dirty_keys.update(left_data.keys())
         return left_data
 
+    async def delete(self, ids: list[str]):
+        for id in ids:
+            if self._data.pop(id, None) is not None:
+                self._dirty_keys.add(id)
+
     async def drop(self):
         self._data = {}
+        self._dirty_keys = set()
+        self._needs_rewrite = True
 
 
 @dataclass
@@ -71,12 +127,48 @@ class NanoVectorDBStorage(BaseVectorStorage):
             self.global_config["working_dir"], f"vdb_{self.namespace}.json"
         )
         self._max_batch_size = self.global_config["embedding_batch_num"]
+        self._log_file_name = os.path.join(
+            self.global_config["working_dir"], f"vdb_{self.namespace}.log.jsonl"
+        )
         self._client = NanoVectorDB(
             self.embedding_func.embedding_dim, storage_file=self._client_file_name
         )
         self.cosine_better_than_threshold = self.global_config.get(
             "cosine_better_than_threshold", self.cosine_better_than_threshold
         )
+        log_entries = load_json_lines(self._log_file_name)
+        for entry in log_entries:
+            self._replay_log_entry(entry)
+        self._log_lines = len(log_entries)
+        # latest serialized row for every id upserted since the last flush
+        self._pending_upserts: dict[str, dict] = {}
+        self._pending_deletes: set[str] = set()
+
+    def _replay_log_entry(self, entry: dict):
+        if entry["op"] == "delete":
+            self._client.delete(entry["ids"])
+            return
+        self._client.upsert(
+            datas=[
+                {**d, "__vector__": buffer_string_to_array(d["__vector__"])}
+                for d in entry["data"]
+            ]
+        )
+
+    def _track_upserts(self, list_data: list[dict]):
+        for d in list_data:
+            self._pending_deletes.discard(d["__id__"])
+            self._pending_upserts[d["__id__"]] = {
+                **d,
+                "__vector__": array_to_buffer_string(
+                    np.asarray(d["__vector__"], dtype=np.float32)
+                ),
+            }
+
+    def _track_deletes(self, ids: list[str]):
+        for id in ids:
+            self._pending_upserts.pop(id, None)
+            self._pending_deletes.add(id)
 
     async def upsert(self, data: dict[str, dict]):
         logger.info(f"Inserting {len(data)} vectors to {self.namespace}")
@@ -101,12 +193,19 @@ class NanoVectorDBStorage(BaseVectorStorage):
         embeddings = np.concatenate(embeddings_list)
         for i, d in enumerate(list_data):
             d["__vector__"] = embeddings[i]
+        self._track_upserts(list_data)
         results = self._client.upsert(datas=list_data)
         return results
 
+    async def delete(self, ids: list[str]):
+        self._client.delete(ids)
+        self._track_deletes(ids)
+
     async def query(self, query: str, top_k=5):
         embedding = await self.embedding_func([query])
-        embedding = embedding[0]
+        return await self.query_by_embedding(embedding[0], top_k=top_k)
+
+    async def query_by_embedding(self, embedding: np.ndarray, top_k=5):
         results = self._client.query(
             query=embedding,
             top_k=top_k,
@@ -127,6 +226,7 @@ class NanoVectorDBStorage(BaseVectorStorage):
 
             if self._client.get(entity_id):
                 self._client.delete(entity_id)
+                self._track_deletes(entity_id)
                 logger.info(f"Entity {entity_name} have been deleted.")
             else:
                 logger.info(f"No entity found with name {entity_name}.")
@@ -144,6 +244,7 @@ class NanoVectorDBStorage(BaseVectorStorage):
 
             if ids_to_delete:
                 self._client.delete(ids_to_delete)
+                self._track_deletes(ids_to_delete)
                 logger.info(
                     f"All relations related to entity {entity_name} have been deleted."
                 )
@@ -155,7 +256,25 @@ class NanoVectorDBStorage(BaseVectorStorage):
             )
 
     async def index_done_callback(self):
-        self._client.save()
+        delta = len(self._pending_upserts) + len(self._pending_deletes)
+        if _needs_compaction(
+            self._log_lines + delta, len(self._client), self.global_config
+        ):
+            self._client.save()
+            open(self._log_file_name, "w").close()
+            self._log_lines = 0
+        elif delta:
+            entries = []
+            if self._pending_deletes:
+                entries.append({"op": "delete", "ids": list(self._pending_deletes)})
+            if self._pending_upserts:
+                entries.append(
+                    {"op": "upsert", "data": list(self._pending_upserts.values())}
+                )
+            append_json_lines(entries, self._log_file_name)
+            self._log_lines += delta
+        self._pending_upserts = {}
+        self._pending_deletes = set()
 
 
 @dataclass
@@ -234,9 +353,74 @@ class NetworkXStorage(BaseGraphStorage):
         self._node_embed_algorithms = {
             "node2vec": self._node2vec_embed,
         }
+        self._log_file_name = os.path.join(
+            self.global_config["working_dir"], f"graph_{self.namespace}.log.jsonl"
+        )
+        log_entries = load_json_lines(self._log_file_name)
+        for entry in log_entries:
+            self._replay_log_entry(entry)
+        self._log_lines = len(log_entries)
+        self._dirty_nodes: set[str] = set()
+        self._dirty_edges: set[tuple[str, str]] = set()
+        self._deleted_nodes: set[str] = set()
+        self._deleted_edges: set[tuple[str, str]] = set()
+
+    def _replay_log_entry(self, entry: dict):
+        if entry["op"] == "delete_node":
+            if self._graph.has_node(entry["id"]):
+                self._graph.remove_node(entry["id"])
+        elif entry["op"] == "delete_edge":
+            if self._graph.has_edge(entry["src"], entry["tgt"]):
+                self._graph.remove_edge(entry["src"], entry["tgt"])
+        elif entry["op"] == "node":
+            self._graph.add_node(entry["id"], **entry["data"])
+        elif entry["op"] == "edge":
+            self._graph.add_edge(entry["src"], entry["tgt"], **entry["data"])
 
     async def index_done_callback(self):
-        NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+        delta = (
+            len(self._deleted_nodes)
+            + len(self._deleted_edges)
+            + len(self._dirty_nodes)
+            + len(self._dirty_edges)
+        )
+        if _needs_compaction(
+            self._log_lines + delta,
+            self._graph.number_of_nodes() + self._graph.number_of_edges(),
+            self.global_config,
+        ):
+            NetworkXStorage.write_nx_graph(self._graph, self._graphml_xml_file)
+            open(self._log_file_name, "w").close()
+            self._log_lines = 0
+        elif delta:
+            # deletions first, so a node deleted and re-added since the last
+            # flush is replayed with its current attributes and edges
+            entries = [{"op": "delete_node", "id": n} for n in self._deleted_nodes]
+            entries += [
+                {"op": "delete_edge", "src": u, "tgt": v}
+                for u, v in self._deleted_edges
+            ]
+            entries += [
+                {"op": "node", "id": n, "data": dict(self._graph.nodes[n])}
+                for n in self._dirty_nodes
+                if self._graph.has_node(n)
+            ]
+            entries += [
+                {
+                    "op": "edge",
+                    "src": u,
+                    "tgt": v,
+                    "data": dict(self._graph.edges[u, v]),
+                }
+                for u, v in self._dirty_edges
+                if self._graph.has_edge(u, v)
+            ]
+            append_json_lines(entries, self._log_file_name)
+            self._log_lines += len(entries)
+        self._dirty_nodes = set()
+        self._dirty_edges = set()
+        self._deleted_nodes = set()
+        self._deleted_edges = set()
 
     async def has_node(self, node_id: str) -> bool:
         return self._graph.has_node(node_id)
@@ -247,6 +431,9 @@ class NetworkXStorage(BaseGraphStorage):
     async def get_node(self, node_id: str) -> Union[dict, None]:
         return self._graph.nodes.get(node_id)
 
+    async def all_nodes(self) -> list[tuple[str, dict]]:
+        return list(self._graph.nodes(data=True))
+
     async def node_degree(self, node_id: str) -> int:
         return self._graph.degree(node_id)
 
@@ -263,13 +450,37 @@ class NetworkXStorage(BaseGraphStorage):
             return list(self._graph.edges(source_node_id))
         return None
 
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        return [self._graph.nodes.get(node_id) for node_id in node_ids]
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return [
+            self._graph.degree(node_id) if self._graph.has_node(node_id) else 0
+            for node_id in node_ids
+        ]
+
+    async def get_edges_batch(
+        self, pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        return [self._graph.edges.get(pair) for pair in pairs]
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        return [
+            list(self._graph.edges(node_id)) if self._graph.has_node(node_id) else None
+            for node_id in node_ids
+        ]
+
     async def upsert_node(self, node_id: str, node_data: dict[str, str]):
         self._graph.add_node(node_id, **node_data)
+        self._dirty_nodes.add(node_id)
 
     async def upsert_edge(
         self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
     ):
         self._graph.add_edge(source_node_id, target_node_id, **edge_data)
+        self._dirty_edges.add((source_node_id, target_node_id))
 
     async def delete_node(self, node_id: str):
         """
@@ -279,10 +490,16 @@ class NetworkXStorage(BaseGraphStorage):
         """
         if self._graph.has_node(node_id):
             self._graph.remove_node(node_id)
+            self._deleted_nodes.add(node_id)
             logger.info(f"Node {node_id} deleted from the graph.")
         else:
             logger.warning(f"Node {node_id} not found in the graph for deletion.")
 
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        if self._graph.has_edge(source_node_id, target_node_id):
+            self._graph.remove_edge(source_node_id, target_node_id)
+            self._deleted_edges.add((source_node_id, target_node_id))
+
     async def embed_nodes(self, algorithm: str) -> tuple[np.ndarray, list[str]]:
         if algorithm not in self._node_embed_algorithms:
             raise ValueError(f"Node embedding algorithm {algorithm} not supported")
@@ -299,3 +516,331 @@ class NetworkXStorage(BaseGraphStorage):
 
         nodes_ids = [self._graph.nodes[node_id]["id"] for node_id in nodes]
         return embeddings, nodes_ids
+
+
+def _shard_index(key: str, num_shards: int) -> int:
+    return int(md5(key.encode()).hexdigest()[:8], 16) % num_shards
+
+
+class _ShardSet:
+    """Lazily created shards of a file based storage.
+
+    A shard is the wrapped storage class under the namespace
+    ``{namespace}.shard{i}-of-{n}``, so it keeps its own data and delta log
+    files, named ``{file_prefix}{namespace}.shard{i}-of-{n}.*``. Shards are
+    loaded on first access in a worker thread, so the event loop keeps
+    serving requests to loaded shards meanwhile; fan-out operations load the
+    missing ones in parallel.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        global_config: dict,
+        make_shard: callable,
+        file_prefix: str,
+    ):
+        self.num_shards = global_config.get("storage_num_shards", 1)
+        self._namespace = namespace
+        self._make_shard = make_shard
+        self._shards: list = [None] * self.num_shards
+        self._loading: dict[int, asyncio.Future] = {}
+        self._check_layout(global_config["working_dir"], file_prefix)
+        if global_config.get("storage_preload_shards", False):
+            with ThreadPoolExecutor(max_workers=min(self.num_shards, 8)) as executor:
+                self._shards = list(executor.map(self._load, range(self.num_shards)))
+
+    def _check_layout(self, working_dir: str, file_prefix: str):
+        pattern = re.compile(
+            re.escape(f"{file_prefix}{self._namespace}") + r"(?:\.shard\d+-of-(\d+))?\."
+        )
+        for file_name in os.listdir(working_dir):
+            match = pattern.match(file_name)
+            if match is None:
+                continue
+            if match.group(1) is None:
+                raise ValueError(
+                    f"{self._namespace} was stored unsharded ({file_name}), "
+                    f"but storage_num_shards is {self.num_shards}; insert the "
+                    "documents again into a new working_dir to shard them"
+                )
+            if int(match.group(1)) != self.num_shards:
+                raise ValueError(
+                    f"{self._namespace} was stored in {match.group(1)} shards, "
+                    f"but storage_num_shards is {self.num_shards}"
+                )
+
+    def _load(self, index: int):
+        return self._make_shard(f"{self._namespace}.shard{index}-of-{self.num_shards}")
+
+    async def _get(self, index: int):
+        if self._shards[index] is None:
+            # concurrent first accesses share one load
+            if index not in self._loading:
+                self._loading[index] = asyncio.ensure_future(
+                    asyncio.to_thread(self._load, index)
+                )
+            loading = self._loading[index]
+            try:
+                shard = await asyncio.shield(loading)
+            finally:
+                # a failed load is retried on the next access
+                if loading.done() and self._loading.get(index) is loading:
+                    del self._loading[index]
+            if self._shards[index] is None:
+                self._shards[index] = shard
+        return self._shards[index]
+
+    async def for_key(self, key: str):
+        return await self._get(_shard_index(key, self.num_shards))
+
+    async def for_keys(self, keys: list[str]) -> list[tuple[object, list[int]]]:
+        """The shards of ``keys``, each with the positions of its keys; shards
+        not loaded yet are loaded concurrently"""
+        groups: dict[int, list[int]] = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(_shard_index(key, self.num_shards), []).append(i)
+        shards = await asyncio.gather(*[self._get(index) for index in groups])
+        return list(zip(shards, groups.values()))
+
+    async def all(self) -> list:
+        return list(
+            await asyncio.gather(*[self._get(i) for i in range(self.num_shards)])
+        )
+
+    def loaded(self) -> list:
+        return [shard for shard in self._shards if shard is not None]
+
+
+@dataclass
+class ShardedJsonKVStorage(BaseKVStorage):
+    def __post_init__(self):
+        self._shards = _ShardSet(
+            self.namespace,
+            self.global_config,
+            lambda namespace: JsonKVStorage(
+                namespace=namespace,
+                global_config=self.global_config,
+                embedding_func=self.embedding_func,
+            ),
+            file_prefix="kv_store_",
+        )
+
+    async def all_keys(self) -> list[str]:
+        keys = await asyncio.gather(*[s.all_keys() for s in await self._shards.all()])
+        return [k for shard_keys in keys for k in shard_keys]
+
+    async def index_done_callback(self):
+        await asyncio.gather(*[s.index_done_callback() for s in self._shards.loaded()])
+
+    async def get_by_id(self, id):
+        shard = await self._shards.for_key(id)
+        return await shard.get_by_id(id)
+
+    async def get_by_ids(self, ids, fields=None):
+        results = [None] * len(ids)
+        for shard, positions in await self._shards.for_keys(ids):
+            shard_results = await shard.get_by_ids(
+                [ids[i] for i in positions], fields=fields
+            )
+            for i, result in zip(positions, shard_results):
+                results[i] = result
+        return results
+
+    async def filter_keys(self, data: list[str]) -> set[str]:
+        new_keys = set()
+        for shard, positions in await self._shards.for_keys(data):
+            new_keys |= await shard.filter_keys([data[i] for i in positions])
+        return new_keys
+
+    async def upsert(self, data: dict[str, dict]):
+        keys = list(data.keys())
+        left_data = {}
+        for shard, positions in await self._shards.for_keys(keys):
+            left_data.update(
+                await shard.upsert({keys[i]: data[keys[i]] for i in positions})
+            )
+        return left_data
+
+    async def delete(self, ids: list[str]):
+        for shard, positions in await self._shards.for_keys(ids):
+            await shard.delete([ids[i] for i in positions])
+
+    async def drop(self):
+        await asyncio.gather(*[s.drop() for s in await self._shards.all()])
+
+
+@dataclass
+class ShardedNanoVectorDBStorage(BaseVectorStorage):
+    def __post_init__(self):
+        self._shards = _ShardSet(
+            self.namespace,
+            self.global_config,
+            lambda namespace: NanoVectorDBStorage(
+                namespace=namespace,
+                global_config=self.global_config,
+                embedding_func=self.embedding_func,
+                meta_fields=self.meta_fields,
+            ),
+            file_prefix="vdb_",
+        )
+
+    async def upsert(self, data: dict[str, dict]):
+        keys = list(data.keys())
+        await asyncio.gather(
+            *[
+                shard.upsert({keys[i]: data[keys[i]] for i in positions})
+                for shard, positions in await self._shards.for_keys(keys)
+            ]
+        )
+
+    async def delete(self, ids: list[str]):
+        for shard, positions in await self._shards.for_keys(ids):
+            await shard.delete([ids[i] for i in positions])
+
+    async def query(self, query: str, top_k=5):
+        embedding = await self.embedding_func([query])
+        return await self.query_by_embedding(embedding[0], top_k=top_k)
+
+    async def query_by_embedding(self, embedding: np.ndarray, top_k=5):
+        shard_results = await asyncio.gather(
+            *[s.query_by_embedding(embedding, top_k) for s in await self._shards.all()]
+        )
+        results = [dp for dps in shard_results for dp in dps]
+        return sorted(results, key=lambda dp: dp["distance"], reverse=True)[:top_k]
+
+    async def delete_entity(self, entity_name: str):
+        entity_id = compute_mdhash_id(entity_name, prefix="ent-")
+        shard = await self._shards.for_key(entity_id)
+        await shard.delete_entity(entity_name)
+
+    async def delete_relation(self, entity_name: str):
+        await asyncio.gather(
+            *[s.delete_relation(entity_name) for s in await self._shards.all()]
+        )
+
+    async def index_done_callback(self):
+        await asyncio.gather(*[s.index_done_callback() for s in self._shards.loaded()])
+
+
+@dataclass
+class ShardedNetworkXStorage(BaseGraphStorage):
+    """Nodes live in the shard of their id. An edge is stored in the shards
+    of both endpoints, so degrees and edge lists of a node are answered by its
+    own shard; the far endpoint is only a bare placeholder node there.
+    """
+
+    def __post_init__(self):
+        self._shards = _ShardSet(
+            self.namespace,
+            self.global_config,
+            lambda namespace: NetworkXStorage(
+                namespace=namespace,
+                global_config=self.global_config,
+                embedding_func=self.embedding_func,
+            ),
+            file_prefix="graph_",
+        )
+
+    async def _edge_shards(self, source_node_id: str, target_node_id: str) -> list:
+        shards = [await self._shards.for_key(source_node_id)]
+        target_shard = await self._shards.for_key(target_node_id)
+        if target_shard is not shards[0]:
+            shards.append(target_shard)
+        return shards
+
+    async def index_done_callback(self):
+        await asyncio.gather(*[s.index_done_callback() for s in self._shards.loaded()])
+
+    async def has_node(self, node_id: str) -> bool:
+        shard = await self._shards.for_key(node_id)
+        return await shard.has_node(node_id)
+
+    async def has_edge(self, source_node_id: str, target_node_id: str) -> bool:
+        shard = await self._shards.for_key(source_node_id)
+        return await shard.has_edge(source_node_id, target_node_id)
+
+    async def get_node(self, node_id: str) -> Union[dict, None]:
+        shard = await self._shards.for_key(node_id)
+        return await shard.get_node(node_id)
+
+    async def all_nodes(self) -> list[tuple[str, dict]]:
+        # skipping the placeholders of far endpoints
+        return [
+            (node_id, node_data)
+            for index, shard in enumerate(await self._shards.all())
+            for node_id, node_data in await shard.all_nodes()
+            if _shard_index(node_id, self._shards.num_shards) == index
+        ]
+
+    async def node_degree(self, node_id: str) -> int:
+        shard = await self._shards.for_key(node_id)
+        return await shard.node_degree(node_id)
+
+    async def edge_degree(self, src_id: str, tgt_id: str) -> int:
+        return await self.node_degree(src_id) + await self.node_degree(tgt_id)
+
+    async def get_edge(
+        self, source_node_id: str, target_node_id: str
+    ) -> Union[dict, None]:
+        shard = await self._shards.for_key(source_node_id)
+        return await shard.get_edge(source_node_id, target_node_id)
+
+    async def get_node_edges(self, source_node_id: str):
+        shard = await self._shards.for_key(source_node_id)
+        return await shard.get_node_edges(source_node_id)
+
+    async def _batch(self, method: str, keys: list, shard_keys: list[str]) -> list:
+        results = [None] * len(keys)
+        for shard, positions in await self._shards.for_keys(shard_keys):
+            shard_results = await getattr(shard, method)([keys[i] for i in positions])
+            for i, result in zip(positions, shard_results):
+                results[i] = result
+        return results
+
+    async def get_nodes_batch(self, node_ids: list[str]) -> list[Union[dict, None]]:
+        return await self._batch("get_nodes_batch", node_ids, node_ids)
+
+    async def node_degrees_batch(self, node_ids: list[str]) -> list[int]:
+        return await self._batch("node_degrees_batch", node_ids, node_ids)
+
+    async def get_edges_batch(
+        self, pairs: list[tuple[str, str]]
+    ) -> list[Union[dict, None]]:
+        return await self._batch("get_edges_batch", pairs, [s for s, _ in pairs])
+
+    async def get_nodes_edges_batch(
+        self, node_ids: list[str]
+    ) -> list[Union[list[tuple[str, str]], None]]:
+        return await self._batch("get_nodes_edges_batch", node_ids, node_ids)
+
+    async def upsert_node(self, node_id: str, node_data: dict[str, str]):
+        shard = await self._shards.for_key(node_id)
+        await shard.upsert_node(node_id, node_data)
+
+    async def upsert_edge(
+        self, source_node_id: str, target_node_id: str, edge_data: dict[str, str]
+    ):
+        for shard in await self._edge_shards(source_node_id, target_node_id):
+            await shard.upsert_edge(source_node_id, target_node_id, edge_data)
+
+    async def delete_edge(self, source_node_id: str, target_node_id: str):
+        for node_id, other_id in [
+            (source_node_id, target_node_id),
+            (target_node_id, source_node_id),
+        ]:
+            shard = await self._shards.for_key(node_id)
+            await shard.delete_edge(source_node_id, target_node_id)
+            # drop the placeholder once its last edge in this shard is gone
+            if (
+                (await self._shards.for_key(other_id)) is not shard
+                and await shard.has_node(other_id)
+                and await shard.node_degree(other_id) == 0
+            ):
+                await shard.delete_node(other_id)
+
+    async def delete_node(self, node_id: str):
+        for _, neighbor_id in await self.get_node_edges(node_id) or []:
+            await self.delete_edge(node_id, neighbor_id)
+        shard = await self._shards.for_key(node_id)
+        await shard.delete_node(node_id)
@@ -6,17 +6,18 @@ import json
 import logging
 import os
 import re
+import threading
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
+from collections import OrderedDict
 from functools import wraps
 from hashlib import md5
-from typing import Any, Union, List
+from typing import Any, Hashable, Iterable, Union, List
 import xml.etree.ElementTree as ET
 
 import numpy as np
 import tiktoken
 
-ENCODER = None
-
 logger = logging.getLogger("lightrag")
 
 
@@ -86,15 +87,68 @@ def limit_async_func_call(max_size: int, waitting_time: float = 0.0001):
             while __current_size >= max_size:
                 await asyncio.sleep(waitting_time)
             __current_size += 1
-            result = await func(*args, **kwargs)
-            __current_size -= 1
-            return result
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                __current_size -= 1
+                raise
+            if not hasattr(result, "__aiter__"):
+                __current_size -= 1
+                return result
+
+            # a streamed call lasts until its stream is consumed or closed
+            async def stream():
+                nonlocal __current_size
+                try:
+                    async for piece in result:
+                        yield piece
+                finally:
+                    __current_size -= 1
+
+            return stream()
 
         return wait_func
 
     return final_decro
 
 
+class KeyedLock:
+    """Async locks by key, so work on one key is serialized while other keys
+    go on in parallel. Locks are created on first use and dropped once
+    nobody holds or waits for them."""
+
+    def __init__(self):
+        self._locks: dict[Hashable, asyncio.Lock] = {}
+        self._users: dict[Hashable, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, keys: Iterable[Hashable]):
+        """Hold the locks of all ``keys``; they are taken in a fixed order, so
+        two holders of overlapping keys can't wait for each other"""
+        keys = sorted(set(keys), key=repr)
+        for key in keys:
+            self._locks.setdefault(key, asyncio.Lock())
+            self._users[key] = self._users.get(key, 0) + 1
+        acquired = []
+        try:
+            for key in keys:
+                await self._locks[key].acquire()
+                acquired.append(key)
+            yield
+        finally:
+            for key in acquired:
+                self._locks[key].release()
+            for key in keys:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key], self._locks[key]
+
+    def __deepcopy__(self, memo):
+        # global_config is a deep copy of the LightRAG fields, but every copy
+        # must serialize on the very same locks
+        return self
+
+
 def wrap_embedding_func_with_attrs(**kwargs):
     """Wrap a function with attributes"""
 
@@ -117,20 +171,216 @@ def write_json(json_obj, file_name):
         json.dump(json_obj, f, indent=2, ensure_ascii=False)
 
 
+def load_json_lines(file_name) -> list:
+    """Load a JSON-lines file, ignoring a torn trailing line left by a crash"""
+    if not os.path.exists(file_name):
+        return []
+    entries = []
+    with open(file_name, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping damaged line in {file_name}")
+    return entries
+
+
+def append_json_lines(entries: list, file_name):
+    with open(file_name, "a", encoding="utf-8") as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+class Tokenizer:
+    """Turns text into token ids and back.
+
+    Subclass it to plug in another tokenizer library and register it for a
+    model name with ``register_tokenizer``.
+    """
+
+    def encode(self, content: str) -> list[int]:
+        raise NotImplementedError
+
+    def decode(self, tokens: list[int]) -> str:
+        raise NotImplementedError
+
+    def encode_batch(self, contents: list[str]) -> list[list[int]]:
+        return [self.encode(content) for content in contents]
+
+    def decode_batch(self, batch: list[list[int]]) -> list[str]:
+        return [self.decode(tokens) for tokens in batch]
+
+    def encode_batch_with_offsets(
+        self, contents: list[str]
+    ) -> list[tuple[list[int], Union[list[int], None]]]:
+        """Tokens of each string with the character offset every token starts
+        at, or None offsets if the tokenizer can't tell"""
+        return [(tokens, None) for tokens in self.encode_batch(contents)]
+
+
+class TiktokenTokenizer(Tokenizer):
+    def __init__(self, encoding: tiktoken.Encoding):
+        self.encoding = encoding
+
+    def encode(self, content: str) -> list[int]:
+        return self.encoding.encode(content)
+
+    def decode(self, tokens: list[int]) -> str:
+        return self.encoding.decode(tokens)
+
+    def encode_batch(self, contents: list[str]) -> list[list[int]]:
+        return self.encoding.encode_batch(contents)
+
+    def decode_batch(self, batch: list[list[int]]) -> list[str]:
+        return self.encoding.decode_batch(batch)
+
+    def encode_batch_with_offsets(
+        self, contents: list[str]
+    ) -> list[tuple[list[int], Union[list[int], None]]]:
+        return [
+            (tokens, self.encoding.decode_with_offsets(tokens)[1])
+            for tokens in self.encoding.encode_batch(contents)
+        ]
+
+
+class HFTokenizer(Tokenizer):
+    """Tokenizer of a Hugging Face model, e.g. the local Llama or Qwen model
+    that answers the prompts"""
+
+    def __init__(self, model_name_or_path: str):
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+
+    def encode(self, content: str) -> list[int]:
+        return self.tokenizer.encode(content, add_special_tokens=False)
+
+    def decode(self, tokens: list[int]) -> str:
+        return self.tokenizer.decode(tokens)
+
+    def encode_batch(self, contents: list[str]) -> list[list[int]]:
+        return self.tokenizer(contents, add_special_tokens=False)["input_ids"]
+
+    def decode_batch(self, batch: list[list[int]]) -> list[str]:
+        return self.tokenizer.batch_decode(batch)
+
+    def encode_batch_with_offsets(
+        self, contents: list[str]
+    ) -> list[tuple[list[int], Union[list[int], None]]]:
+        if not self.tokenizer.is_fast:
+            # only the Rust tokenizers report offsets
+            return super().encode_batch_with_offsets(contents)
+        encoded = self.tokenizer(
+            contents, add_special_tokens=False, return_offsets_mapping=True
+        )
+        return [
+            (tokens, [start for start, _ in mapping])
+            for tokens, mapping in zip(encoded["input_ids"], encoded["offset_mapping"])
+        ]
+
+
+_tokenizers: dict[str, Tokenizer] = {}
+_registered_tokenizers: dict[str, Union[Tokenizer, callable]] = {}
+_tokenizers_lock = threading.Lock()
+
+
+def register_tokenizer(model_name: str, tokenizer: Union[Tokenizer, callable]):
+    """Use ``tokenizer`` for ``model_name``; a callable is only called, once,
+    when the tokenizer is first needed"""
+    with _tokenizers_lock:
+        _tokenizers.pop(model_name, None)
+        _registered_tokenizers[model_name] = tokenizer
+    # counts memoized with the replaced tokenizer are no longer right
+    with _token_counts_lock:
+        _token_counts.clear()
+
+
+def registered_tokenizers() -> dict[str, Union[Tokenizer, callable]]:
+    """What was passed to ``register_tokenizer``, by model name, to register
+    it again in a worker process"""
+    with _tokenizers_lock:
+        return dict(_registered_tokenizers)
+
+
+def _load_tokenizer(model_name: str) -> Tokenizer:
+    if model_name in _registered_tokenizers:
+        tokenizer = _registered_tokenizers[model_name]
+        return tokenizer if isinstance(tokenizer, Tokenizer) else tokenizer()
+    try:
+        return TiktokenTokenizer(tiktoken.encoding_for_model(model_name))
+    except KeyError:
+        pass
+    try:
+        # an encoding name such as "cl100k_base"
+        return TiktokenTokenizer(tiktoken.get_encoding(model_name))
+    except ValueError:
+        pass
+    # anything else is taken for a Hugging Face model name or path
+    try:
+        tokenizer = HFTokenizer(model_name)
+    except (ImportError, OSError, ValueError) as e:
+        raise ValueError(
+            f"No tokenizer for {model_name!r}: it is neither an OpenAI model or "
+            "tiktoken encoding nor a loadable Hugging Face model "
+            f"({type(e).__name__}: {e}); register one for it with "
+            "lightrag.utils.register_tokenizer"
+        ) from e
+    logger.info(f"Using the Hugging Face tokenizer of {model_name}")
+    return tokenizer
+
+
+def get_tokenizer(model_name: str = "gpt-4o") -> Tokenizer:
+    """The tokenizer of a model, loaded on first use: a registered one, the
+    tiktoken encoding of an OpenAI model, or a Hugging Face tokenizer"""
+    tokenizer = _tokenizers.get(model_name)
+    if tokenizer is not None:
+        return tokenizer
+    with _tokenizers_lock:
+        if model_name not in _tokenizers:
+            _tokenizers[model_name] = _load_tokenizer(model_name)
+        return _tokenizers[model_name]
+
+
 def encode_string_by_tiktoken(content: str, model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    tokens = ENCODER.encode(content)
-    return tokens
+    return get_tokenizer(model_name).encode(content)
+
+
+def encode_strings_by_tiktoken(contents: list[str], model_name: str = "gpt-4o"):
+    return get_tokenizer(model_name).encode_batch(contents)
+
+
+# token counts by digest of the counted string, so the memo doesn't keep
+# every description and chunk alive
+_token_counts: "OrderedDict[tuple[bytes, str], int]" = OrderedDict()
+_token_counts_lock = threading.Lock()
+_TOKEN_COUNTS_MAX_SIZE = 65536
+
+
+def count_tokens(content: str, model_name: str = "gpt-4o") -> int:
+    """Number of tokens of a string, memoized since the same descriptions and
+    chunks are counted again by every query that retrieves them"""
+    key = (md5(content.encode()).digest(), model_name)
+    with _token_counts_lock:
+        count = _token_counts.get(key)
+        if count is not None:
+            _token_counts.move_to_end(key)
+            return count
+    count = len(encode_string_by_tiktoken(content, model_name=model_name))
+    with _token_counts_lock:
+        _token_counts[key] = count
+        if len(_token_counts) > _TOKEN_COUNTS_MAX_SIZE:
+            _token_counts.popitem(last=False)
+    return count
 
 
 def decode_tokens_by_tiktoken(tokens: list[int], model_name: str = "gpt-4o"):
-    global ENCODER
-    if ENCODER is None:
-        ENCODER = tiktoken.encoding_for_model(model_name)
-    content = ENCODER.decode(tokens)
-    return content
+    return get_tokenizer(model_name).decode(tokens)
+
+
+def decode_token_batches_by_tiktoken(
+    batch: list[list[int]], model_name: str = "gpt-4o"
+):
+    return get_tokenizer(model_name).decode_batch(batch)
 
 
 def pack_user_ass_to_openai_messages(*args: str):
@@ -165,13 +415,26 @@ def is_float_regex(value):
     return bool(re.match(r"^[-+]?[0-9]*\.?[0-9]+$", value))
 
 
-def truncate_list_by_token_size(list_data: list, key: callable, max_token_size: int):
-    """Truncate a list of data by token size"""
+def truncate_list_by_token_size(
+    list_data: list,
+    key: callable,
+    max_token_size: int,
+    token_count: callable = None,
+    model_name: str = "gpt-4o",
+):
+    """Truncate a list of data by token size
+
+    ``token_count(data)`` may return the stored token count of ``key(data)``;
+    items it returns None for are counted.
+    """
     if max_token_size <= 0:
         return []
     tokens = 0
     for i, data in enumerate(list_data):
-        tokens += len(encode_string_by_tiktoken(key(data)))
+        data_tokens = token_count(data) if token_count is not None else None
+        if data_tokens is None:
+            data_tokens = count_tokens(key(data), model_name=model_name)
+        tokens += data_tokens
         if tokens > max_token_size:
             return list_data[:i]
     return list_data
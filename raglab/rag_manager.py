@@ -33,11 +33,9 @@ class RAGManager:
         with open(file_path, 'r', encoding='utf-8') as file:
             unique_contexts = json.load(file)
 
-        start_ctx = 8
-
+        # Already inserted contexts are skipped by LightRAG itself, and a retry
+        # resumes from the ingestion journal instead of starting over.
         for ctx_idx, ctx in enumerate(unique_contexts):
-            if ctx_idx < start_ctx:
-                continue
             retries = 0
             max_retries = self.config_manager.text_insersion_max_retries
             while retries < max_retries:
@@ -0,0 +1,48 @@
+import asyncio
+import tempfile
+
+import lightrag.batch as batch
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# max_chunks_in_flight bounds chunks, also when they are packed several to
+# an extraction request.
+
+WORKING_DIR = tempfile.mkdtemp()
+MAX_CHUNKS = 6
+
+in_flight = {"chunks": 0, "max": 0}
+extract_packed_entities = batch.extract_packed_entities
+
+
+async def counting_extract(group, global_config, journal=None):
+    in_flight["chunks"] += len(group)
+    in_flight["max"] = max(in_flight["max"], in_flight["chunks"])
+    try:
+        await asyncio.sleep(0.01)
+        return await extract_packed_entities(group, global_config, journal=journal)
+    finally:
+        in_flight["chunks"] -= len(group)
+
+
+batch.extract_packed_entities = counting_extract
+
+rag = LightRAG(
+    working_dir=WORKING_DIR,
+    llm_model_func=MockLLM(),
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    chunk_token_size=200,
+    entity_extract_pack_max_chunks=4,
+    entity_extract_pack_max_tokens=100000,
+)
+docs = make_corpus(num_chunks=40, chunks_per_doc=4, chunk_token_size=200)
+results = always_get_an_event_loop().run_until_complete(
+    rag.ainsert_batch(docs, max_docs_in_flight=8, max_chunks_in_flight=MAX_CHUNKS)
+)
+print(f"at most {in_flight['max']} chunks in flight, limit {MAX_CHUNKS}")
+assert all(r.status == "inserted" for r in results), results
+assert in_flight["max"] <= MAX_CHUNKS, in_flight["max"]
+print("ok")
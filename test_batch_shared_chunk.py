@@ -0,0 +1,43 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# Two documents of insert_batch starting with the same chunk: the second
+# waits for the first to insert it, and must insert it itself when the first
+# fails, instead of leaving it never extracted.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+class FailingLLM(MockLLM):
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if self._classify(prompt, system_prompt) == "extract" and "Doomed" in prompt:
+            raise RuntimeError("LLM unavailable")
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+rag = LightRAG(
+    working_dir=WORKING_DIR,
+    llm_model_func=FailingLLM(),
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    chunk_token_size=40,
+    chunk_overlap_token_size=0,
+)
+shared = " ".join(f"Alice met Bob{i} in Paris." for i in range(20))
+docs = [shared + " Doomed met Carol.", shared + " Dave met Erin."]
+results = rag.insert_batch(docs, max_docs_in_flight=2)
+print([r.status for r in results])
+assert [r.status for r in results] == ["failed", "inserted"]
+
+loop = always_get_an_event_loop()
+chunk_ids = loop.run_until_complete(rag.text_chunks.all_keys())
+chunks = loop.run_until_complete(rag.text_chunks.get_by_ids(chunk_ids))
+assert any(dp["content"].startswith("Alice met Bob0") for dp in chunks), (
+    "the shared chunk was never inserted"
+)
+assert rag.chunk_entity_relation_graph._graph.has_node('"BOB0"')
+print("ok")
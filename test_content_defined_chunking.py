@@ -0,0 +1,35 @@
+import random
+
+from lightrag.chunking import content_defined_windows
+
+# Content-defined chunks must respect chunk_token_size with their overlap,
+# and an edit must only move the boundaries next to it.
+
+rng = random.Random(0)
+tokens = [rng.randrange(50000) for _ in range(20000)]
+
+for max_token_size, overlap_token_size in [
+    (1024, 128),
+    (1200, 100),
+    (300, 0),
+    (64, 60),
+]:
+    windows = content_defined_windows(tokens, overlap_token_size, max_token_size)
+    sizes = [end - start for start, end in windows]
+    print(
+        f"{max_token_size}/{overlap_token_size}: {len(windows)} chunks, max {max(sizes)}"
+    )
+    assert max(sizes) <= max_token_size, (max_token_size, max(sizes))
+    assert windows[0][0] == 0 and windows[-1][1] == len(tokens)
+    # every token is in a chunk
+    assert all(b[0] <= a[1] for a, b in zip(windows, windows[1:]))
+
+edited = tokens[:10000] + [rng.randrange(50000) for _ in range(7)] + tokens[10005:]
+before = content_defined_windows(tokens, 128, 1024)
+after = content_defined_windows(edited, 128, 1024)
+chunks_before = {tuple(tokens[start:end]) for start, end in before}
+chunks_after = [tuple(edited[start:end]) for start, end in after]
+changed = sum(chunk not in chunks_before for chunk in chunks_after)
+print(f"{changed} of {len(chunks_after)} chunks changed by the edit")
+assert changed <= 3, changed
+print("ok")
@@ -0,0 +1,45 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc, compute_mdhash_id
+
+# Deleting a document must remove its chunks, vectors and entities even when
+# the chunk settings changed since it was inserted.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+def make_rag(chunk_token_size):
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=MockLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        chunk_token_size=chunk_token_size,
+    )
+
+
+doc = make_corpus(num_chunks=10, chunks_per_doc=10, chunk_token_size=400)[0]
+doc_id = compute_mdhash_id(doc.strip(), prefix="doc-")
+
+rag = make_rag(400)
+rag.insert(doc)
+rag.flush()
+
+rag = make_rag(500)
+loop = always_get_an_event_loop()
+chunk_ids = loop.run_until_complete(rag.text_chunks.all_keys())
+nodes = rag.chunk_entity_relation_graph._graph.number_of_nodes()
+print(f"inserted {len(chunk_ids)} chunks and {nodes} nodes")
+assert chunk_ids and nodes
+
+assert rag.delete_document(doc_id)
+left_chunks = loop.run_until_complete(rag.text_chunks.all_keys())
+left_vectors = loop.run_until_complete(rag.chunks_vdb.query(doc[:200], top_k=10))
+left_nodes = rag.chunk_entity_relation_graph._graph.number_of_nodes()
+print(
+    f"left: {len(left_chunks)} chunks, {len(left_vectors)} vectors, {left_nodes} nodes"
+)
+assert not left_chunks and not left_vectors and not left_nodes
+print("ok")
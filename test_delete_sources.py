@@ -0,0 +1,93 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.prompt import PROMPTS
+from lightrag.utils import EmbeddingFunc, compute_mdhash_id
+
+# Deleting a document rebuilds what it shared with other documents: a node
+# only linked by another document's relationship must lose the description
+# the deleted document gave it, and the summaries of rebuilt descriptions
+# must not hold the merge locks.
+
+WORKING_DIR = tempfile.mkdtemp()
+TD = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+
+
+class DeleteLLM(MockLLM):
+    def __init__(self):
+        super().__init__()
+        self.locks = None
+        self.summaries_under_lock = []
+        self.summaries = []
+
+    def _extraction(self, text):
+        if "Alpha" in text:
+            records = [
+                f'("entity"{TD}"Xeno"{TD}"person"{TD}"Xeno keeps the secret of Alpha.")',
+                f'("entity"{TD}"Hub"{TD}"person"{TD}"Hub was seen in Alpha.")',
+                f'("relationship"{TD}"Xeno"{TD}"Hub"{TD}"Xeno told Hub the Alpha secret."'
+                f'{TD}"secret"{TD}5)',
+            ]
+        else:
+            records = [
+                f'("entity"{TD}"Zed"{TD}"person"{TD}"Zed is mentioned in the text.")',
+                f'("entity"{TD}"Hub"{TD}"person"{TD}"Hub is mentioned in the text.")',
+                f'("relationship"{TD}"Zed"{TD}"Xeno"{TD}"Zed writes to Xeno."'
+                f'{TD}"letters"{TD}5)',
+            ]
+        return (
+            PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+            + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+        )
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if self.locks is not None and self._classify(prompt, system_prompt) == (
+            "summarize"
+        ):
+            entity = prompt.split("Entities:", 1)[1].split("\n", 1)[0].strip()
+            self.summaries.append(entity)
+            if any(lock.locked() for lock in self.locks._locks.values()):
+                self.summaries_under_lock.append(entity)
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+llm = DeleteLLM()
+rag = LightRAG(
+    working_dir=WORKING_DIR,
+    llm_model_func=llm,
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    entity_summary_to_max_tokens=5,
+)
+doc_a = "Alpha document about Xeno and Hub."
+rag.insert(doc_a)
+rag.insert("Beta document about Zed and Hub.")
+
+llm.locks = rag.merge_locks
+upserted = {}
+entities_upsert = rag.entities_vdb.upsert
+
+
+async def recording_upsert(data):
+    upserted.update(data)
+    return await entities_upsert(data)
+
+
+rag.entities_vdb.upsert = recording_upsert
+assert rag.delete_document(compute_mdhash_id(doc_a, prefix="doc-"))
+
+graph = rag.chunk_entity_relation_graph._graph
+xeno = graph.nodes['"XENO"']
+print(f"XENO after the delete: {xeno}")
+print(f"summaries: {llm.summaries}, under a merge lock: {llm.summaries_under_lock}")
+assert "Alpha" not in xeno["description"], xeno
+assert "Alpha" not in graph.nodes['"HUB"']["description"]
+assert not graph.has_edge('"XENO"', '"HUB"')
+assert llm.summaries, "nothing was summarized"
+assert not llm.summaries_under_lock, "summaries ran under merge locks"
+
+ent_id = compute_mdhash_id('"XENO"', prefix="ent-")
+assert ent_id in upserted and "Alpha" not in upserted[ent_id]["content"], upserted
+print("ok")
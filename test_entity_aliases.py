@@ -0,0 +1,85 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM
+from lightrag.prompt import PROMPTS
+from lightrag.utils import EmbeddingFunc
+
+# Spelling variants of an entity are merged into one node, but names that
+# only differ by a number or a letter are different entities, and the nodes
+# of a graph built before aliases were turned on take in new spellings.
+
+
+class NamesLLM(MockLLM):
+    """Extracts the organizations listed after "Names:" in the text"""
+
+    def _extraction(self, text: str) -> str:
+        d = PROMPTS["DEFAULT_TUPLE_DELIMITER"]
+        names = text.split("Names:", 1)[1].split("\n")[0].split(";")
+        records = [
+            f'("entity"{d}"{name.strip()}"{d}"organization"{d}"{name.strip()} is named.")'
+            for name in names
+        ]
+        records += [
+            f'("relationship"{d}"{a.strip()}"{d}"{b.strip()}"{d}"named together"{d}"x"{d}1)'
+            for a, b in zip(names, names[1:])
+        ]
+        return (
+            PROMPTS["DEFAULT_RECORD_DELIMITER"].join(records)
+            + PROMPTS["DEFAULT_COMPLETION_DELIMITER"]
+        )
+
+
+def make_rag(working_dir, **kwargs):
+    return LightRAG(
+        working_dir=working_dir,
+        llm_model_func=NamesLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        **kwargs,
+    )
+
+
+def nodes(rag):
+    return sorted(rag.chunk_entity_relation_graph._graph.nodes)
+
+
+docs = [
+    "Names: OpenAI; Article 1234; John Smithson",
+    "Names: OpenAI Inc.; Article 1235; John Smithsons",
+    "Names: Open AI; Article 1234; John Smithson",
+]
+
+# only spelling variants by default
+rag = make_rag(tempfile.mkdtemp(), enable_entity_aliases=True)
+for doc in docs:
+    rag.insert(doc)
+print(nodes(rag))
+assert nodes(rag) == [
+    '"ARTICLE 1234"',
+    '"ARTICLE 1235"',
+    '"JOHN SMITHSON"',
+    '"JOHN SMITHSONS"',
+    '"OPENAI"',
+]
+
+# fuzzy matches never merge different numbers
+rag = make_rag(
+    tempfile.mkdtemp(),
+    enable_entity_aliases=True,
+    entity_alias_fuzzy_without_embedding=True,
+)
+for doc in docs:
+    rag.insert(doc)
+print(nodes(rag))
+assert '"ARTICLE 1234"' in nodes(rag) and '"ARTICLE 1235"' in nodes(rag)
+
+# a graph built without aliases folds new spellings into its nodes
+working_dir = tempfile.mkdtemp()
+rag = make_rag(working_dir)
+rag.insert(docs[0])
+rag.flush()
+rag = make_rag(working_dir, enable_entity_aliases=True)
+rag.insert(docs[2])
+print(nodes(rag))
+assert nodes(rag) == ['"ARTICLE 1234"', '"JOHN SMITHSON"', '"OPENAI"']
+print("ok")
@@ -0,0 +1,48 @@
+import asyncio
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.utils import EmbeddingFunc
+
+# With a flush policy that skips flushes, the last inserts must still reach
+# the disk: on leaving the instance's context, and by the interval timer
+# without another insert to trigger it.
+
+
+def make_rag(working_dir, **kwargs):
+    return LightRAG(
+        working_dir=working_dir,
+        llm_model_func=MockLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        storage_flush_every_n_inserts=100,
+        **kwargs,
+    )
+
+
+def stored_docs(working_dir) -> int:
+    rag = make_rag(working_dir)
+    return len(asyncio.run(rag.full_docs.all_keys()))
+
+
+docs = make_corpus(num_chunks=4, chunks_per_doc=2, chunk_token_size=200)
+
+working_dir = tempfile.mkdtemp()
+with make_rag(working_dir) as rag:
+    for doc in docs:
+        rag.insert(doc)
+assert stored_docs(working_dir) == len(docs), "the context exit didn't flush"
+
+
+async def insert_and_wait(working_dir):
+    rag = make_rag(working_dir, storage_flush_interval_seconds=0.2)
+    for doc in docs:
+        await rag.ainsert(doc)
+    await asyncio.sleep(0.5)
+    return rag._inserts_since_flush
+
+
+working_dir = tempfile.mkdtemp()
+assert asyncio.run(insert_and_wait(working_dir)) == 0, "the timer didn't flush"
+assert stored_docs(working_dir) == len(docs)
+print("ok")
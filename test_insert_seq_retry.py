@@ -0,0 +1,61 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# insert_seq stores chunks one by one as they are merged: when a chunk fails,
+# a retry must extract it and the chunks after it.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+class FailingLLM(MockLLM):
+    fail_at = None
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if (
+            self._classify(prompt, system_prompt) == "extract"
+            and self.calls["extract"] + 1 == self.fail_at
+        ):
+            raise RuntimeError("LLM unavailable")
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+def make_rag(llm):
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=llm,
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        enable_near_duplicate_filter=True,
+        enable_llm_cache=False,
+        chunk_token_size=200,
+    )
+
+
+doc = make_corpus(num_chunks=6, chunks_per_doc=6, chunk_token_size=200)[0]
+loop = always_get_an_event_loop()
+
+llm = FailingLLM()
+llm.fail_at = 3
+rag = make_rag(llm)
+try:
+    loop.run_until_complete(rag.ainsert_seq(doc))
+    raise AssertionError("the insert should have failed")
+except RuntimeError:
+    pass
+stored = loop.run_until_complete(rag.text_chunks.all_keys())
+print(f"{len(stored)} chunks stored before the failure")
+assert len(stored) == 2, len(stored)
+
+llm = FailingLLM()
+rag = make_rag(llm)
+loop.run_until_complete(rag.ainsert_seq(doc))
+chunk_ids = loop.run_until_complete(rag.text_chunks.all_keys())
+extracted = loop.run_until_complete(rag.chunk_extractions.get_by_ids(chunk_ids))
+print(f"retry: {llm.calls['extract']} extractions, {len(chunk_ids)} chunks")
+assert llm.calls["extract"] > 0, "the retry extracted nothing"
+assert all(record is not None for record in extracted), "chunks were never extracted"
+assert loop.run_until_complete(rag.full_docs.all_keys())
+print("ok")
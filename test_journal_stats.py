@@ -0,0 +1,69 @@
+import os
+import tempfile
+from dataclasses import asdict
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.journal import IngestionJournal
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.operate import extract_packed_entities
+from lightrag.utils import EmbeddingFunc, compute_mdhash_id
+
+# An extraction reused from the journal after a restart must give the chunk
+# the same extraction_rounds and extraction_tokens as the run that made it.
+
+WORKING_DIR = tempfile.mkdtemp()
+JOURNAL = os.path.join(WORKING_DIR, "journal.jsonl")
+
+
+def make_config(llm):
+    rag = LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=llm,
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        enable_llm_cache=False,
+        entity_extract_max_gleaning=1,
+    )
+    return asdict(rag)
+
+
+content = make_corpus(num_chunks=1, chunks_per_doc=1, chunk_token_size=300)[0]
+chunk_key = compute_mdhash_id(content, prefix="chunk-")
+
+
+def make_chunk():
+    return {
+        "content": content,
+        "tokens": 300,
+        "full_doc_id": "doc-1",
+        "chunk_order_index": 0,
+    }
+
+
+loop = always_get_an_event_loop()
+llm = MockLLM()
+first = make_chunk()
+loop.run_until_complete(
+    extract_packed_entities(
+        [(chunk_key, first)], make_config(llm), journal=IngestionJournal(JOURNAL)
+    )
+)
+assert first.get("extraction_rounds"), first
+
+for compact in (False, True):
+    journal = IngestionJournal(JOURNAL)
+    if compact:
+        journal.compact()
+        journal = IngestionJournal(JOURNAL)
+    llm = MockLLM()
+    resumed = make_chunk()
+    loop.run_until_complete(
+        extract_packed_entities(
+            [(chunk_key, resumed)], make_config(llm), journal=journal
+        )
+    )
+    assert llm.calls["extract"] == 0, "the journaled extraction was not reused"
+    assert resumed.get("extraction_rounds") == first["extraction_rounds"], resumed
+    assert resumed.get("extraction_tokens") == first["extraction_tokens"], resumed
+print(f"rounds {first['extraction_rounds']}, tokens {first['extraction_tokens']}")
+print("ok")
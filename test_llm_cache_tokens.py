@@ -0,0 +1,63 @@
+import tempfile
+from functools import partial
+
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.llm import openai_complete_if_cache
+from lightrag.metrics import (
+    InMemoryMetricsCollector,
+    count_llm_tokens,
+    instrument_async_func,
+)
+from lightrag.storage import JsonKVStorage
+from lightrag.utils import compute_args_hash
+
+# An answer served from the LLM response cache costs no tokens: only the
+# calls that miss the cache count prompt and completion tokens.
+
+metrics = InMemoryMetricsCollector()
+cache = JsonKVStorage(
+    namespace="llm_response_cache",
+    global_config={"working_dir": tempfile.mkdtemp(), "metrics_collector": metrics},
+    embedding_func=None,
+)
+model = "gpt-4o-mini"
+messages = [
+    {"role": "system", "content": "You answer questions."},
+    {"role": "user", "content": "Who wrote the story?"},
+]
+
+
+async def fresh_answer(prompt, system_prompt=None, **kwargs):
+    return "A fresh answer."
+
+
+async def main():
+    await cache.upsert(
+        {compute_args_hash(model, messages): {"return": "A cached answer."}}
+    )
+    cached = instrument_async_func(
+        partial(openai_complete_if_cache, model, hashing_kv=cache, api_key="test"),
+        metrics,
+        "llm",
+        count_func=count_llm_tokens,
+    )
+    fresh = instrument_async_func(
+        fresh_answer, metrics, "llm", count_func=count_llm_tokens
+    )
+    for _ in range(3):
+        answer = await cached(
+            "Who wrote the story?", system_prompt="You answer questions."
+        )
+        assert answer == "A cached answer.", answer
+    assert metrics.counter("llm.cache_hit") == 3
+    assert metrics.counter("llm.prompt_tokens") == 0, metrics.snapshot()
+    assert metrics.counter("llm.completion_tokens") == 0, metrics.snapshot()
+    # a miss after the hits still counts its tokens
+    await fresh("Who wrote the story?", system_prompt="You answer questions.")
+    assert metrics.counter("llm.prompt_tokens") > 0, metrics.snapshot()
+    assert metrics.counter("llm.completion_tokens") > 0, metrics.snapshot()
+    assert metrics.counter("llm.calls") == 4
+
+
+always_get_an_event_loop().run_until_complete(main())
+print("ok")
@@ -0,0 +1,41 @@
+import lightrag.utils as utils
+from lightrag import metrics
+from lightrag.metrics import count_llm_tokens
+
+# Gleaning rounds resend the same system prompt and a growing history:
+# counting the tokens of a call must only encode what the call adds.
+
+encoded = []
+encode = utils.encode_string_by_tiktoken
+
+
+def counting_encode(content, model_name="gpt-4o"):
+    encoded.append(content)
+    return encode(content, model_name=model_name)
+
+
+utils.encode_string_by_tiktoken = counting_encode
+if hasattr(metrics, "encode_string_by_tiktoken"):
+    metrics.encode_string_by_tiktoken = counting_encode
+
+system_prompt = "You extract entities. " * 200
+history = []
+for i in range(10):
+    prompt = f"Round {i}: continue the extraction."
+    result = f"Entities of round {i}."
+    encoded.clear()
+    counts = count_llm_tokens(
+        (prompt,),
+        {"system_prompt": system_prompt, "history_messages": list(history)},
+        result,
+    )
+    assert counts["prompt_tokens"] > len(encode(system_prompt)), counts
+    assert counts["completion_tokens"] == len(encode(result)), counts
+    if i > 0:
+        # only the new prompt and the new completion are encoded
+        assert sorted(encoded) == sorted([prompt, result]), encoded
+    history += [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": result},
+    ]
+print("ok")
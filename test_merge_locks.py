@@ -0,0 +1,59 @@
+import asyncio
+import tempfile
+from collections import Counter
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# Inserts sharing an entity must only wait for each other's graph writes:
+# summarizing its grown description must not hold its merge lock, or every
+# insert mentioning a hub entity is serialized behind the LLM.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+class SlowSummaryLLM(MockLLM):
+    def __init__(self):
+        super().__init__()
+        self.summarizing = Counter()
+        self.max_summarizing = Counter()
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if self._classify(prompt, system_prompt) != "summarize":
+            return await super().__call__(prompt, system_prompt, history_messages, **kw)
+        entity = prompt.split("Entities:", 1)[1].split("\n", 1)[0].strip()
+        self.summarizing[entity] += 1
+        self.max_summarizing[entity] = max(
+            self.max_summarizing[entity], self.summarizing[entity]
+        )
+        await asyncio.sleep(0.05)
+        self.summarizing[entity] -= 1
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+llm = SlowSummaryLLM()
+rag = LightRAG(
+    working_dir=WORKING_DIR,
+    llm_model_func=llm,
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    entity_summary_to_max_tokens=10,
+)
+docs = [f"Hub met Person{i} in Place{i}." for i in range(6)]
+
+
+async def main():
+    await asyncio.gather(*[rag.ainsert(doc) for doc in docs])
+
+
+always_get_an_event_loop().run_until_complete(main())
+
+graph = rag.chunk_entity_relation_graph._graph
+hub = graph.nodes['"HUB"']
+overlap = llm.max_summarizing['"HUB"']
+print(f"at most {overlap} summaries of HUB at once")
+assert len(hub["source_id"].split("<SEP>")) == len(docs), hub["source_id"]
+assert overlap > 1, "summaries ran under the merge lock"
+print("ok")
@@ -0,0 +1,60 @@
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# A failed insert must not leave the signatures of its chunks behind: the
+# retry would take every chunk for a near-duplicate of itself and never
+# extract the document.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+class FailingLLM(MockLLM):
+    fail = True
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if self.fail and self._classify(prompt, system_prompt) == "extract":
+            raise RuntimeError("LLM unavailable")
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+def make_rag(llm):
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=llm,
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        enable_near_duplicate_filter=True,
+        enable_llm_cache=False,
+        chunk_token_size=200,
+    )
+
+
+doc = make_corpus(num_chunks=8, chunks_per_doc=8, chunk_token_size=200)[0]
+
+llm = FailingLLM()
+rag = make_rag(llm)
+try:
+    rag.insert(doc)
+    raise AssertionError("the insert should have failed")
+except RuntimeError:
+    pass
+rag.flush()
+
+# retry after a restart, so whatever the failed insert persisted is reloaded
+llm = FailingLLM()
+llm.fail = False
+rag = make_rag(llm)
+rag.insert(doc)
+
+loop = always_get_an_event_loop()
+chunk_ids = loop.run_until_complete(rag.text_chunks.all_keys())
+chunks = loop.run_until_complete(rag.text_chunks.get_by_ids(chunk_ids))
+self_links = [k for k, dp in zip(chunk_ids, chunks) if dp.get("duplicate_of") == k]
+print(f"{len(chunk_ids)} chunks, {llm.calls['extract']} extraction calls")
+assert not self_links, f"chunks linked to themselves: {self_links}"
+assert llm.calls["extract"] > 0, "the retried document was not extracted"
+assert rag.chunk_entity_relation_graph._graph.number_of_nodes() > 0
+print("ok")
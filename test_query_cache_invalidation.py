@@ -0,0 +1,65 @@
+import tempfile
+
+from lightrag import LightRAG, QueryParam
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc, compute_mdhash_id
+
+# A persistent query cache must not serve what it cached before an insert or
+# a delete, even after a restart, even when the change was made by another
+# instance sharing the working directory, and must keep at most
+# query_cache_max_entries entries in its storage.
+
+WORKING_DIR = tempfile.mkdtemp()
+docs = make_corpus(num_chunks=3, chunks_per_doc=1, chunk_token_size=1200)
+
+
+def make_rag(llm, **kwargs):
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=llm,
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        enable_llm_cache=False,
+        query_cache_persistent=True,
+        **kwargs,
+    )
+
+
+def misses(rag, llm, query):
+    before = llm.calls["keywords"]
+    rag.query(query, QueryParam(mode="local"))
+    return llm.calls["keywords"] - before
+
+
+llm = MockLLM()
+rag = make_rag(llm)
+rag.insert(docs[0])
+assert misses(rag, llm, "who is in the text?") == 1
+assert misses(rag, llm, "who is in the text?") == 0
+rag.insert(docs[1])
+assert misses(rag, llm, "who is in the text?") == 1, "served after an insert"
+assert rag.delete_document(compute_mdhash_id(docs[1].strip(), prefix="doc-"))
+assert misses(rag, llm, "who is in the text?") == 1, "served after a delete"
+
+# survives a restart of the same index
+llm = MockLLM()
+rag = make_rag(llm)
+assert misses(rag, llm, "who is in the text?") == 0, "not persisted"
+
+# another instance changes the index while this one keeps caching
+other = make_rag(MockLLM())
+other.insert(docs[2])
+assert misses(rag, llm, "what happened?") == 1
+llm = MockLLM()
+rag = make_rag(llm)
+assert misses(rag, llm, "what happened?") == 1, "served after another insert"
+
+llm = MockLLM()
+rag = make_rag(llm, query_cache_max_entries=2)
+for query in ["one?", "two?", "three?"]:
+    misses(rag, llm, query)
+loop = always_get_an_event_loop()
+stored = loop.run_until_complete(rag.query_cache._storage.all_keys())
+print(f"stored entries: {len(stored)}")
+assert len(stored) <= 2, len(stored)
+print("ok")
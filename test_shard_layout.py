@@ -0,0 +1,37 @@
+import tempfile
+
+from lightrag import LightRAG, QueryParam
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.utils import EmbeddingFunc
+
+# A working directory written without shards must not be opened sharded:
+# the shards would start empty and the stored data would be silently ignored.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+def make_rag(**kwargs):
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=MockLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        **kwargs,
+    )
+
+
+docs = make_corpus(num_chunks=8, chunks_per_doc=4, chunk_token_size=200)
+make_rag().insert(docs)
+try:
+    make_rag(storage_num_shards=4)
+    raise AssertionError("an unsharded working_dir was opened with shards")
+except ValueError as e:
+    print(e)
+
+WORKING_DIR = tempfile.mkdtemp()
+rag = make_rag(storage_num_shards=4)
+rag.insert(docs)
+context = rag.query("Person1", QueryParam(mode="local", only_need_context=True))
+# reopened with the same shard count, shards load lazily in worker threads
+rag = make_rag(storage_num_shards=4)
+assert rag.query("Person1", QueryParam(mode="local", only_need_context=True)) == context
+print("ok")
@@ -0,0 +1,52 @@
+import tempfile
+import time
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.storage import JsonKVStorage, _shard_index
+from lightrag.utils import EmbeddingFunc
+
+# Reading keys of several shards that are not loaded yet loads those shards
+# concurrently, not one after the other.
+
+WORKING_DIR = tempfile.mkdtemp()
+LOAD_SECONDS = 0.2
+
+
+def make_rag():
+    return LightRAG(
+        working_dir=WORKING_DIR,
+        llm_model_func=MockLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        storage_num_shards=4,
+    )
+
+
+loop = always_get_an_event_loop()
+rag = make_rag()
+rag.insert(make_corpus(num_chunks=40, chunks_per_doc=4, chunk_token_size=200))
+chunk_ids = loop.run_until_complete(rag.text_chunks.all_keys())
+assert len({_shard_index(k, 4) for k in chunk_ids}) == 4
+
+post_init = JsonKVStorage.__post_init__
+
+
+def slow_post_init(self):
+    time.sleep(LOAD_SECONDS)
+    post_init(self)
+
+
+JsonKVStorage.__post_init__ = slow_post_init
+for method, args in [
+    ("get_by_ids", (chunk_ids,)),
+    ("filter_keys", (chunk_ids,)),
+    ("delete", (chunk_ids,)),
+]:
+    storage = make_rag().text_chunks
+    start = time.perf_counter()
+    loop.run_until_complete(getattr(storage, method)(*args))
+    elapsed = time.perf_counter() - start
+    print(f"{method}: loaded 4 shards in {elapsed:.2f}s")
+    assert elapsed < 2.5 * LOAD_SECONDS, "shards were loaded one by one"
+print("ok")
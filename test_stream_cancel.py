@@ -0,0 +1,50 @@
+import asyncio
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.lightrag import always_get_an_event_loop
+from lightrag.utils import EmbeddingFunc
+
+# When a worker of ainsert_stream fails, the other workers of the pipeline
+# must be cancelled with it instead of waiting on their queues forever.
+
+WORKING_DIR = tempfile.mkdtemp()
+
+
+class FailingLLM(MockLLM):
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        if self._classify(prompt, system_prompt) == "extract":
+            raise RuntimeError("LLM unavailable")
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+rag = LightRAG(
+    working_dir=WORKING_DIR,
+    llm_model_func=FailingLLM(),
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    pipeline_extract_max_async=16,
+)
+docs = make_corpus(num_chunks=40, chunks_per_doc=4, chunk_token_size=200)
+
+
+async def main():
+    try:
+        await rag.ainsert_stream(docs)
+        raise AssertionError("the insert should have failed")
+    except RuntimeError:
+        pass
+    # let cancelled tasks finish
+    await asyncio.sleep(0)
+    return [
+        task
+        for task in asyncio.all_tasks()
+        if task is not asyncio.current_task() and not task.done()
+    ]
+
+
+leftover = always_get_an_event_loop().run_until_complete(main())
+print(f"{len(leftover)} tasks left after the failed stream")
+assert not leftover, leftover
+print("ok")
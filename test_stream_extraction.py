@@ -0,0 +1,78 @@
+import asyncio
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.metrics import InMemoryMetricsCollector
+from lightrag.utils import EmbeddingFunc
+
+# A streamed extraction call must hold its llm_model_max_async slot until
+# the stream ends and be counted in the metrics with its completion tokens;
+# a model function that can't stream must never get stream=True.
+
+
+class StreamingLLM(MockLLM):
+    supports_stream = True
+
+    def __init__(self):
+        super().__init__()
+        self.streaming = 0
+        self.max_streaming = 0
+
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        stream = kw.pop("stream", False)
+        result = await super().__call__(prompt, system_prompt, history_messages, **kw)
+        if not stream:
+            return result
+
+        async def pieces():
+            self.streaming += 1
+            self.max_streaming = max(self.max_streaming, self.streaming)
+            try:
+                for i in range(0, len(result), 16):
+                    await asyncio.sleep(0.001)
+                    yield result[i : i + 16]
+            finally:
+                self.streaming -= 1
+
+        return pieces()
+
+
+class PlainLLM(MockLLM):
+    async def __call__(self, prompt, system_prompt=None, history_messages=[], **kw):
+        assert "stream" not in kw, "stream=True passed to a non-streaming function"
+        return await super().__call__(prompt, system_prompt, history_messages, **kw)
+
+
+docs = make_corpus(num_chunks=12, chunks_per_doc=4, chunk_token_size=200)
+
+llm = StreamingLLM()
+metrics = InMemoryMetricsCollector()
+rag = LightRAG(
+    working_dir=tempfile.mkdtemp(),
+    llm_model_func=llm,
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    entity_extract_stream=True,
+    llm_model_max_async=2,
+    metrics_collector=metrics,
+)
+rag.insert(docs)
+print(
+    f"at most {llm.max_streaming} streams at once, "
+    f"{metrics.counter('llm.completion_tokens'):.0f} completion tokens"
+)
+assert llm.max_streaming <= 2, llm.max_streaming
+assert metrics.counter("llm.calls") == sum(llm.calls.values())
+assert metrics.counter("llm.completion_tokens") > 0
+
+rag = LightRAG(
+    working_dir=tempfile.mkdtemp(),
+    llm_model_func=PlainLLM(),
+    embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+    enable_llm_cache=False,
+    entity_extract_stream=True,
+)
+assert not rag.entity_extract_stream
+rag.insert(docs)
+print("ok")
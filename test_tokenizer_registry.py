@@ -0,0 +1,41 @@
+import multiprocessing
+import tempfile
+
+from lightrag import LightRAG
+from lightrag.benchmark import MockEmbedding, MockLLM, make_corpus
+from lightrag.utils import EmbeddingFunc, Tokenizer, get_tokenizer, register_tokenizer
+
+# A tokenizer registered in the main process must reach spawned chunking
+# workers, and a model name nothing can tokenize must say how to fix it.
+
+
+class CharTokenizer(Tokenizer):
+    def encode(self, content: str) -> list[int]:
+        return [ord(c) for c in content]
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(chr(t) for t in tokens)
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
+    register_tokenizer("chars", CharTokenizer())
+
+    rag = LightRAG(
+        working_dir=tempfile.mkdtemp(),
+        llm_model_func=MockLLM(),
+        embedding_func=EmbeddingFunc(64, 8192, MockEmbedding()),
+        tiktoken_model_name="chars",
+        chunking_executor="process",
+        chunking_max_workers=2,
+        chunking_parallel_min_chars=0,
+    )
+    rag.insert(make_corpus(num_chunks=8, chunks_per_doc=2, chunk_token_size=200))
+    assert rag.chunk_entity_relation_graph._graph.number_of_nodes() > 0
+
+    try:
+        get_tokenizer("no such model")
+        raise AssertionError("an unknown model name got a tokenizer")
+    except ValueError as e:
+        assert "register_tokenizer" in str(e), e
+    print("ok")